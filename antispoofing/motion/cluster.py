@@ -7,8 +7,20 @@
 """
 
 import sys
-import bob
+import math
 import numpy
+import collections
+from numpy.lib.stride_tricks import as_strided
+
+def ac_sum(res, n):
+  """Returns the sum of the magnitudes of all non-DC coefficients of the FFT of
+  a real signal with ``n`` samples, given the magnitudes of its first ``n/2+1``
+  coefficients (as returned by ``numpy.fft.rfft``). The other coefficients are
+  obtained by symmetry. The last dimension of ``res`` indexes coefficients."""
+
+  retval = 2 * res[...,1:(n+1)//2].sum(axis=-1)
+  if n % 2 == 0: retval = retval + res[...,n//2]
+  return retval
 
 def dcratio(arr):
   """Calculates the DC ratio as defined by the following formula
@@ -16,20 +28,139 @@ def dcratio(arr):
   .. math::
 
     D(N) = \frac{\sum_{i=1}^N{|FFT_i|}}{|FFT_0|}
+
+  Real inputs are treated with a real FFT, so no complex copy of the input is
+  allocated and only half of the coefficients are calculated.
   """
 
   if arr.shape[0] <= 1: return 0.
 
-  res = bob.sp.fft(arr.astype('complex128'))
-  res = numpy.absolute(res) #absolute value
-
-  if res[0] == 0:
+  if numpy.iscomplexobj(arr):
+    import bob
+    res = bob.sp.fft(arr.astype('complex128'))
+    res = numpy.absolute(res) #absolute value
     s = sum(res[1:])
+
+  else:
+    res = numpy.absolute(numpy.fft.rfft(arr))
+    s = ac_sum(res, arr.shape[0])
+
+  return _ratio(res[0], s)
+
+def _ratio(dc, s):
+  """Divides the sum of the AC coefficient magnitudes by the DC one, taking
+  care of the special cases in which the DC component is zero"""
+
+  if dc == 0:
     if s > 0: return sys.float_info.max
     elif s < 0: return -sys.float_info.max
     else: return 0
 
-  return sum(res[1:])/res[0]
+  return s/dc
+
+def dcratio_spectrum(spectrum, n):
+  """Calculates the DC ratio (see :py:func:`dcratio`) of a real signal with
+  ``n`` samples, given its first ``n/2+1`` Fourier coefficients (e.g., as kept
+  by :py:class:`SlidingDFT`)"""
+
+  if n <= 1: return 0.
+
+  res = numpy.absolute(spectrum)
+  return _ratio(res[0], ac_sum(res, n))
+
+def dcratio_windows(obs):
+  """Calculates the DC ratio (see :py:func:`dcratio`) for every row of a 2D
+  real array, using a single batched FFT"""
+
+  if obs.shape[1] <= 1: return numpy.zeros((obs.shape[0],), dtype='float64')
+
+  res = numpy.absolute(numpy.fft.rfft(obs, axis=1))
+  dc = res[:,0]
+  s = ac_sum(res, obs.shape[1])
+
+  old = numpy.seterr(divide='ignore', invalid='ignore')
+  try:
+    retval = s / dc
+  finally:
+    numpy.seterr(**old)
+
+  # special cases, when the DC component is zero
+  zero = numpy.where(s > 0, sys.float_info.max,
+      numpy.where(s < 0, -sys.float_info.max, 0.))
+  return numpy.where(dc == 0, zero, retval)
+
+class SlidingDFT(object):
+  """Keeps the discrete Fourier transform of the last ``window_size`` values
+  of a real signal given one value at a time.
+
+  Instead of calculating an FFT from scratch for every new value, in O(N log
+  N), all coefficients are updated in O(N) with the sliding DFT recursion:
+
+  .. math::
+
+    X_k(n+1) = (X_k(n) - x(n-N+1) + x(n+1)) e^{j 2 \pi k / N}
+
+  Only the first ``N/2+1`` coefficients are kept, as the input is real. To
+  keep numerical drift bounded, the coefficients are re-calculated from
+  scratch (re-anchored) every ``anchor`` values. With the default (once every
+  window length), the coefficients agree with the ones of a direct FFT to
+  within about ``1e-12`` times the magnitude of the input values. Before the
+  window is full, missing values are considered to be zero.
+  """
+
+  def __init__(self, window_size, anchor=None):
+
+    if window_size <= 0:
+      raise RuntimeError, "window-size has to be greater than 0"
+
+    self.window_size = window_size
+    self.anchor = anchor or window_size
+    k = numpy.arange(window_size//2 + 1)
+    self.twiddle = numpy.exp(2j * numpy.pi * k / window_size)
+    self.reset()
+
+  def reset(self):
+    """Resets the state of this object, so a new signal can be treated"""
+
+    self.buffer = numpy.zeros((self.window_size,), dtype='float64')
+    self.spectrum = numpy.zeros(self.twiddle.shape, dtype='complex128')
+    self.index = 0 #number of values received so far
+    self.updates = 0 #number of updates since the last re-anchoring
+
+  def window(self):
+    """Returns the values in the window, from the oldest to the newest"""
+
+    position = self.index % self.window_size
+    return numpy.concatenate((self.buffer[position:], self.buffer[:position]))
+
+  def __call__(self, value):
+    """Adds a new value to the window, updating the coefficients"""
+
+    position = self.index % self.window_size
+    delta = value - self.buffer[position]
+    self.buffer[position] = value
+    self.index += 1
+    self.updates += 1
+
+    if self.updates >= self.anchor:
+      self.spectrum[:] = numpy.fft.rfft(self.window())
+      self.updates = 0
+    else:
+      self.spectrum += delta
+      self.spectrum *= self.twiddle
+
+def window_view(arr, window_size, overlap):
+  """Returns a 2D view of the input 1D array where every row corresponds to one
+  window of the given size. Consecutive windows start ``window_size-overlap``
+  entries apart. No data is copied."""
+
+  step = window_size - overlap
+  count = 0
+  if arr.shape[0] >= window_size:
+    count = ((arr.shape[0] - window_size) // step) + 1
+
+  return as_strided(arr, shape=(count, window_size),
+      strides=(step*arr.strides[0], arr.strides[0]))
 
 def cluster_5quantities(arr, window_size, overlap):
   """Calculates the clustered values as described at the paper:
@@ -53,18 +184,287 @@ def cluster_5quantities(arr, window_size, overlap):
     
     We always ignore the first entry from the input array as, by definition, it 
     is always zero.
+
+  All windows are treated at once, through a (zero-copy) strided view of the
+  input array. NaN values are replaced by the mean of the valid values in their
+  window.
   """
 
-  retval = numpy.ndarray((arr.shape[0], 5), dtype='float64')
+  arr = numpy.asarray(arr, dtype='float64')
+  return _scatter(_window_quantities(arr, window_size, overlap),
+      arr.shape[0], window_size, overlap)
+
+def _missing_prefix(arr):
+  """Returns the prefix sums of the number of NaNs in the input array, with a
+  leading zero, so the number of NaNs in ``arr[a:b]`` is ``p[b] - p[a]``"""
+
+  retval = numpy.zeros((arr.shape[0]+1,), dtype='int64')
+  numpy.isnan(arr).cumsum(out=retval[1:])
+  return retval
+
+def _window_quantities(arr, window_size, overlap, prefix=None):
+  """Calculates the 5 quantities for every window, returning an array with
+  shape ``(windows, 5)``. See :py:func:`cluster_5quantities`.
+
+  If given, ``prefix`` should contain the prefix sums of the number of NaNs in
+  the input array, as returned by :py:func:`_missing_prefix`.
+  """
+
+  obs = window_view(arr, window_size, overlap)
+  if obs.shape[0] == 0: return numpy.ndarray((0, 5), dtype='float64')
+
+  if prefix is None: prefix = _missing_prefix(arr)
+  step = window_size - overlap
+  start = numpy.arange(obs.shape[0]) * step
+  missing = prefix[start + window_size] - prefix[start]
+
+  old = numpy.seterr(divide='ignore', invalid='ignore')
+  try:
+
+    # replace NaN values by set mean so they don't disturb calculations much,
+    # only touching the windows that have NaNs
+    rows = numpy.where(missing > 0)[0]
+    if len(rows):
+      obs = obs.copy()
+      sub = obs[rows]
+      mask = numpy.isnan(sub)
+      mean = numpy.where(mask, 0., sub).sum(axis=1) / \
+          (window_size - missing[rows])
+      obs[rows] = numpy.where(mask, mean[:,numpy.newaxis], sub)
+
+    quantities = (obs.min(axis=1), obs.max(axis=1), obs.mean(axis=1),
+        obs.std(axis=1, ddof=1), dcratio_windows(obs))
+
+  finally:
+    numpy.seterr(**old)
+
+  return numpy.vstack(quantities).T
+
+def _scatter(quantities, length, window_size, overlap):
+  """Places the quantities for every window on the last frame of the
+  respective window, in an array with ``length`` rows filled with NaNs"""
+
+  retval = numpy.ndarray((length, 5), dtype='float64')
   retval[:] = numpy.NaN
+  step = window_size - overlap
+  retval[window_size-1::step][:quantities.shape[0]] = quantities
+  return retval
+
+def _gcd(a, b):
+  """Greatest common divisor of two positive integers"""
+
+  while b: a, b = b, a % b
+  return a
+
+def cluster_5quantities_sweep(arr, configurations):
+  """Calculates the output of :py:func:`cluster_5quantities` for many
+  (window-size, overlap) configurations at once, sharing work between them.
+
+  Windows for configurations with the same window size and different overlaps
+  are all sub-sets of the windows obtained with a step that is the greatest
+  common divisor of their steps. Those are calculated only once, if that is
+  cheaper than treating every configuration on its own. The number of NaNs on
+  every window is obtained from prefix sums shared by all configurations.
+  Results are identical to calling :py:func:`cluster_5quantities` for every
+  configuration.
+
+  Keyword Parameters:
+
+  arr
+    The input 1D array with frame differences
+
+  configurations
+    An iterable of ``(window_size, overlap)`` tuples
+
+  Returns a dictionary with the configurations as keys and the output of
+  :py:func:`cluster_5quantities` for each of them as values.
+  """
+
+  arr = numpy.asarray(arr, dtype='float64')
+  prefix = _missing_prefix(arr)
 
-  for k in range(0, arr.shape[0]-window_size+1, window_size-overlap):
-    obs = arr[k:k+window_size].copy()
+  sizes = {}
+  for window_size, overlap in configurations:
+    sizes.setdefault(window_size, set()).add(overlap)
 
-    # replace NaN values by set mean so they don't disturb calculations much
-    ok = obs[~numpy.isnan(obs)]
-    obs[numpy.isnan(obs)] = ok.mean()
+  retval = {}
+  for window_size, overlaps in sizes.items():
+
+    steps = [window_size - k for k in overlaps]
+    common = reduce(_gcd, steps)
+
+    if len(steps) > 1 and (1./common) <= sum([1./k for k in steps]):
+      shared = _window_quantities(arr, window_size, window_size - common,
+          prefix)
+      for overlap in overlaps:
+        quantities = shared[::(window_size-overlap)//common]
+        retval[(window_size, overlap)] = _scatter(quantities, arr.shape[0],
+            window_size, overlap)
+
+    else:
+      for overlap in overlaps:
+        quantities = _window_quantities(arr, window_size, overlap, prefix)
+        retval[(window_size, overlap)] = _scatter(quantities, arr.shape[0],
+            window_size, overlap)
 
-    retval[k+window_size-1] = \
-        (obs.min(), obs.max(), obs.mean(), obs.std(ddof=1), dcratio(obs))
   return retval
+
+class StreamingQuantities(object):
+  """Calculates the 5 quantities described at :py:func:`cluster_5quantities`
+  online, from frame-difference values given one at a time.
+
+  Windows are defined exactly like in :py:func:`cluster_5quantities`: the first
+  window starts at the first value and the next ones, ``window_size-overlap``
+  values later. Every time a window is complete, the 5 quantities are
+  returned.
+
+  The minimum and maximum are tracked with monotonic queues and the mean and
+  variance with incremental updates as values enter and leave the window, so
+  their cost per frame does not depend on the window size. The DC ratio is
+  calculated from Fourier coefficients kept with :py:class:`SlidingDFT`,
+  which costs O(N) per frame instead of an O(N log N) FFT per window. NaN values are
+  replaced by the mean of the valid values in the window, like in
+  :py:func:`cluster_5quantities`.
+  """
+
+  def __init__(self, window_size, overlap):
+
+    if window_size <= 0:
+      raise RuntimeError, "window-size has to be greater than 0"
+    if overlap >= window_size or overlap < 0:
+      raise RuntimeError, "overlap has to be smaller than window-size and greater or equal zero"
+
+    self.window_size = window_size
+    self.overlap = overlap
+    self.reset()
+
+  def reset(self):
+    """Resets the state of this object, so a new sequence can be treated"""
+
+    self.buffer = numpy.ndarray((self.window_size,), dtype='float64')
+    self.buffer[:] = numpy.NaN
+    self.index = 0 #number of values received so far
+
+    # statistics of the valid (non-NaN) values on the current window
+    self.count = 0
+    self.mean = 0.
+    self.m2 = 0. #sum of squared differences to the mean
+
+    # monotonic queues with (index, value) pairs for the minimum and maximum
+    self.minq = collections.deque()
+    self.maxq = collections.deque()
+
+    # Fourier coefficients of the valid values (with NaNs set to zero) and of
+    # the NaN mask, so we can get the ones for the imputed window at any time
+    self.values = SlidingDFT(self.window_size)
+    self.missing = SlidingDFT(self.window_size)
+
+  def _add(self, index, value):
+    """Adds a valid value to the window statistics"""
+
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+
+    while self.minq and self.minq[-1][1] >= value: self.minq.pop()
+    self.minq.append((index, value))
+    while self.maxq and self.maxq[-1][1] <= value: self.maxq.pop()
+    self.maxq.append((index, value))
+
+  def _remove(self, index, value):
+    """Removes a valid value from the window statistics"""
+
+    if self.count == 1:
+      self.count = 0
+      self.mean = 0.
+      self.m2 = 0.
+    else:
+      self.count -= 1
+      delta = value - self.mean
+      self.mean -= delta / self.count
+      self.m2 -= delta * (value - self.mean)
+      if self.m2 < 0.: self.m2 = 0. #rounding errors
+
+    if self.minq and self.minq[0][0] == index: self.minq.popleft()
+    if self.maxq and self.maxq[0][0] == index: self.maxq.popleft()
+
+  def _recalculate(self):
+    """Re-calculates the mean and variance from the values in the window"""
+
+    valid = self.buffer[~numpy.isnan(self.buffer)]
+    self.count = len(valid)
+    if self.count:
+      self.mean = valid.mean()
+      self.m2 = ((valid - self.mean)**2).sum()
+    else:
+      self.mean = 0.
+      self.m2 = 0.
+
+  def quantities(self):
+    """Returns the 5 quantities for the values currently in the window"""
+
+    if self.count == 0: #same as dcratio() on a window full of NaNs
+      if self.window_size <= 1: return (numpy.NaN,) * 4 + (0.,)
+      return (numpy.NaN,) * 5
+
+    minimum = self.minq[0][1]
+    maximum = self.maxq[0][1]
+
+    if minimum == maximum: #all valid values are equal, avoid rounding errors
+      self.mean = minimum
+      self.m2 = 0.
+
+    if self.window_size > 1:
+      std = math.sqrt(self.m2 / (self.window_size - 1))
+    else:
+      std = numpy.NaN
+
+    # NaN values are replaced by the mean: by linearity, the Fourier
+    # coefficients of the imputed window are those of the valid values plus
+    # the mean times those of the NaN mask. If all values are equal, only the
+    # DC coefficient is non-zero.
+    if minimum == maximum:
+      ratio = 0.
+    else:
+      spectrum = self.values.spectrum
+      if self.count != self.window_size:
+        spectrum = spectrum + self.mean * self.missing.spectrum
+      ratio = dcratio_spectrum(spectrum, self.window_size)
+
+    return (minimum, maximum, self.mean, std, ratio)
+
+  def __call__(self, value):
+    """Adds a new value to the current window.
+
+    Returns the 5 quantities if this value completes a window or None
+    otherwise.
+    """
+
+    index = self.index
+    position = index % self.window_size
+
+    if index >= self.window_size: #the oldest value leaves the window
+      old = self.buffer[position]
+      if not numpy.isnan(old): self._remove(index - self.window_size, old)
+
+    self.buffer[position] = value
+    if numpy.isnan(value):
+      self.values(0.)
+      self.missing(1.)
+    else:
+      self._add(index, value)
+      self.values(value)
+      self.missing(0.)
+    self.index += 1
+
+    # once every window length, re-calculate the mean and variance from
+    # scratch, so rounding errors from the incremental updates cannot pile up.
+    # This only adds a constant cost per frame.
+    if self.index % self.window_size == 0: self._recalculate()
+
+    start = index - self.window_size + 1 #of the current window
+    if start >= 0 and (start % (self.window_size - self.overlap)) == 0:
+      return self.quantities()
+
+    return None
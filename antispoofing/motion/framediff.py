@@ -6,6 +6,8 @@
 """Support methods to compute frame differences in two image sequences.
 """
 
+import numpy
+
 def eval_face_differences(previous, current, facebbx):
   """Evaluates the normalized frame difference on the face region.
 
@@ -90,3 +92,235 @@ def eval_background_differences(previous, current, facebbx, border):
     bg /= float(full_size - face_diff.size)
 
   return bg
+
+def _slice_bounds(start, stop, size):
+  """Returns the effective boundaries numpy would use when slicing an axis of
+  the given size with ``[start:stop]``."""
+
+  start, stop, step = slice(start, stop).indices(size)
+  return start, max(start, stop)
+
+def integral_difference(previous, current):
+  """Calculates the summed-area table of the absolute difference between two
+  frames.
+
+  The returned table has one extra row and column of zeros at the begining, so
+  that the sum of the absolute differences in the region ``[y1:y2, x1:x2]`` is
+  ``T[y2,x2] - T[y1,x2] - T[y2,x1] + T[y1,x1]``. Sums are kept as 64-bit
+  integers and are, therefore, exact.
+
+  Keyword Parameters:
+
+  previous
+    Previous frame as a gray-scaled image
+
+  current
+    The current frame as a gray-scaled image
+  """
+
+  diff = abs(current.astype('int32') - previous.astype('int32'))
+
+  retval = numpy.zeros((diff.shape[0]+1, diff.shape[1]+1), dtype='int64')
+  diff.cumsum(axis=0, dtype='int64', out=retval[1:,1:])
+  retval[1:,1:].cumsum(axis=1, out=retval[1:,1:])
+
+  return retval
+
+def rectangle_sum(table, y1, y2, x1, x2):
+  """Returns the sum of the absolute differences and the number of pixels in
+  the region ``[y1:y2, x1:x2]``, given a summed-area table.
+
+  Boundaries are clipped exactly like numpy does when slicing the original
+  difference image.
+
+  Keyword Parameters:
+
+  table
+    A summed-area table as returned by :py:func:`integral_difference`
+
+  y1, y2, x1, x2
+    The region boundaries, as they would be used for slicing the frames
+  """
+
+  y1, y2 = _slice_bounds(y1, y2, table.shape[0]-1)
+  x1, x2 = _slice_bounds(x1, x2, table.shape[1]-1)
+
+  total = table[y2,x2] - table[y1,x2] - table[y2,x1] + table[y1,x1]
+
+  return total, (y2-y1)*(x2-x1)
+
+def eval_differences(previous, current, facebbx, borders=(None,)):
+  """Evaluates the normalized frame difference on the face region and on the
+  background, for one or more border sizes, in a single pass.
+
+  The absolute difference between both frames is computed only once and
+  integrated into a summed-area table, from which every region energy is
+  obtained in constant time. Results are identical to calling
+  :py:func:`eval_face_differences` and :py:func:`eval_background_differences`
+  (once per border).
+
+  Keyword Parameters:
+
+  previous
+    Previous frame as a gray-scaled image
+
+  current
+    The current frame as a gray-scaled image
+
+  facebbx
+    A valid BoundingBox object containing the coordinates of the face location.
+
+  borders
+    An iterable with the border sizes to consider for the background. A value
+    of None means all image from the face location up to the end.
+
+  Returns a tuple containing the face difference and a list with the
+  background differences, one per border in the order given.
+  """
+
+  table = integral_difference(previous, current)
+  height = table.shape[0] - 1
+  width = table.shape[1] - 1
+
+  face, face_size = rectangle_sum(table, facebbx.y, facebbx.y+facebbx.height,
+      facebbx.x, facebbx.x+facebbx.width)
+
+  backgrounds = []
+
+  for border in borders:
+
+    if border is None:
+      full = table[height, width]
+      full_size = height * width
+
+    else:
+
+      y1 = facebbx.y - border
+      if y1 < 0: y1 = 0
+      x1 = facebbx.x - border
+      if x1 < 0: x1 = 0
+      y2 = y1 + facebbx.height + (2*border)
+      if y2 > height: y2 = height
+      x2 = x1 + facebbx.width + (2*border)
+      if x2 > width: x2 = width
+      full, full_size = rectangle_sum(table, y1, y2, x1, x2)
+
+    bg = full - face
+
+    normalization = float(full_size - face_size)
+    if normalization < 1: #prevents zero division
+      bg = 0.0
+    else:
+      bg /= normalization
+
+    backgrounds.append(bg)
+
+  return face / float(face_size), backgrounds
+
+def bbx_array(locations):
+  """Converts a sequence of face locations into an array of integers with
+  shape ``(T, 5)``, where every row contains the ``(x, y, width, height,
+  valid)`` entries of the respective bounding box. Missing or invalid
+  detections are marked with ``valid == 0``.
+
+  Keyword Parameters:
+
+  locations
+    An iterable with BoundingBox objects (or None), one per frame.
+  """
+
+  retval = numpy.zeros((len(locations), 5), dtype='int64')
+  for k, bbx in enumerate(locations):
+    if bbx and bbx.is_valid():
+      retval[k] = (bbx.x, bbx.y, bbx.width, bbx.height, 1)
+  return retval
+
+def _stack_slice_bounds(start, stop, size):
+  """Vectorized version of :py:func:`_slice_bounds`"""
+
+  start = numpy.where(start < 0, start + size, start).clip(0, size)
+  stop = numpy.where(stop < 0, stop + size, stop).clip(0, size)
+  return start, numpy.maximum(start, stop)
+
+def _stack_rectangle_sum(table, y1, y2, x1, x2):
+  """Vectorized version of :py:func:`rectangle_sum`, for one rectangle per
+  summed-area table in the stack"""
+
+  y1, y2 = _stack_slice_bounds(y1, y2, table.shape[1]-1)
+  x1, x2 = _stack_slice_bounds(x1, x2, table.shape[2]-1)
+  t = numpy.arange(table.shape[0])
+
+  total = table[t,y2,x2] - table[t,y1,x2] - table[t,y2,x1] + table[t,y1,x1]
+
+  return total, (y2-y1)*(x2-x1)
+
+def eval_stack_differences(frames, bbx, border=None):
+  """Evaluates the normalized frame differences on the face region and on the
+  background for a whole stack of frames at once.
+
+  This is equivalent to calling :py:func:`eval_differences` for every pair of
+  consecutive frames, but uses array operations over the time axis instead of
+  a Python loop. Results are identical.
+
+  Keyword Parameters:
+
+  frames
+    A 3D array with shape ``(T, height, width)`` containing the gray-scaled
+    (or LBP encoded) frames
+
+  bbx
+    An integer array with shape ``(T, 5)`` containing, for every frame, the
+    face location as ``(x, y, width, height, valid)``. See
+    :py:func:`bbx_array`.
+
+  border
+    The border size to consider for the background. If set to None, consider
+    all image from the face location up to the end.
+
+  Returns an array with shape ``(T, 2)`` containing the face and background
+  differences for every frame. The first row and rows for which the detection
+  is invalid are set to NaN.
+  """
+
+  retval = numpy.ndarray((frames.shape[0], 2), dtype='float64')
+  retval[:] = numpy.NaN
+  if frames.shape[0] < 2: return retval
+
+  diff = abs(frames[1:].astype('int32') - frames[:-1].astype('int32'))
+
+  table = numpy.zeros((diff.shape[0], diff.shape[1]+1, diff.shape[2]+1),
+      dtype='int64')
+  diff.cumsum(axis=1, dtype='int64', out=table[:,1:,1:])
+  del diff
+  table[:,1:,1:].cumsum(axis=2, out=table[:,1:,1:])
+  height = table.shape[1] - 1
+  width = table.shape[2] - 1
+
+  x, y, w, h, valid = [bbx[1:,k] for k in range(5)]
+
+  face, face_size = _stack_rectangle_sum(table, y, y+h, x, x+w)
+
+  if border is None:
+    full = table[:, height, width]
+    full_size = height * width
+
+  else:
+    y1 = numpy.maximum(y - border, 0)
+    x1 = numpy.maximum(x - border, 0)
+    y2 = numpy.minimum(y1 + h + (2*border), height)
+    x2 = numpy.minimum(x1 + w + (2*border), width)
+    full, full_size = _stack_rectangle_sum(table, y1, y2, x1, x2)
+
+  normalization = (full_size - face_size).astype('float64')
+
+  old = numpy.seterr(divide='ignore', invalid='ignore')
+  try:
+    bg = numpy.where(normalization < 1, 0.0, (full - face) / normalization)
+    face = face / face_size.astype('float64')
+  finally:
+    numpy.seterr(**old)
+
+  retval[1:,0] = numpy.where(valid != 0, face, numpy.NaN)
+  retval[1:,1] = numpy.where(valid != 0, bg, numpy.NaN)
+
+  return retval
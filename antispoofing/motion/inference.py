@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Scoring with trained machines using only NumPy.
+
+A trained MLP or LinearMachine can be exported (see :py:func:`export`) to a
+``.npz`` file, containing:
+
+type
+  Either ``mlp`` or ``linear``
+
+layers
+  The number of layers in the machine
+
+weights_<k>, biases_<k>
+  The weights (with shape ``(inputs, outputs)``) and biases of layer ``k``
+
+activations
+  The name of the activation function of every layer
+
+activation_parameters
+  An array with shape ``(layers, 2)``, containing the parameters of every
+  activation function (``C`` and ``M``, see below)
+
+input_subtract, input_divide
+  The input normalization parameters
+
+Supported activations are ``identity`` (``x``), ``linear`` (``C*x``),
+``tanh``, ``mtanh`` (``M*tanh(C*x)``) and ``logistic``
+(``1/(1+exp(-x))``). Exported machines are loaded with :py:func:`load` and
+evaluated by :py:class:`Machine`, without importing bob.
+"""
+
+import os
+import numpy
+
+_ACTIVATIONS = {
+    'Identity': 'identity',
+    'Linear': 'linear',
+    'HyperbolicTangent': 'tanh',
+    'MultipliedHyperbolicTangent': 'mtanh',
+    'Logistic': 'logistic',
+    # older versions of bob use an enumeration
+    'LINEAR': 'identity',
+    'TANH': 'tanh',
+    'LOG': 'logistic',
+    }
+
+def activation_name(activation):
+  """Returns a tuple ``(name, C, M)`` describing a bob activation function"""
+
+  if hasattr(activation, 'unique_identifier'):
+    key = activation.unique_identifier().split('.')[-1]
+  else:
+    key = str(activation).split('.')[-1]
+
+  if key not in _ACTIVATIONS:
+    raise RuntimeError, "activation function `%s' is not supported" % key
+
+  return (_ACTIVATIONS[key], float(getattr(activation, 'C', 1.)),
+      float(getattr(activation, 'M', 1.)))
+
+def _activate(name, C, M, x):
+  """Applies the activation function, in place, on the given array"""
+
+  if name == 'identity': pass
+  elif name == 'linear': x *= C
+  elif name == 'tanh': numpy.tanh(x, x)
+  elif name == 'mtanh':
+    x *= C
+    numpy.tanh(x, x)
+    x *= M
+  elif name == 'logistic':
+    numpy.negative(x, x)
+    numpy.exp(x, x)
+    x += 1.
+    numpy.reciprocal(x, x)
+  else:
+    raise RuntimeError, "activation function `%s' is not supported" % name
+
+class Machine(object):
+  """A feed-forward machine (MLP or linear) implemented with NumPy.
+
+  The input normalization is folded into the weights and biases of the first
+  layer, so evaluating a batch takes one matrix product per layer.
+
+  Keyword Parameters:
+
+  weights
+    A list with the weights of every layer, each with shape ``(inputs,
+    outputs)``
+
+  biases
+    A list with the biases of every layer
+
+  activations
+    A list with tuples ``(name, C, M)`` describing the activation function
+    of every layer
+
+  input_subtract, input_divide
+    The input normalization parameters
+
+  dtype
+    The floating-point type used in the calculations. ``float32`` is faster
+    on large batches, with a small loss of precision.
+  """
+
+  def __init__(self, weights, biases, activations, input_subtract,
+      input_divide, dtype='float64'):
+
+    if not (len(weights) == len(biases) == len(activations)):
+      raise RuntimeError, "the number of weights, biases and activations should be the same"
+
+    self.weights = [numpy.array(k, dtype='float64') for k in weights]
+    self.biases = [numpy.array(k, dtype='float64') for k in biases]
+    self.activations = [(str(n), float(c), float(m)) for n, c, m in activations]
+    self.input_subtract = numpy.array(input_subtract, dtype='float64')
+    self.input_divide = numpy.array(input_divide, dtype='float64')
+    self.dtype = numpy.dtype(dtype)
+
+    # folds the input normalization into the first layer
+    w = self.weights[0] / self.input_divide[:,numpy.newaxis]
+    b = self.biases[0] - numpy.dot(self.input_subtract, w)
+    self._weights = [w] + self.weights[1:]
+    self._biases = [b] + self.biases[1:]
+    self._weights = [k.astype(self.dtype) for k in self._weights]
+    self._biases = [k.astype(self.dtype) for k in self._biases]
+
+  @property
+  def shape(self):
+    """The number of inputs, followed by the number of outputs of every
+    layer"""
+
+    return (self.weights[0].shape[0],) + \
+        tuple([k.shape[1] for k in self.weights])
+
+  def __call__(self, input, output=None):
+    """Runs the input through the machine.
+
+    Keyword Parameters:
+
+    input
+      A 2D array with one input vector per row (or a single 1D vector)
+
+    output
+      If given, an array with the right shape where to write the results
+
+    Returns the output of the machine, with one row per input.
+    """
+
+    input = numpy.asarray(input, dtype=self.dtype)
+    single = (input.ndim == 1)
+    if single: input = input[numpy.newaxis,:]
+
+    x = input
+    for w, b, (name, C, M) in zip(self._weights, self._biases,
+        self.activations):
+      x = numpy.dot(x, w)
+      x += b
+      _activate(name, C, M, x)
+
+    if single: x = x[0]
+
+    if output is None: return x
+    output[...] = x
+    return output
+
+  def save(self, filename):
+    """Saves the machine in a ``.npz`` file"""
+
+    data = {
+        'type': 'mlp' if len(self.weights) > 1 else 'linear',
+        'layers': len(self.weights),
+        'activations': numpy.array([k[0] for k in self.activations]),
+        'activation_parameters': numpy.array([k[1:] for k in self.activations],
+          dtype='float64'),
+        'input_subtract': self.input_subtract,
+        'input_divide': self.input_divide,
+        }
+
+    for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+      data['weights_%d' % i] = w
+      data['biases_%d' % i] = b
+
+    f = open(filename, 'wb')
+    numpy.savez(f, **data)
+    f.close()
+
+def convert(machine, dtype='float64'):
+  """Converts a bob MLP or LinearMachine into a :py:class:`Machine`"""
+
+  if isinstance(machine.weights, (list, tuple)): #MLP
+    weights = machine.weights
+    biases = machine.biases
+    hidden = getattr(machine, 'hidden_activation', machine.activation)
+    output = getattr(machine, 'output_activation', machine.activation)
+    activations = [activation_name(hidden)] * (len(weights) - 1) + \
+        [activation_name(output)]
+
+  else: #LinearMachine
+    weights = [machine.weights]
+    biases = [machine.biases]
+    activations = [activation_name(machine.activation)]
+
+  return Machine(weights, biases, activations, machine.input_subtract,
+      machine.input_divide, dtype)
+
+def export(machine, filename):
+  """Exports a bob MLP or LinearMachine to a ``.npz`` file"""
+
+  convert(machine).save(filename)
+
+def load(filename, dtype='float64'):
+  """Loads a :py:class:`Machine` from a ``.npz`` file"""
+
+  data = numpy.load(filename)
+
+  layers = int(data['layers'])
+  names = data['activations']
+  parameters = data['activation_parameters']
+
+  return Machine(
+      [data['weights_%d' % k] for k in range(layers)],
+      [data['biases_%d' % k] for k in range(layers)],
+      [(names[k], parameters[k,0], parameters[k,1]) for k in range(layers)],
+      data['input_subtract'],
+      data['input_divide'],
+      dtype,
+      )
+
+def load_machine(filename, dtype='float64'):
+  """Loads a machine for scoring.
+
+  Files with the ``.npz`` extension are loaded with :py:func:`load`, without
+  importing bob. Other files should contain a bob MLP or LinearMachine.
+  """
+
+  if os.path.splitext(filename)[1] == '.npz': return load(filename, dtype)
+
+  import bob
+
+  try:
+    return bob.machine.MLP(bob.io.HDF5File(filename))
+  except Exception:
+    pass
+
+  try:
+    return bob.machine.LinearMachine(bob.io.HDF5File(filename))
+  except Exception:
+    raise RuntimeError, "Cannot load Linear or MLP machine from file %s" % filename
@@ -9,3 +9,10 @@
 from . import rprop
 from . import perf
 from . import time
+from . import stats
+from . import sampler
+from . import nprprop
+from . import search
+from . import checkpoint
+from . import history
+from . import coreset
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Checkpoints of the MLP training state, so long trainings can be resumed
+
+A checkpoint is a single ``.npz`` file with named arrays. It is written to a
+temporary file first and then renamed, so an interrupted run never leaves a
+corrupted checkpoint behind.
+"""
+
+import os
+import numpy
+
+# Training state of every RProp implementation: names of the attributes of
+# the trainer holding one array per layer
+_TRAINERS = {
+    'numpy': ('delta', 'previous'),
+    'bob': ('deltas', 'deltas_bias', 'previous_derivatives',
+      'previous_bias_derivatives'),
+    }
+
+def save(filename, state):
+  """Atomically saves a dictionary of arrays in the given file"""
+
+  tmpfile = '%s.tmp%d' % (filename, os.getpid())
+
+  try:
+    f = open(tmpfile, 'wb')
+    numpy.savez(f, **state)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(tmpfile, filename)
+
+  finally:
+    if os.path.exists(tmpfile): os.unlink(tmpfile)
+
+def load(filename):
+  """Loads a dictionary of arrays saved with :py:func:`save`"""
+
+  f = numpy.load(filename)
+  retval = dict([(k, f[k]) for k in f.files])
+  f.close()
+  return retval
+
+def _list(state, prefix):
+  """Returns the arrays saved as ``<prefix>-0``, ``<prefix>-1``, ..."""
+
+  retval = []
+  while '%s-%d' % (prefix, len(retval)) in state:
+    retval.append(state['%s-%d' % (prefix, len(retval))])
+  return retval
+
+def get_machine(machine, prefix):
+  """Returns the parameters of an MLP (either a ``bob.machine.MLP`` or an
+  :py:class:`antispoofing.motion.ml.nprprop.MLP`) as a dictionary of
+  arrays with names starting with ``prefix``"""
+
+  retval = {
+      prefix + '-input-subtract': numpy.array(machine.input_subtract),
+      prefix + '-input-divide': numpy.array(machine.input_divide),
+      }
+  for k, w in enumerate(machine.weights):
+    retval['%s-weights-%d' % (prefix, k)] = numpy.array(w)
+  for k, b in enumerate(machine.biases):
+    retval['%s-biases-%d' % (prefix, k)] = numpy.array(b)
+  return retval
+
+def set_machine(machine, state, prefix):
+  """Sets the parameters of an MLP from those saved by
+  :py:func:`get_machine`"""
+
+  dtype = getattr(machine, 'dtype', numpy.dtype('float64'))
+  machine.weights = [k.astype(dtype) for k in _list(state, prefix + '-weights')]
+  machine.biases = [k.astype(dtype) for k in _list(state, prefix + '-biases')]
+  machine.input_subtract = state[prefix + '-input-subtract']
+  machine.input_divide = state[prefix + '-input-divide']
+
+def get_trainer(trainer, backend):
+  """Returns the state of an RProp trainer of the given backend (step sizes
+  and previous derivatives) as a dictionary of arrays"""
+
+  retval = {}
+  for name in _TRAINERS[backend]:
+    try:
+      values = getattr(trainer, name)
+    except AttributeError:
+      raise RuntimeError, "the state of the `%s' trainer cannot be saved - use the numpy backend" % backend
+    for k, v in enumerate(values):
+      retval['trainer-%s-%d' % (name, k)] = numpy.array(v)
+  return retval
+
+def set_trainer(trainer, state, backend):
+  """Sets the state of an RProp trainer from that saved by
+  :py:func:`get_trainer`"""
+
+  for name in _TRAINERS[backend]:
+    values = _list(state, 'trainer-' + name)
+    if backend == 'numpy':
+      for current, saved in zip(getattr(trainer, name), values):
+        current[...] = saved
+    else:
+      setattr(trainer, name, values)
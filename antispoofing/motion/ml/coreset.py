@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Reduction of the (redundant) feature rows of a video
+
+With overlapping windows, consecutive rows of the clustered features of a
+video are nearly identical. The methods in this module select a subset of
+the rows of a video, and give each selected row a weight: the number of
+original rows it stands for. Weighted statistics of the reduced set (see
+:py:class:`antispoofing.motion.ml.stats.Accumulator`) approximate those of
+the original one.
+
+All methods take a 2D array of valid rows (without NaNs) and return a tuple
+``(index, weights)`` with the positions of the selected rows, in increasing
+order, and their weights, which sum up to the number of rows.
+"""
+
+import numpy
+
+METHODS = ('stride', 'quantize', 'kcenter')
+
+def stride(data, step):
+  """Keeps one row every ``step`` rows. Each row stands for itself and the
+  rows skipped after it."""
+
+  if step != int(step) or step < 1:
+    raise RuntimeError, "the stride (%g) should be an integer greater than zero" % step
+  step = int(step)
+
+  index = numpy.arange(0, len(data), step, dtype='int64')
+  weights = numpy.diff(numpy.append(index, len(data))).astype('float64')
+  return index, weights
+
+def _scale(data, scale):
+  """Divides the data by the scale of every feature, if one is given"""
+
+  data = numpy.asarray(data, dtype='float64')
+  if scale is None: return data
+  return data / scale
+
+def quantize(data, resolution, scale=None):
+  """Keeps a single row amongst those that fall in the same cell of a
+  regular grid with the given resolution. The first row of each cell stands
+  for all rows in it.
+
+  If given, the features are divided by ``scale`` (e.g. their standard
+  deviation) before quantization, so the resolution applies to all features
+  alike.
+  """
+
+  if resolution <= 0:
+    raise RuntimeError, "the resolution (%g) should be greater than zero" % resolution
+
+  if len(data) == 0:
+    return numpy.ndarray((0,), 'int64'), numpy.ndarray((0,), 'float64')
+
+  cells = numpy.floor(_scale(data, scale) / resolution).astype('int64')
+
+  # sorts rows by cell (keeping their original order within each cell), so
+  # rows in the same cell are consecutive
+  order = numpy.lexsort(cells.T[::-1])
+  cells = cells[order]
+  first = numpy.ones((len(cells),), dtype=bool)
+  first[1:] = (cells[1:] != cells[:-1]).any(axis=1)
+  start = numpy.where(first)[0]
+
+  index = order[start]
+  weights = numpy.diff(numpy.append(start, len(cells))).astype('float64')
+  order = numpy.argsort(index)
+  return index[order].astype('int64'), weights[order]
+
+def kcenter(data, radius, scale=None, size=0):
+  """Greedy k-center selection: starting from the first row, the row that is
+  the farthest from all rows selected so far is selected next, until every
+  row is within ``radius`` of a selected one (or ``size`` rows were
+  selected, if it is given). Each selected row stands for all rows that are
+  closest to it.
+
+  If given, the features are divided by ``scale`` (e.g. their standard
+  deviation) before calculating distances.
+  """
+
+  if radius < 0:
+    raise RuntimeError, "the radius (%g) cannot be negative" % radius
+
+  if len(data) == 0:
+    return numpy.ndarray((0,), 'int64'), numpy.ndarray((0,), 'float64')
+
+  data = _scale(data, scale)
+  centers = [0]
+  label = numpy.zeros((len(data),), dtype='int64')
+  distance = numpy.sqrt(((data - data[0])**2).sum(axis=1))
+
+  while distance.max() > radius and (size <= 0 or len(centers) < size):
+    k = int(distance.argmax())
+    candidate = numpy.sqrt(((data - data[k])**2).sum(axis=1))
+    closer = candidate < distance
+    label[closer] = len(centers)
+    distance[closer] = candidate[closer]
+    centers.append(k)
+
+  weights = numpy.bincount(label, minlength=len(centers)).astype('float64')
+  centers = numpy.array(centers, dtype='int64')
+  order = numpy.argsort(centers)
+  return centers[order], weights[order]
+
+def select(data, method, parameter, scale=None, size=0):
+  """Selects a weighted subset of the given rows with one of the
+  :py:data:`METHODS`.
+
+  Keyword Parameters:
+
+  data
+    A 2D array with the (valid) rows of a video
+
+  method
+    The name of the method to use
+
+  parameter
+    The step of ``stride``, the resolution of ``quantize`` or the radius of
+    ``kcenter``
+
+  scale
+    If given, the scale of every feature, used by ``quantize`` and
+    ``kcenter``
+
+  size
+    If greater than zero, the maximum number of rows kept by ``kcenter``
+
+  Returns a tuple ``(index, weights)``.
+  """
+
+  if method == 'stride': return stride(data, parameter)
+  elif method == 'quantize': return quantize(data, parameter, scale)
+  elif method == 'kcenter': return kcenter(data, parameter, scale, size)
+
+  raise RuntimeError, "reduction method `%s' is not supported - use one of %s" % (method, ', '.join(METHODS))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Append-only logs of the training evolution
+
+A log starts with a single text line with a signature, the format version
+and the (comma-separated) names of its columns, padded with spaces to a
+multiple of 8 bytes. Rows follow as little-endian ``float64`` values, one per
+column. Since rows have a fixed size and are only appended, a log can be read
+while it is being written: an incomplete last row is simply ignored.
+"""
+
+import os
+import numpy
+
+SIGNATURE = 'MOTIONLOG'
+VERSION = 1
+DTYPE = numpy.dtype('<f8')
+
+def _header(columns):
+  """Returns the header of a log with the given columns"""
+
+  retval = '%s %d %s' % (SIGNATURE, VERSION, ','.join(columns))
+  return retval + ' ' * (7 - len(retval) % 8) + '\n'
+
+def _read_header(f):
+  """Reads the header of a log. Returns the list of columns."""
+
+  line = f.readline()
+  fields = line.split()
+  if len(fields) != 3 or fields[0] != SIGNATURE or not line.endswith('\n'):
+    raise RuntimeError, "`%s' is not a training evolution log" % f.name
+  if int(fields[1]) != VERSION:
+    raise RuntimeError, "version %s of the training evolution log `%s' is not supported" % (fields[1], f.name)
+  return fields[2].split(',')
+
+class Writer(object):
+  """Appends rows to a log, keeping at most ``buffer_size`` rows in memory
+  before writing them to the file.
+
+  Keyword Parameters:
+
+  filename
+    The name of the log file
+
+  columns
+    A list with the names of the columns
+
+  buffer_size
+    The maximum number of rows kept in memory. With the default, every row
+    is written as soon as it is appended, so readers never lag behind and a
+    crash loses no rows. Larger values write less often.
+
+  append
+    If set and the file exists, new rows are appended to it. Otherwise, the
+    file is (re-)created.
+  """
+
+  def __init__(self, filename, columns, buffer_size=1, append=False):
+
+    self.filename = filename
+    self.columns = list(columns)
+    self.buffer = numpy.ndarray((max(buffer_size, 1), len(columns)),
+        dtype=DTYPE)
+    self.pending = 0
+
+    if append and os.path.exists(filename):
+      self.file = open(filename, 'r+b')
+      existing = _read_header(self.file)
+      if existing != self.columns:
+        raise RuntimeError, "columns of the training evolution log `%s' (%s) differ from the expected ones (%s)" % (filename, ','.join(existing), ','.join(self.columns))
+      self.offset = self.file.tell()
+      self.file.seek(0, os.SEEK_END)
+    else:
+      self.file = open(filename, 'wb')
+      self.file.write(_header(self.columns))
+      self.offset = self.file.tell()
+      self.file.flush()
+
+  def append(self, row):
+    """Appends a row, given in the order of the columns"""
+
+    self.buffer[self.pending] = row
+    self.pending += 1
+    if self.pending == len(self.buffer): self.flush()
+
+  def flush(self):
+    """Writes all buffered rows to the file"""
+
+    if self.file.closed: return
+    if self.pending:
+      self.file.write(self.buffer[:self.pending].tostring())
+      self.pending = 0
+    self.file.flush()
+
+  def truncate(self, rows):
+    """Keeps only the first rows of the log, dropping any buffered rows. New
+    rows are appended after those."""
+
+    self.pending = 0
+    self.file.flush()
+    self.file.truncate(self.offset + rows * len(self.columns) * DTYPE.itemsize)
+    self.file.seek(0, os.SEEK_END)
+
+  def close(self):
+    """Writes all buffered rows and closes the file"""
+
+    if self.file.closed: return
+    self.flush()
+    self.file.close()
+
+def read(filename):
+  """Reads all the complete rows of a log, which may still be growing.
+  Returns a dictionary with one array per column."""
+
+  f = open(filename, 'rb')
+  try:
+    columns = _read_header(f)
+    data = f.read()
+  finally:
+    f.close()
+
+  width = len(columns) * DTYPE.itemsize
+  rows = len(data) // width
+  data = numpy.frombuffer(data[:rows*width], dtype=DTYPE).reshape(rows,
+      len(columns))
+
+  return dict([(k, data[:,i].copy()) for i, k in enumerate(columns)])
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Trains an MLP using RProp, implemented with NumPy
+
+This is an alternative to ``bob.trainer.MLPRPropTrainer`` for MLPs with a
+single hidden layer and hyperbolic tangent activations, trained to minimize
+the square error. Gradients for a whole mini-batch are calculated with a few
+matrix products, so they profit from multi-threaded BLAS implementations. All
+temporary arrays are allocated only once.
+"""
+
+import numpy
+
+class MLP(object):
+  """A multi-layer perceptron with a single hidden layer and hyperbolic
+  tangent activations, that can be trained by :py:class:`RPropTrainer`.
+
+  Keyword Parameters:
+
+  shape
+    A tuple with the number of inputs, hidden neurons and outputs
+
+  dtype
+    The floating-point type used for the weights and calculations
+
+  rng
+    A ``numpy.random.RandomState`` used to initialize the weights and biases
+    uniformly in ``[-0.1, 0.1]``, like ``bob.machine.MLP.randomize()``. If
+    not given, a new one is created.
+  """
+
+  def __init__(self, shape, dtype='float64', rng=None):
+
+    if len(shape) != 3:
+      raise RuntimeError, "only MLPs with a single hidden layer are supported, not shape %s" % (shape,)
+
+    if rng is None: rng = numpy.random.RandomState()
+
+    self.dtype = numpy.dtype(dtype)
+    self.weights = [
+        rng.uniform(-0.1, 0.1, (shape[0], shape[1])).astype(self.dtype),
+        rng.uniform(-0.1, 0.1, (shape[1], shape[2])).astype(self.dtype),
+        ]
+    self.biases = [
+        rng.uniform(-0.1, 0.1, (shape[1],)).astype(self.dtype),
+        rng.uniform(-0.1, 0.1, (shape[2],)).astype(self.dtype),
+        ]
+    self.input_subtract = numpy.zeros((shape[0],), dtype='float64')
+    self.input_divide = numpy.ones((shape[0],), dtype='float64')
+
+  @property
+  def shape(self):
+    return (self.weights[0].shape[0], self.weights[0].shape[1],
+        self.weights[1].shape[1])
+
+  def copy(self):
+    """Returns a deep copy of this machine"""
+
+    retval = MLP.__new__(MLP)
+    retval.dtype = self.dtype
+    retval.weights = [k.copy() for k in self.weights]
+    retval.biases = [k.copy() for k in self.biases]
+    retval.input_subtract = self.input_subtract.copy()
+    retval.input_divide = self.input_divide.copy()
+    return retval
+
+  def __call__(self, input, output=None):
+    """Runs the (un-normalized) input through the machine. If given, the
+    results are written in ``output``."""
+
+    x = (numpy.asarray(input) - self.input_subtract) / self.input_divide
+    x = numpy.tanh(numpy.dot(x.astype(self.dtype), self.weights[0]) + \
+        self.biases[0])
+    x = numpy.tanh(numpy.dot(x, self.weights[1]) + self.biases[1])
+
+    if output is None: return x
+    output[...] = x
+    return output
+
+  def to_bob(self):
+    """Returns an equivalent ``bob.machine.MLP``"""
+
+    import bob
+
+    machine = bob.machine.MLP(self.shape)
+    machine.activation = bob.machine.HyperbolicTangentActivation()
+    machine.weights = [k.astype('float64') for k in self.weights]
+    machine.biases = [k.astype('float64') for k in self.biases]
+    machine.input_subtract = self.input_subtract
+    machine.input_divide = self.input_divide
+    return machine
+
+class RPropTrainer(object):
+  """Trains a :py:class:`MLP` with resilient back-propagation.
+
+  The update rule and its constants are the same as in
+  ``bob.trainer.MLPRPropTrainer``: the step of every weight grows by ``eta+``
+  while the sign of its derivative is kept, and shrinks by ``eta-`` (skipping
+  the update) when it changes. Derivatives are averaged over the mini-batch.
+  Inputs given to :py:meth:`train` should already be normalized.
+
+  Keyword Parameters:
+
+  machine
+    The :py:class:`MLP` to be trained
+
+  batch_size
+    The number of samples in every mini-batch
+  """
+
+  eta_minus = 0.5
+  eta_plus = 1.2
+  delta_zero = 0.1
+  delta_min = 1e-6
+  delta_max = 50.
+
+  def __init__(self, machine, batch_size):
+
+    dtype = machine.dtype
+    inputs, hidden, outputs = machine.shape
+    self.batch_size = batch_size
+
+    # training state, one entry per weight and bias array
+    parameters = machine.weights + machine.biases
+    self.delta = [numpy.ones_like(k) * self.delta_zero for k in parameters]
+    self.previous = [numpy.zeros_like(k) for k in parameters]
+
+    # temporary arrays
+    self.derivative = [numpy.zeros_like(k) for k in parameters]
+    self.product = [numpy.zeros_like(k) for k in parameters]
+    self.factor = [numpy.zeros_like(k) for k in parameters]
+    self.increase = [numpy.zeros(k.shape, dtype=bool) for k in parameters]
+    self.decrease = [numpy.zeros(k.shape, dtype=bool) for k in parameters]
+
+    self.input = numpy.zeros((batch_size, inputs), dtype=dtype)
+    self.target = numpy.zeros((batch_size, outputs), dtype=dtype)
+    self.hidden = numpy.zeros((batch_size, hidden), dtype=dtype)
+    self.output = numpy.zeros((batch_size, outputs), dtype=dtype)
+    self.hidden_error = numpy.zeros((batch_size, hidden), dtype=dtype)
+    self.output_error = numpy.zeros((batch_size, outputs), dtype=dtype)
+    self.tmp_hidden = numpy.zeros((batch_size, hidden), dtype=dtype)
+
+  def gradients(self, machine, input, target, average=True):
+    """Calculates the derivatives of the square error with respect to all
+    weights and biases, averaged over the mini-batch, storing them in
+    ``self.derivative``. If ``average`` is not set, the derivatives are
+    summed instead. Returns the derivatives."""
+
+    self.input[...] = input
+    self.target[...] = target
+
+    # forward step
+    numpy.dot(self.input, machine.weights[0], out=self.hidden)
+    self.hidden += machine.biases[0]
+    numpy.tanh(self.hidden, self.hidden)
+    numpy.dot(self.hidden, machine.weights[1], out=self.output)
+    self.output += machine.biases[1]
+    numpy.tanh(self.output, self.output)
+
+    # backward step: error * f'(a), with f'(a) = 1 - f(a)^2 for tanh
+    numpy.subtract(self.output, self.target, self.output_error)
+    numpy.square(self.output, self.target) #target is not needed anymore
+    numpy.subtract(1., self.target, self.target)
+    self.output_error *= self.target
+
+    numpy.dot(self.output_error, machine.weights[1].T, out=self.hidden_error)
+    numpy.square(self.hidden, self.tmp_hidden)
+    numpy.subtract(1., self.tmp_hidden, self.tmp_hidden)
+    self.hidden_error *= self.tmp_hidden
+
+    d = self.derivative
+    numpy.dot(self.input.T, self.hidden_error, out=d[0])
+    numpy.dot(self.hidden.T, self.output_error, out=d[1])
+    self.hidden_error.sum(axis=0, out=d[2])
+    self.output_error.sum(axis=0, out=d[3])
+    if average:
+      scale = 1. / len(self.input)
+      for k in d: k *= scale
+
+    return d
+
+  def update(self, machine, derivative=None):
+    """Updates the weights and biases of the machine using the RProp rule.
+    If not given, the derivatives calculated by the last call to
+    :py:meth:`gradients` are used."""
+
+    if derivative is None: derivative = self.derivative
+
+    parameters = machine.weights + machine.biases
+
+    for k, w in enumerate(parameters):
+
+      d = derivative[k]
+      product = self.product[k]
+      increase = self.increase[k]
+      decrease = self.decrease[k]
+      factor = self.factor[k]
+      delta = self.delta[k]
+
+      numpy.multiply(self.previous[k], d, product)
+      numpy.greater(product, 0, increase)
+      numpy.less(product, 0, decrease)
+
+      # factor = 1 + (eta+ - 1) * increase + (eta- - 1) * decrease
+      numpy.multiply(increase, self.eta_plus - 1., factor)
+      factor += 1.
+      numpy.multiply(decrease, self.eta_minus - 1., product)
+      factor += product
+      delta *= factor
+      numpy.clip(delta, self.delta_min, self.delta_max, delta)
+
+      # derivatives that changed sign do not update the weights and are
+      # forgotten for the next step
+      numpy.logical_not(decrease, increase)
+      numpy.multiply(d, increase, self.previous[k])
+
+      numpy.sign(self.previous[k], product)
+      product *= delta
+      w -= product
+
+  def train(self, machine, input, target):
+    """Trains the machine for one step with the given mini-batch"""
+
+    self.gradients(machine, input, target)
+    self.update(machine)
+
+def _shared(shape, dtype):
+  """Returns an array of the given shape and type in shared memory"""
+
+  import multiprocessing
+
+  dtype = numpy.dtype(dtype)
+  size = int(numpy.prod(shape))
+  buffer = multiprocessing.RawArray('b', max(size * dtype.itemsize, 1))
+  return numpy.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+def _worker(connection, machine, input, target, derivative):
+  """Calculates the summed derivatives of a shard of the mini-batch every
+  time the coordinator asks for it, until it sends ``None``"""
+
+  trainer = RPropTrainer(machine, len(input))
+
+  while True:
+    if connection.recv() is None: break
+    try:
+      trainer.gradients(machine, input, target, average=False)
+      for shared, partial in zip(derivative, trainer.derivative):
+        shared[...] = partial
+      connection.send(True)
+    except Exception, e:
+      connection.send('%s: %s' % (type(e).__name__, e))
+
+  connection.close()
+
+class ParallelTrainer(RPropTrainer):
+  """Trains a :py:class:`MLP` with resilient back-propagation, calculating
+  the derivatives of every mini-batch in many processes.
+
+  The mini-batch is copied to shared memory and split in contiguous shards,
+  one per worker process. Each worker sums the derivatives of its shard and
+  the coordinator adds all partial sums before applying the RProp update.
+  The results are the same as those of :py:class:`RPropTrainer`, up to the
+  order of the floating-point summations. As workers share the mini-batch
+  with the coordinator, this mainly pays off for large mini-batches. Set
+  ``OMP_NUM_THREADS=1`` (or the equivalent for your BLAS implementation) to
+  avoid running more threads than cores.
+
+  Keyword Parameters:
+
+  machine
+    The :py:class:`MLP` to be trained
+
+  batch_size
+    The number of samples in every mini-batch
+
+  jobs
+    The number of worker processes. It is limited to the mini-batch size.
+
+  Workers are forked on construction and should be stopped with
+  :py:meth:`close`.
+  """
+
+  def __init__(self, machine, batch_size, jobs):
+
+    import multiprocessing
+
+    RPropTrainer.__init__(self, machine, batch_size)
+
+    dtype = machine.dtype
+    jobs = max(min(jobs, batch_size), 1)
+
+    # shared memory, written by the coordinator (parameters and mini-batch)
+    # or the workers (partial derivatives)
+    self.shared_parameters = [_shared(k.shape, dtype) for k in \
+        machine.weights + machine.biases]
+    self.shared_input = _shared(self.input.shape, dtype)
+    self.shared_target = _shared(self.target.shape, dtype)
+
+    shared_machine = MLP.__new__(MLP)
+    shared_machine.dtype = dtype
+    shared_machine.weights = self.shared_parameters[:2]
+    shared_machine.biases = self.shared_parameters[2:]
+    shared_machine.input_subtract = machine.input_subtract
+    shared_machine.input_divide = machine.input_divide
+
+    bounds = numpy.linspace(0, batch_size, jobs + 1).astype('int64')
+    self.partial = []
+    self.connections = []
+    self.workers = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+      derivative = [_shared(k.shape, dtype) for k in self.derivative]
+      parent, child = multiprocessing.Pipe()
+      worker = multiprocessing.Process(target=_worker, args=(child,
+        shared_machine, self.shared_input[start:stop],
+        self.shared_target[start:stop], derivative))
+      worker.daemon = True
+      worker.start()
+      child.close()
+      self.partial.append(derivative)
+      self.connections.append(parent)
+      self.workers.append(worker)
+
+  def gradients(self, machine, input, target, average=True):
+    """Calculates the derivatives of the square error with respect to all
+    weights and biases using the worker processes, storing them in
+    ``self.derivative``. Returns the derivatives."""
+
+    if not self.workers:
+      raise RuntimeError, "the workers of this trainer were already stopped"
+
+    for shared, parameter in zip(self.shared_parameters,
+        machine.weights + machine.biases):
+      shared[...] = parameter
+    self.shared_input[...] = input
+    self.shared_target[...] = target
+
+    for connection in self.connections: connection.send(True)
+    errors = [k.recv() for k in self.connections]
+    errors = [k for k in errors if k is not True]
+    if errors:
+      raise RuntimeError, "gradient calculation failed on %d worker(s): %s" % (len(errors), errors[0])
+
+    for k, d in enumerate(self.derivative):
+      d[...] = self.partial[0][k]
+      for partial in self.partial[1:]: d += partial[k]
+      if average: d *= 1. / len(self.shared_input)
+
+    return self.derivative
+
+  def close(self):
+    """Stops the worker processes"""
+
+    for connection in self.connections:
+      connection.send(None)
+      connection.close()
+    for worker in self.workers: worker.join()
+    self.connections = []
+    self.workers = []
@@ -313,10 +313,16 @@ def epc(test, devel, npoints):
   mpl.grid(True, alpha=0.3)
 
 def plot_rmse_evolution(data):
-  """Performance evolution during training"""
+  """Performance evolution during training. ``data`` is either a dictionary
+  with the training evolution or the name of a training evolution log, which
+  may still be growing (see :py:mod:`antispoofing.motion.ml.history`)."""
 
   import matplotlib.pyplot as mpl
 
+  if isinstance(data, (str, unicode)):
+    from . import history
+    data = history.read(data)
+
   mpl.plot(data['epoch'], data['real-train-rmse'], color='green',
     linestyle='--', dashes=(6,2), alpha=0.5, label='Real Access (train)')
   mpl.plot(data['epoch'], data['attack-train-rmse'], color='blue',
@@ -346,10 +352,16 @@ def plot_rmse_evolution(data):
   mpl.setp(ltext, fontsize='small')
 
 def plot_eer_evolution(data):
-  """Performance evolution during training"""
+  """Performance evolution during training. ``data`` is either a dictionary
+  with the training evolution or the name of a training evolution log, which
+  may still be growing (see :py:mod:`antispoofing.motion.ml.history`)."""
 
   import matplotlib.pyplot as mpl
 
+  if isinstance(data, (str, unicode)):
+    from . import history
+    data = history.read(data)
+
   train = [50*sum(k) for k in zip(data['train-frr'], data['train-far'])]
   mpl.plot(data['epoch'], train, color='black', alpha=0.6,
     linestyle='--', dashes=(6,2), label='EER (train)')
@@ -6,20 +6,59 @@
 """Trains an MLP using RProp
 """
 
+import os
 import sys
 import bob
 import numpy
+import datetime
 import numpy.linalg as la
 from . import perf
 
+def forward(machine, data, output, chunk_size=65536):
+  """Runs the data through the machine, writing the results in ``output``.
+  Data that is not an array (e.g. a
+  :py:class:`antispoofing.motion.storage.Rows` view) is read and run
+  ``chunk_size`` rows at a time."""
+
+  if isinstance(data, numpy.ndarray):
+    machine(data, output)
+    return
+
+  for start in range(0, len(data), chunk_size):
+    stop = min(start + chunk_size, len(data))
+    machine(data[start:stop], output[start:stop])
+
 class Analyzer:
-  """Can analyze results in the end of a run. It can also save itself"""
+  """Can analyze results in the end of a run. It can also save itself
+
+  Evaluating the machine on the complete training and development sets may
+  cost more than the training steps between evaluations. If ``subsample`` is
+  set, most evaluations only use a fixed random subset of (at most) that
+  many samples of each class of each set, and the complete sets are only
+  used every ``full_every`` evaluations (including the first one). Whether
+  each evaluation was complete is recorded in ``data['full']``.
+
+  If a ``history`` log writer is given (see
+  :py:class:`antispoofing.motion.ml.history.Writer`), every evaluation is
+  appended to it and ``data`` only keeps the last one, so the memory used
+  does not grow with the number of evaluations. The complete evolution is
+  returned by :py:meth:`curves`.
+
+  The training set may be given as
+  :py:class:`antispoofing.motion.storage.Rows` views, which are evaluated
+  in chunks and never loaded as a whole.
+  """
+
+  COLUMNS = ('epoch', 'real-train-rmse', 'attack-train-rmse',
+      'real-devel-rmse', 'attack-devel-rmse', 'train-far', 'train-frr',
+      'devel-far', 'devel-frr', 'full')
 
   def gentargets(self, data, target):
     t = numpy.vstack(data.shape[0] * (target,))
     return t, numpy.empty_like(t)
 
-  def __init__(self, train, devel, target):
+  def __init__(self, train, devel, target, subsample=0, full_every=1,
+      seed=0, history=None):
 
     self.train = train
     self.devel = devel
@@ -35,6 +74,28 @@ class Analyzer:
     self.devel_target = (real_devel[0], attack_devel[0])
     self.devel_output = (real_devel[1], attack_devel[1])
 
+    self.full_every = max(full_every, 1)
+    self.subset = None
+    if subsample > 0:
+      rng = numpy.random.RandomState(seed)
+      def pick(data):
+        if len(data) <= subsample: return data
+        return data[numpy.sort(rng.permutation(len(data))[:subsample])]
+      train = tuple([pick(k) for k in train])
+      devel = tuple([pick(k) for k in devel])
+      real_train = self.gentargets(train[0], target[0])
+      attack_train = self.gentargets(train[1], target[1])
+      real_devel = self.gentargets(devel[0], target[0])
+      attack_devel = self.gentargets(devel[1], target[1])
+      self.subset = {
+          'train': train,
+          'devel': devel,
+          'train-target': (real_train[0], attack_train[0]),
+          'train-output': (real_train[1], attack_train[1]),
+          'devel-target': (real_devel[0], attack_devel[0]),
+          'devel-output': (real_devel[1], attack_devel[1]),
+          }
+
     self.data = {} #where to store variables that will be saved
     self.data['epoch'] = []
     self.data['real-train-rmse'] = []
@@ -45,32 +106,58 @@ class Analyzer:
     self.data['train-frr'] = []
     self.data['devel-far'] = []
     self.data['devel-frr'] = []
+    self.data['full'] = []
+
+    self.count = 0 #number of evaluations so far
+    self.history = history
+
+  def is_full(self):
+    """Tells if the last evaluation used the complete data sets"""
+
+    return not self.data['full'] or bool(self.data['full'][-1])
 
-  def __call__(self, machine, iteration):
-    """Computes current outputs and evaluate performance"""
+  def __call__(self, machine, iteration, full=None):
+    """Computes current outputs and evaluate performance. The complete data
+    sets are used if ``full`` is set or, if not given, according to the
+    evaluation policy."""
 
     def evalperf(outputs, targets):
       return la.norm(bob.measure.rmse(outputs, targets))
 
-    for k in range(len(self.train)):
-      machine(self.train[k], self.train_output[k])
-      machine(self.devel[k], self.devel_output[k])
-
-    self.data['real-train-rmse'].append(evalperf(self.train_output[0],
-      self.train_target[0]))
-    self.data['attack-train-rmse'].append(evalperf(self.train_output[1],
-      self.train_target[1]))
-    self.data['real-devel-rmse'].append(evalperf(self.devel_output[0],
-      self.devel_target[0]))
-    self.data['attack-devel-rmse'].append(evalperf(self.devel_output[1],
-      self.devel_target[1]))
-
-    thres = bob.measure.eer_threshold(self.train_output[1][:,0],
-        self.train_output[0][:,0])
-    train_far, train_frr = bob.measure.farfrr(self.train_output[1][:,0], 
-        self.train_output[0][:,0], thres)
-    devel_far, devel_frr = bob.measure.farfrr(self.devel_output[1][:,0],
-        self.devel_output[0][:,0], thres)
+    if full is None:
+      full = self.subset is None or \
+          self.count % self.full_every == 0
+
+    if full:
+      train, devel = self.train, self.devel
+      train_target, train_output = self.train_target, self.train_output
+      devel_target, devel_output = self.devel_target, self.devel_output
+    else:
+      train, devel = self.subset['train'], self.subset['devel']
+      train_target = self.subset['train-target']
+      train_output = self.subset['train-output']
+      devel_target = self.subset['devel-target']
+      devel_output = self.subset['devel-output']
+
+    for k in range(len(train)):
+      forward(machine, train[k], train_output[k])
+      forward(machine, devel[k], devel_output[k])
+
+    self.data['real-train-rmse'].append(evalperf(train_output[0],
+      train_target[0]))
+    self.data['attack-train-rmse'].append(evalperf(train_output[1],
+      train_target[1]))
+    self.data['real-devel-rmse'].append(evalperf(devel_output[0],
+      devel_target[0]))
+    self.data['attack-devel-rmse'].append(evalperf(devel_output[1],
+      devel_target[1]))
+
+    thres = bob.measure.eer_threshold(train_output[1][:,0],
+        train_output[0][:,0])
+    train_far, train_frr = bob.measure.farfrr(train_output[1][:,0], 
+        train_output[0][:,0], thres)
+    devel_far, devel_frr = bob.measure.farfrr(devel_output[1][:,0],
+        devel_output[0][:,0], thres)
 
     self.data['train-far'].append(train_far)
     self.data['train-frr'].append(train_frr)
@@ -78,6 +165,22 @@ class Analyzer:
     self.data['devel-frr'].append(devel_frr)
 
     self.data['epoch'].append(iteration)
+    self.data['full'].append(1 if full else 0)
+    self.count += 1
+
+    if self.history is not None:
+      self.history.append([self.data[k][-1] for k in self.COLUMNS])
+      for v in self.data.values(): del v[:-1]
+
+  def curves(self):
+    """Returns the complete training evolution, as a dictionary of arrays"""
+
+    if self.history is None:
+      return dict([(k, numpy.array(v)) for k, v in self.data.items()])
+
+    from . import history
+    self.history.flush()
+    return history.read(self.history.filename)
 
   def str_header(self):
     """Returns the string header of what I can print"""
@@ -95,12 +198,13 @@ class Analyzer:
             self.data['attack-devel-rmse'][-1],
             50*(self.data['devel-far'][-1] + self.data['devel-frr'][-1]),
             )
+    if not self.is_full(): retval += " (subset)"
     return retval
 
   def save(self, f):
     """Saves my contents on the bob.io.HDF5File you give me."""
 
-    for k, v in self.data.items(): f.set(k, numpy.array(v))
+    for k, v in self.curves().items(): f.set(k, numpy.array(v))
 
   def load(self, f):
     """Loads my contents from the bob.io.HDF5File you give me."""
@@ -108,6 +212,21 @@ class Analyzer:
     for k in f.paths():
       self.data[k.strip('/')] = f.read(k)
 
+    if 'full' not in [k.strip('/') for k in f.paths()]: #older files
+      self.data['full'] = numpy.ones((len(self.data['epoch']),), 'int64')
+
+    self.count = len(self.data['epoch'])
+
+  def relevance_rows(self, data, size=100000, seed=0):
+    """Returns the rows used to evaluate the relevance of the features: all
+    of them for arrays, a random subset of (at most) ``size`` rows for views
+    that are not loaded in memory"""
+
+    if isinstance(data, numpy.ndarray): return data
+    if len(data) <= size: return data[:]
+    rng = numpy.random.RandomState(seed)
+    return data[numpy.sort(rng.permutation(len(data))[:size])]
+
   def report(self, machine, test, pdffile, cfgfile):
     """Complete analysis of the contained data, with plots and all..."""
 
@@ -121,9 +240,9 @@ class Analyzer:
     test_output = (real_test[1], attack_test[1])
 
     for k in range(len(self.train)):
-      machine(self.train[k], self.train_output[k])
-      machine(self.devel[k], self.devel_output[k])
-      machine(test[k], test_output[k])
+      forward(machine, self.train[k], self.train_output[k])
+      forward(machine, self.devel[k], self.devel_output[k])
+      forward(machine, test[k], test_output[k])
 
     # Here we start with the plotting and writing of tables in files
     # --------------------------------------------------------------
@@ -158,19 +277,24 @@ class Analyzer:
     perf.epc(test_output, self.devel_output, 100)
     pp.savefig(fig)
     fig = mpl.figure()
-    perf.plot_rmse_evolution(self.data)
+    curves = self.curves()
+    perf.plot_rmse_evolution(curves)
     pp.savefig(fig)
     fig = mpl.figure()
-    perf.plot_eer_evolution(self.data)
+    perf.plot_eer_evolution(curves)
     pp.savefig(fig)
     fig = mpl.figure()
-    perf.evaluate_relevance(test, self.devel, self.train, machine)
+    perf.evaluate_relevance(test, self.devel,
+        [self.relevance_rows(k) for k in self.train], machine)
     pp.savefig(fig)
     pp.close()
     return devel_res, test_res
 
 def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
-    no_improvements=0, verbose=False):
+    no_improvements=0, verbose=False, shuffler=None, backend='bob',
+    dtype='float64', seed=None, monitor=None, checkpoint=None,
+    checkpoint_interval=600, resume=False, subsample=0, full_every=1,
+    history=None, gradient_jobs=1):
   """Creates a randomly initialized MLP and train it using the input data.
   
   This method will create an MLP with a single hidden layer containing the
@@ -219,6 +343,67 @@ def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
 
   verbose
     Makes the training more verbose
+
+  shuffler
+    If given, a callable like ``shuffler(data, target)``, returning the
+    object that will draw the training samples. It should have the same
+    interface as ``bob.trainer.DataShuffler``, which is used by default (see
+    also :py:class:`antispoofing.motion.ml.sampler.Sampler`).
+
+  backend
+    Either ``bob``, to train with ``bob.trainer.MLPRPropTrainer``, or
+    ``numpy``, to train with
+    :py:class:`antispoofing.motion.ml.nprprop.RPropTrainer`. In both cases,
+    the returned machine is a ``bob.machine.MLP``.
+
+  dtype
+    The floating-point type used for training with the ``numpy`` backend
+
+  seed
+    If given, the seed used to initialize the weights and biases, uniformly in
+    ``[-0.1, 0.1]``. Otherwise, the ``bob`` backend uses
+    ``bob.machine.MLP.randomize()``.
+
+  monitor
+    If given, a callable like ``monitor(iteration, analyzer)``, called after
+    every evaluation of the machine. If it returns ``True``, the training is
+    stopped (see :py:func:`antispoofing.motion.ml.search.sweep`).
+
+  checkpoint
+    If given, the name of a file where the training state is periodically
+    saved (see :py:mod:`antispoofing.motion.ml.checkpoint`): the current and
+    best machines, the trainer and shuffler states, the iteration counters
+    and the analyzer data. The file is removed when the training ends by one
+    of the stop conditions. If the trainer state cannot be saved, a warning
+    is printed before the training starts and no checkpoints are saved.
+
+  checkpoint_interval
+    The minimum number of seconds between two checkpoints
+
+  resume
+    If set and the checkpoint file exists, the training continues from the
+    saved state instead of starting over. The training then proceeds exactly
+    as if it had never been interrupted only if the shuffler state can be
+    saved too (as with :py:class:`antispoofing.motion.ml.sampler.Sampler`,
+    but not with ``bob.trainer.DataShuffler``, whatever the backend).
+
+  subsample, full_every
+    The evaluation policy of the :py:class:`Analyzer`: if ``subsample`` is
+    set, evaluations use a fixed subset of at most that number of samples of
+    each class, except every ``full_every`` evaluations, which use the
+    complete sets. Subset evaluations are only used for the stop conditions:
+    the best machine is always chosen on the complete development set.
+
+  history
+    If given, the name of a file where every evaluation is appended as soon
+    as possible (see :py:mod:`antispoofing.motion.ml.history`), so the
+    training can be followed while it runs. When resuming, the rows written
+    after the checkpoint are discarded.
+
+  gradient_jobs
+    With the ``numpy`` backend, the number of processes calculating the
+    derivatives of every mini-batch (see
+    :py:class:`antispoofing.motion.ml.nprprop.ParallelTrainer`)
   """
 
   VALLEY_CONDITION = 0.8 #of the minimum devel. set RMSE detected so far
@@ -234,30 +419,107 @@ def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
       numpy.array([-1], 'float64'),
       ]
 
+  if gradient_jobs > 1 and backend != 'numpy':
+    raise RuntimeError, "derivatives can only be calculated in parallel with the numpy backend"
+
   if verbose: print "Preparing analysis framework..."
-  analyze = Analyzer(train, devel, target)
+  restore = resume and checkpoint is not None and os.path.exists(checkpoint)
+  if history is not None:
+    from . import history as log
+    history = log.Writer(history, Analyzer.COLUMNS, append=restore)
+  analyze = Analyzer(train, devel, target, subsample, full_every,
+      history=history)
 
   if verbose: print "Setting up training infrastructure..."
-  shuffler = bob.trainer.DataShuffler(train, target)
+  if shuffler is None: shuffler = bob.trainer.DataShuffler
+  shuffler = shuffler(train, target)
   shuffler.auto_stdnorm = True
 
   shape = (shuffler.data_width, nhidden, 1)
-  machine = bob.machine.MLP(shape)
-  #machine.activation = bob.machine.Activation.TANH
-  machine.activation = bob.machine.HyperbolicTangentActivation()
-  machine.randomize()
-  machine.input_subtract, machine.input_divide = shuffler.stdnorm()
 
-  #trainer = bob.trainer.MLPRPropTrainer(machine, batch_size)
-  trainer = bob.trainer.MLPRPropTrainer(batch_size, bob.trainer.SquareError(machine.output_activation), machine, True)
-  #trainer.trainBiases = True
+  if backend == 'numpy':
+    from . import nprprop
+    machine = nprprop.MLP(shape, dtype, numpy.random.RandomState(seed))
+    machine.input_subtract, machine.input_divide = shuffler.stdnorm()
+    if gradient_jobs > 1:
+      trainer = nprprop.ParallelTrainer(machine, batch_size, gradient_jobs)
+    else:
+      trainer = nprprop.RPropTrainer(machine, batch_size)
+    copy = nprprop.MLP.copy
+
+  elif backend == 'bob':
+    machine = bob.machine.MLP(shape)
+    #machine.activation = bob.machine.Activation.TANH
+    machine.activation = bob.machine.HyperbolicTangentActivation()
+    if seed is None: machine.randomize()
+    else:
+      rng = numpy.random.RandomState(seed)
+      machine.weights = [rng.uniform(-0.1, 0.1, k.shape) for k in machine.weights]
+      machine.biases = [rng.uniform(-0.1, 0.1, k.shape) for k in machine.biases]
+    machine.input_subtract, machine.input_divide = shuffler.stdnorm()
+
+    #trainer = bob.trainer.MLPRPropTrainer(machine, batch_size)
+    trainer = bob.trainer.MLPRPropTrainer(batch_size, bob.trainer.SquareError(machine.output_activation), machine, True)
+    #trainer.trainBiases = True
+    copy = bob.machine.MLP #deep copy
+
+  else:
+    raise RuntimeError, "backend `%s' is not supported - use `bob' or `numpy'" % backend
+
+  # checks the trainer state can be saved now, instead of failing at the
+  # first checkpoint, in the middle of the training
+  if checkpoint is not None:
+    from . import checkpoint as ckpt
+    try:
+      ckpt.get_trainer(trainer, backend)
+    except RuntimeError, e:
+      if restore: raise
+      print "Warning: checkpoints are disabled, %s" % e
+      checkpoint = None
 
   continue_training = True
   iteration = 0
   min_devel_rmse = sys.float_info.max
-  best_machine = bob.machine.MLP(machine) #deep copy
+  best_machine = copy(machine)
   best_machine_iteration = 0
 
+  if checkpoint is not None:
+
+    def save_checkpoint():
+      state = {
+          'iteration': numpy.array(iteration),
+          'best-machine-iteration': numpy.array(best_machine_iteration),
+          'min-devel-rmse': numpy.array(min_devel_rmse),
+          'analyzer-count': numpy.array(analyze.count),
+          }
+      state.update(ckpt.get_machine(machine, 'machine'))
+      state.update(ckpt.get_machine(best_machine, 'best-machine'))
+      state.update(ckpt.get_trainer(trainer, backend))
+      if hasattr(shuffler, 'get_state'): state.update(shuffler.get_state())
+      for k, v in analyze.data.items():
+        state['analyzer-' + k] = numpy.array(v)
+      if analyze.history is not None: analyze.history.flush()
+      ckpt.save(checkpoint, state)
+
+    if restore:
+      state = ckpt.load(checkpoint)
+      ckpt.set_machine(machine, state, 'machine')
+      ckpt.set_machine(best_machine, state, 'best-machine')
+      ckpt.set_trainer(trainer, state, backend)
+      if hasattr(shuffler, 'set_state'): shuffler.set_state(state)
+      else:
+        print "Warning: the shuffler state was not saved - training samples will differ from those of an uninterrupted run"
+      for k in analyze.data.keys():
+        analyze.data[k] = list(state['analyzer-' + k])
+      analyze.count = int(state['analyzer-count'])
+      if analyze.history is not None: analyze.history.truncate(analyze.count)
+      iteration = int(state['iteration'])
+      best_machine_iteration = int(state['best-machine-iteration'])
+      min_devel_rmse = float(state['min-devel-rmse'])
+      if verbose: print "Resuming training from iteration %d (checkpoint `%s')" % (iteration, checkpoint)
+
+    last_checkpoint = datetime.datetime.now()
+
   # temporary training data selected by the shuffer
   shuffled_input = numpy.ndarray((batch_size, shuffler.data_width), 'float64')
   shuffled_target = numpy.ndarray((batch_size, shuffler.target_width), 'float64')
@@ -274,9 +536,9 @@ def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
       avg_devel_rmse = (analyze.data['real-devel-rmse'][-1] + \
           analyze.data['attack-devel-rmse'][-1])/2
 
-      if avg_devel_rmse < min_devel_rmse: #save best network, record minima
+      if analyze.is_full() and avg_devel_rmse < min_devel_rmse: #save best network, record minima
         best_machine_iteration = iteration
-        best_machine = bob.machine.MLP(machine) #deep copy
+        best_machine = copy(machine)
         if verbose: print "%d: Saving best network so far with average devel. RMSE = %.4e" % (iteration, avg_devel_rmse)
         min_devel_rmse = avg_devel_rmse
         if verbose: print "%d: New valley stop threshold set to %.4e" % \
@@ -289,6 +551,12 @@ def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
 
         break
 
+      if monitor is not None and monitor(iteration, analyze):
+        if verbose:
+          print "%d: Stopping on monitor request" % iteration
+          print "%d: Best machine happened on iteration %d with average devel. RMSE of %.4e" % (iteration, best_machine_iteration, min_devel_rmse)
+        break
+
       for i in range(epoch): #train for 'epoch' times w/o stopping for tests
 
         shuffler(shuffled_input, shuffled_target)
@@ -308,12 +576,28 @@ def make_mlp(train, devel, batch_size, nhidden, epoch, max_iter=0,
           print "%d: Best machine happened on iteration %d with average devel. RMSE of %.4e" % (iteration, best_machine_iteration, min_devel_rmse)
         break
 
+      # the state is saved before the evaluation, where a resumed run starts
+      if checkpoint is not None and (datetime.datetime.now() - \
+          last_checkpoint).total_seconds() >= checkpoint_interval:
+        save_checkpoint()
+        last_checkpoint = datetime.datetime.now()
+        if verbose: print "%d: Saved checkpoint to `%s'" % (iteration, checkpoint)
+
+    # the training has ended by one of the stop conditions
+    if checkpoint is not None and os.path.exists(checkpoint):
+      os.unlink(checkpoint)
+
   except KeyboardInterrupt:
     if verbose:
       print "%d: User interruption captured - exiting in a clean way" % \
           iteration
       print "%d: Best machine happened on iteration %d with average devel. RMSE of %.4e" % (iteration, best_machine_iteration, min_devel_rmse)
 
-    analyze(machine, iteration)
+    analyze(machine, iteration, full=True)
+
+  if analyze.history is not None: analyze.history.close()
+  if hasattr(trainer, 'close'): trainer.close()
+
+  if backend == 'numpy': best_machine = best_machine.to_bob()
 
   return best_machine, analyze
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Class-balanced mini-batch sampling over (memory-mapped) feature arrays
+"""
+
+import numpy
+from . import stats
+
+class Sampler(object):
+  """Draws class-balanced mini-batches from feature arrays.
+
+  This class has the same interface as ``bob.trainer.DataShuffler`` and can
+  be used in its place, but it does not copy the data: arrays may be
+  memory-mapped (e.g. views of a consolidated store, see
+  :py:class:`antispoofing.motion.storage.Store`) and only the rows of each
+  mini-batch are read. Rows containing NaNs are skipped.
+
+  Each class contributes the same number of samples to every mini-batch.
+  Samples of a class are drawn from a random permutation of its (valid) rows,
+  which is shuffled again once all rows have been used. Rows of each class in
+  a mini-batch are read in increasing order, which is friendlier to the page
+  cache.
+
+  If the rows have weights (e.g. after a reduction with
+  :py:mod:`antispoofing.motion.ml.coreset`), samples of a class are instead
+  drawn at random with probabilities proportional to the weights, and the
+  normalization uses the weighted statistics.
+
+  Keyword Parameters:
+
+  data
+    A list of 2D arrays, one per class, with one sample per row
+
+  target
+    A list of 1D arrays with the target of each class
+
+  seed
+    If given, the seed of the random number generator
+
+  chunk_size
+    The number of rows to read at once when scanning the data for valid rows
+    and statistics
+
+  weights
+    If given, a list with the 1D array of weights of the rows of each class,
+    or ``None`` for classes without weights
+  """
+
+  def __init__(self, data, target, seed=None, chunk_size=65536,
+      weights=None):
+
+    if len(data) != len(target):
+      raise RuntimeError, "the number of data arrays (%d) and targets (%d) should be the same" % (len(data), len(target))
+
+    self.data = data
+    self.target = [numpy.array(k, dtype='float64') for k in target]
+    self.data_width = data[0].shape[1]
+    self.target_width = len(self.target[0])
+    self.auto_stdnorm = False
+    self.rng = numpy.random.RandomState(seed)
+
+    # a single pass over the data finds the valid rows and the statistics
+    # required for the normalization
+    if weights is None: weights = [None] * len(data)
+    accumulator = stats.Accumulator(self.data_width)
+    self.permutation = []
+    self.cumulative = [] #cumulative weights of the valid rows, if any
+    for k, d in enumerate(data):
+      w = weights[k]
+      if w is not None: w = numpy.asarray(w, dtype='float64')
+      valid = []
+      for start in range(0, len(d), chunk_size):
+        block = numpy.asarray(d[start:start+chunk_size], dtype='float64')
+        ok = ~numpy.isnan(block.sum(axis=1))
+        valid.append(numpy.where(ok)[0] + start)
+        if w is None: accumulator.update(block[ok])
+        else: accumulator.update(block[ok], w[start:start+chunk_size][ok])
+      valid = numpy.hstack(valid + [numpy.ndarray((0,), dtype='int64')])
+      if len(valid) == 0:
+        raise RuntimeError, "class %d has no valid samples" % k
+      self.permutation.append(valid.astype('int64'))
+      if w is None:
+        self.cumulative.append(None)
+        self.rng.shuffle(self.permutation[-1])
+      else:
+        self.cumulative.append(numpy.cumsum(w[valid]))
+        if self.cumulative[-1][-1] <= 0:
+          raise RuntimeError, "the weights of class %d are all zero" % k
+
+    self.position = [0] * len(data)
+    self.count = accumulator.count
+
+    self.mean = accumulator.mean
+    self.std = numpy.sqrt(numpy.diag(accumulator.scatter) / \
+        max(accumulator.count - 1, 1))
+    self.std[self.std == 0] = 1.
+
+    self._index = {} #index buffers, per mini-batch size
+
+  def stdnorm(self):
+    """Returns the mean and standard deviation of all samples"""
+
+    return self.mean.copy(), self.std.copy()
+
+  def get_state(self):
+    """Returns the state of the sampler (random number generator and
+    position in the permutation of each class) as a dictionary of arrays"""
+
+    name, keys, position, has_gauss, cached = self.rng.get_state()
+    retval = {
+        'sampler-rng-keys': keys,
+        'sampler-rng-state': numpy.array([position, has_gauss]),
+        'sampler-rng-gauss': numpy.array(cached),
+        'sampler-position': numpy.array(self.position),
+        }
+    for k, p in enumerate(self.permutation):
+      retval['sampler-permutation-%d' % k] = p.copy()
+    return retval
+
+  def set_state(self, state):
+    """Restores the state saved by :py:meth:`get_state`, so the same
+    mini-batches are drawn from then on"""
+
+    position, has_gauss = [int(k) for k in state['sampler-rng-state']]
+    self.rng.set_state(('MT19937', state['sampler-rng-keys'], position,
+      has_gauss, float(state['sampler-rng-gauss'])))
+    self.position = [int(k) for k in state['sampler-position']]
+    self.permutation = [state['sampler-permutation-%d' % k].astype('int64') \
+        for k in range(len(self.permutation))]
+
+  def _counts(self, size):
+    """Returns the number of samples of each class in a mini-batch"""
+
+    n = len(self.permutation)
+    return [size // n + (1 if k < size % n else 0) for k in range(n)]
+
+  def _next(self, k, index):
+    """Fills the index buffer with the next rows of class ``k``"""
+
+    permutation = self.permutation[k]
+
+    if self.cumulative[k] is not None: #weighted, with replacement
+      cumulative = self.cumulative[k]
+      position = numpy.searchsorted(cumulative,
+          self.rng.uniform(0, cumulative[-1], len(index)), side='right')
+      numpy.take(permutation, position, out=index)
+      index.sort()
+      return
+
+    filled = 0
+    while filled < len(index):
+      if self.position[k] == len(permutation):
+        self.rng.shuffle(permutation)
+        self.position[k] = 0
+      count = min(len(index) - filled, len(permutation) - self.position[k])
+      index[filled:filled+count] = \
+          permutation[self.position[k]:self.position[k]+count]
+      self.position[k] += count
+      filled += count
+    index.sort()
+
+  def __call__(self, data, target):
+    """Fills the given data and target arrays with a new mini-batch"""
+
+    size = len(data)
+    if size not in self._index:
+      self._index[size] = [numpy.ndarray((k,), dtype='int64') \
+          for k in self._counts(size)]
+
+    start = 0
+    for k, index in enumerate(self._index[size]):
+      stop = start + len(index)
+      self._next(k, index)
+      numpy.take(self.data[k], index, axis=0, out=data[start:stop])
+      target[start:stop] = self.target[k]
+      start = stop
+
+    if self.auto_stdnorm:
+      data -= self.mean
+      data /= self.std
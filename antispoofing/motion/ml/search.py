@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Trains many MLPs in parallel and selects the best one
+"""
+
+import os
+import sys
+import math
+import numpy
+import datetime
+
+# Data shared with the workers, set before they are forked so the training
+# and development sets are not copied or serialized.
+_TASK = None
+
+# Name of the training evolution log of each MLP, which can be followed while
+# the training runs (see antispoofing.motion.ml.history)
+HISTORY = 'training-evolution.log'
+
+def summarize(analyzer):
+  """Summarizes the training evolution recorded by an
+  :py:class:`antispoofing.motion.ml.rprop.Analyzer`.
+
+  Returns a dictionary with the number of iterations trained for, the
+  iteration in which the average devel RMSE was minimal, that RMSE and the
+  devel HTER at that iteration (in %). Evaluations on the complete
+  development set are preferred to those on a subset, if there are any.
+  """
+
+  data = analyzer.curves()
+  rmse = (numpy.array(data['real-devel-rmse']) + \
+      numpy.array(data['attack-devel-rmse'])) / 2
+  full = numpy.array(data.get('full', []), dtype=bool)
+  if len(full) == len(rmse) and full.any():
+    rmse[~full] = numpy.inf
+  best = int(numpy.argmin(rmse))
+
+  return {
+      'iterations': int(data['epoch'][-1]),
+      'best-iteration': int(data['epoch'][best]),
+      'devel-rmse': float(rmse[best]),
+      'devel-hter': 50 * float(data['devel-far'][best] + \
+          data['devel-frr'][best]),
+      }
+
+def save(directory, machine, analyzer):
+  """Saves the machine and its training evolution in the given directory"""
+
+  import bob
+
+  bob.db.utils.makedirs_safe(directory)
+
+  f = bob.io.HDF5File(os.path.join(directory, 'mlp.hdf5'), 'w')
+  machine.save(f)
+  del f
+
+  f = bob.io.HDF5File(os.path.join(directory, 'training-evolution.hdf5'), 'w')
+  analyzer.save(f)
+  del f
+
+def load(directory, train, devel):
+  """Loads the machine and training evolution saved by :py:func:`save`.
+  Returns a tuple ``(machine, analyzer)``."""
+
+  import bob
+  from . import rprop
+
+  machine = bob.machine.MLP(bob.io.HDF5File(os.path.join(directory,
+    'mlp.hdf5')))
+
+  target = [
+      numpy.array([+1], 'float64'),
+      numpy.array([-1], 'float64'),
+      ]
+  analyzer = rprop.Analyzer(train, devel, target)
+  analyzer.load(bob.io.HDF5File(os.path.join(directory,
+    'training-evolution.hdf5')))
+
+  return machine, analyzer
+
+def _shuffler(make_shuffler, seed):
+  """Returns the shuffler of an MLP trained with the given seed"""
+
+  if make_shuffler is not None: return make_shuffler(seed)
+
+  from . import sampler
+
+  def shuffler(data, target):
+    return sampler.Sampler(data, target, seed)
+  return shuffler
+
+def _restart(task):
+  """Trains a single MLP, using the data shared by the parent process"""
+
+  from . import rprop
+
+  index, seed = task
+  train, devel, outputdir, make_shuffler, options = _TASK
+  shuffler = _shuffler(make_shuffler, seed)
+
+  directory = os.path.join(outputdir, 'restart-%02d' % (index+1))
+  if not os.path.exists(directory): os.makedirs(directory)
+
+  start = datetime.datetime.now()
+  machine, analyzer = rprop.make_mlp(train, devel, shuffler=shuffler,
+      seed=seed, history=os.path.join(directory, HISTORY), **options)
+  save(directory, machine, analyzer)
+
+  retval = summarize(analyzer)
+  retval['index'] = index
+  retval['restart'] = index + 1
+  retval['seed'] = seed
+  retval['directory'] = directory
+  retval['time'] = (datetime.datetime.now() - start).total_seconds()
+  return retval
+
+def restarts(train, devel, n, outputdir, jobs=1, seed=None, report=False,
+    make_shuffler=None, **options):
+  """Trains many MLPs on the same data, starting from different random
+  initializations.
+
+  The data is loaded only once: workers are forked from this process and
+  share its memory. Each MLP is trained with
+  :py:func:`antispoofing.motion.ml.rprop.make_mlp`, drawing samples with
+  :py:class:`antispoofing.motion.ml.sampler.Sampler` (unless another
+  shuffler is given), and saved (with its
+  training evolution) in a sub-directory of the output directory called
+  ``restart-<k>``. The evaluations of each MLP are logged in that directory
+  as they happen (see :py:data:`HISTORY`).
+
+  Keyword Parameters:
+
+  train, devel
+    The training and development sets, as for
+    :py:func:`antispoofing.motion.ml.rprop.make_mlp`
+
+  n
+    The number of MLPs to train
+
+  outputdir
+    The base directory where to save the machines
+
+  jobs
+    The number of processes to use
+
+  seed
+    The seed of the first MLP. The k-th MLP uses ``seed + k``. If not given,
+    a random seed is chosen.
+
+  report
+    If set, prints the results of each MLP as soon as its training ends. The
+    verbosity of each training is set with the ``verbose`` option of
+    :py:func:`antispoofing.motion.ml.rprop.make_mlp`.
+
+  make_shuffler
+    If given, a function taking the seed of an MLP and returning its
+    shuffler (see :py:func:`antispoofing.motion.ml.rprop.make_mlp`), e.g. to
+    use the weights of reduced rows. Otherwise, a
+    :py:class:`antispoofing.motion.ml.sampler.Sampler` is built on ``train``.
+
+  options
+    Other parameters given to
+    :py:func:`antispoofing.motion.ml.rprop.make_mlp` (e.g. ``batch_size``
+    or ``nhidden``)
+
+  Returns a list of dictionaries (see :py:func:`summarize`) with the results
+  of every MLP, in order. Each also contains its ``index``, ``seed``,
+  ``directory`` and training ``time``.
+  """
+
+  global _TASK
+
+  if seed is None: seed = numpy.random.randint(2**30)
+  tasks = [(k, seed + k) for k in range(n)]
+
+  if jobs > 1: options['verbose'] = False #avoids mixing outputs
+  _TASK = (train, devel, outputdir, make_shuffler, options)
+
+  pool = None
+  if jobs > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    results = pool.imap_unordered(_restart, tasks)
+  else:
+    import itertools
+    results = itertools.imap(_restart, tasks)
+
+  retval = []
+  try:
+    for result in results:
+      if report:
+        print "Restart %d/%d (seed %d) finished after %d iterations: devel RMSE = %.4e, HTER = %.2f%% (iteration %d)" % (result['restart'], n, result['seed'], result['iterations'], result['devel-rmse'], result['devel-hter'], result['best-iteration'])
+        sys.stdout.flush()
+      retval.append(result)
+
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    _TASK = None
+
+  return sorted(retval, key=lambda k: k['index'])
+
+# Parameters that can be swept, with the name of the matching option of
+# ``motion_rproptrain.py`` and of the keyword argument of make_mlp()
+GRID_PARAMETERS = [
+    ('hidden-neurons', 'nhidden'),
+    ('batch-size', 'batch_size'),
+    ('epoch', 'epoch'),
+    ]
+
+def grid(spec):
+  """Parses a grid specification like
+  ``hidden-neurons=5,10,20;batch-size=200,500;epoch=1,10``.
+
+  Parameters are separated by semi-colons and their values by commas. The
+  names are those in :py:data:`GRID_PARAMETERS`. Returns a list of
+  dictionaries, one per combination of values, with the keyword arguments of
+  :py:func:`antispoofing.motion.ml.rprop.make_mlp` to set.
+  """
+
+  import itertools
+
+  names = dict(GRID_PARAMETERS)
+  keys = []
+  values = []
+  for entry in [k.strip() for k in spec.split(';') if k.strip()]:
+    if '=' not in entry:
+      raise RuntimeError, "grid entry `%s' should be like `name=value1,value2,...'" % entry
+    name, entry_values = [k.strip() for k in entry.split('=', 1)]
+    if name not in names:
+      raise RuntimeError, "cannot sweep parameter `%s' - use one of %s" % (name, ', '.join([k for k, v in GRID_PARAMETERS]))
+    if names[name] in keys:
+      raise RuntimeError, "parameter `%s' is given more than once" % name
+    try:
+      entry_values = [int(k) for k in entry_values.split(',') if k.strip()]
+    except ValueError:
+      raise RuntimeError, "values of parameter `%s' should be integers" % name
+    if not entry_values or min(entry_values) <= 0:
+      raise RuntimeError, "values of parameter `%s' should be greater than zero" % name
+    keys.append(names[name])
+    values.append(entry_values)
+
+  if not keys:
+    raise RuntimeError, "grid specification `%s' has no parameters" % spec
+
+  return [dict(zip(keys, k)) for k in itertools.product(*values)]
+
+def rungs(minimum, maximum, eta=3):
+  """Returns the iterations at which trials are compared, in a successive
+  halving schedule: ``minimum``, ``minimum * eta``, ``minimum * eta**2``,
+  etc., up to (but excluding) ``maximum``."""
+
+  if minimum <= 0 or eta < 2:
+    raise RuntimeError, "the first rung (%d) should be greater than zero and eta (%d) at least 2" % (minimum, eta)
+
+  retval = []
+  while minimum < maximum:
+    retval.append(minimum)
+    minimum *= eta
+  return retval
+
+def _key(criterion):
+  """Returns a function to sort results by the given criterion"""
+
+  if criterion == 'rmse': return lambda k: (k['devel-rmse'], k['devel-hter'])
+  elif criterion == 'hter': return lambda k: (k['devel-hter'], k['devel-rmse'])
+
+  raise RuntimeError, "criterion `%s' is not supported - use `rmse' or `hter'" % criterion
+
+def _trial(task):
+  """Trains the MLP of a single grid point, stopping it as soon as it falls
+  behind the other trials at one of the rungs"""
+
+  from . import rprop
+
+  index, parameters, seed = task
+  train, devel, outputdir, milestones, eta, criterion, reports, \
+      make_shuffler, options = _TASK
+  options = dict(options)
+  options.update(parameters)
+  key = _key(criterion)
+  state = {'rung': 0, 'stopped': None}
+
+  def monitor(iteration, analyzer):
+    # reports the result at every rung reached and checks if this trial is
+    # still amongst the best 1/eta of all trials that reached it so far
+    while state['rung'] < len(milestones) and \
+        iteration >= milestones[state['rung']]:
+      rung = state['rung']
+      value = key(summarize(analyzer))
+      reports[(rung, index)] = value
+      peers = sorted([v for (r, i), v in reports.items() if r == rung])
+      keep = int(math.ceil(len(peers) / float(eta)))
+      state['rung'] += 1
+      if value > peers[keep-1]:
+        state['stopped'] = iteration
+        return True
+    return False
+
+  shuffler = _shuffler(make_shuffler, seed)
+
+  directory = os.path.join(outputdir, 'trial-%02d' % (index+1))
+  if not os.path.exists(directory): os.makedirs(directory)
+
+  start = datetime.datetime.now()
+  machine, analyzer = rprop.make_mlp(train, devel, shuffler=shuffler,
+      seed=seed, monitor=monitor, history=os.path.join(directory, HISTORY),
+      **options)
+  save(directory, machine, analyzer)
+
+  retval = summarize(analyzer)
+  for name, parameter in GRID_PARAMETERS:
+    retval[parameter] = options[parameter]
+  retval['index'] = index
+  retval['trial'] = index + 1
+  retval['seed'] = seed
+  retval['directory'] = directory
+  retval['stopped'] = state['stopped']
+  if state['stopped'] is None:
+    retval['rungs'] = state['rung']
+    retval['status'] = 'completed'
+  else:
+    retval['rungs'] = state['rung'] - 1
+    retval['status'] = 'stopped at %d' % state['stopped']
+  retval['time'] = (datetime.datetime.now() - start).total_seconds()
+  return retval
+
+def sweep(train, devel, configurations, outputdir, min_iter, eta=3, jobs=1,
+    seed=None, criterion='rmse', report=False, make_shuffler=None,
+    **options):
+  """Trains one MLP per configuration of a parameter grid, stopping the
+  losing ones early.
+
+  Trials are scheduled on a pool of processes forked from this one, so the
+  data is loaded only once and shared. Losing trials are stopped following
+  an asynchronous successive halving schedule: when a trial reaches one of
+  the rungs (see :py:func:`rungs`), the best devel result in its training
+  evolution so far is compared to that of all trials that already reached
+  the same rung. The trial only continues if it is amongst the best ``1/eta``
+  of them. Most of the budget is therefore spent on the most promising
+  configurations, and no trial ever waits for the others. Every MLP is saved,
+  with its training evolution, in a sub-directory of the output directory
+  called ``trial-<k>``, where its evaluations are also logged as they happen
+  (see :py:data:`HISTORY`).
+
+  Keyword Parameters:
+
+  train, devel
+    The training and development sets, as for
+    :py:func:`antispoofing.motion.ml.rprop.make_mlp`
+
+  configurations
+    A list of dictionaries with the parameters of each trial (see
+    :py:func:`grid`)
+
+  outputdir
+    The base directory where to save the machines
+
+  min_iter
+    The number of training iterations of the first rung. Trials are compared
+    again every time their number of iterations is multiplied by ``eta``.
+
+  eta
+    The reduction factor: only the best ``1/eta`` of the trials continue
+    after each rung
+
+  jobs
+    The number of processes to use
+
+  seed
+    The seed used by all trials, so they only differ by their parameters. If
+    not given, a random seed is chosen.
+
+  criterion
+    Either ``rmse`` or ``hter``: the devel measure used to compare trials
+
+  report
+    If set, prints the results of each trial as soon as its training ends
+    (the verbosity of each training is set with the ``verbose`` option, as
+    for :py:func:`restarts`)
+
+  make_shuffler
+    If given, a function taking the seed of a trial and returning its
+    shuffler, as for :py:func:`restarts`
+
+  options
+    Other parameters given to
+    :py:func:`antispoofing.motion.ml.rprop.make_mlp`. The maximum number of
+    iterations (``max_iter``) is the budget of the trials that are never
+    stopped and should be given.
+
+  Returns a list of dictionaries (see :py:func:`summarize`) with the results
+  of every trial, ranked (see :py:func:`rank`). Each also contains the
+  parameters of the trial, its ``seed``, ``directory``, ``status`` and
+  training ``time``.
+  """
+
+  global _TASK
+
+  if not options.get('max_iter', 0):
+    raise RuntimeError, "a maximum number of iterations is required to sweep parameters"
+
+  _key(criterion) #checks the criterion before starting
+  milestones = rungs(min_iter, options['max_iter'], eta)
+
+  if seed is None: seed = numpy.random.randint(2**30)
+  tasks = [(k, c, seed) for k, c in enumerate(configurations)]
+
+  if jobs > 1: options['verbose'] = False #avoids mixing outputs
+
+  pool = None
+  manager = None
+  if jobs > 1:
+    import multiprocessing
+    manager = multiprocessing.Manager()
+    reports = manager.dict()
+  else:
+    reports = {}
+
+  _TASK = (train, devel, outputdir, milestones, eta, criterion, reports,
+      make_shuffler, options)
+
+  if jobs > 1:
+    pool = multiprocessing.Pool(jobs)
+    results = pool.imap_unordered(_trial, tasks)
+  else:
+    import itertools
+    results = itertools.imap(_trial, tasks)
+
+  retval = []
+  try:
+    for result in results:
+      if report:
+        print "Trial %d/%d (%s) %s after %d iterations: devel RMSE = %.4e, HTER = %.2f%% (iteration %d)" % (result['trial'], len(tasks), ', '.join(['%s=%d' % (name, result[parameter]) for name, parameter in GRID_PARAMETERS]), result['status'], result['iterations'], result['devel-rmse'], result['devel-hter'], result['best-iteration'])
+        sys.stdout.flush()
+      retval.append(result)
+
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    if manager is not None:
+      manager.shutdown()
+    _TASK = None
+
+  return rank(retval, criterion)
+
+def rank(results, criterion='rmse'):
+  """Ranks the results of a sweep. Trials that were not stopped come first,
+  followed by the stopped ones, from the latest rung reached. Trials within
+  each group are sorted by the given criterion. Sets the ``rank`` of every
+  result and returns them in order."""
+
+  key = _key(criterion)
+  retval = sorted(results, key=lambda k: (k['stopped'] is not None,
+    -k['rungs'], key(k)))
+  for k, r in enumerate(retval): r['rank'] = k + 1
+  return retval
+
+def best(results, criterion='rmse'):
+  """Returns the best result, according to the given criterion, which may
+  be ``rmse`` or ``hter`` (on the development set). Ties are broken by the
+  other criterion."""
+
+  return min(results, key=_key(criterion))
+
+def write_table(results, file, columns, chosen=None):
+  """Writes a nicely formatted table with the results of many trainings.
+
+  Keyword Parameters:
+
+  results
+    A list of dictionaries with the results
+
+  file
+    A file-like object where to write the table
+
+  columns
+    A list of tuples ``(title, key, format)`` describing every column
+
+  chosen
+    If given, the result to be marked with a ``*``
+  """
+
+  rows = []
+  for r in results:
+    row = [fmt % r[key] for title, key, fmt in columns]
+    row[0] = ('* ' if r is chosen else '') + row[0]
+    rows.append(row)
+
+  sizes = [max([len(title)] + [len(row[i]) for row in rows]) + 2 \
+      for i, (title, key, fmt) in enumerate(columns)]
+
+  hline = ' '.join([k*'=' for k in sizes])
+  file.write(hline + '\n')
+  file.write(' '.join([title.center(size) for (title, key, fmt), size in \
+      zip(columns, sizes)]) + '\n')
+  file.write(hline + '\n')
+  for row in rows:
+    file.write(' '.join([v.rjust(size-1) + ' ' for v, size in \
+        zip(row, sizes)]) + '\n')
+  file.write(hline + '\n')
+
+RESTART_COLUMNS = [
+    ('Restart', 'restart', '%d'),
+    ('Seed', 'seed', '%d'),
+    ('Iterations', 'iterations', '%d'),
+    ('Best at', 'best-iteration', '%d'),
+    ('Devel RMSE', 'devel-rmse', '%.4e'),
+    ('Devel HTER', 'devel-hter', '%.2f%%'),
+    ('Time (s)', 'time', '%.0f'),
+    ]
+
+SWEEP_COLUMNS = [
+    ('Rank', 'rank', '%d'),
+    ('Trial', 'trial', '%d'),
+    ('Hidden', 'nhidden', '%d'),
+    ('Batch', 'batch_size', '%d'),
+    ('Epoch', 'epoch', '%d'),
+    ('Status', 'status', '%s'),
+    ('Iterations', 'iterations', '%d'),
+    ('Best at', 'best-iteration', '%d'),
+    ('Devel RMSE', 'devel-rmse', '%.4e'),
+    ('Devel HTER', 'devel-hter', '%.2f%%'),
+    ('Time (s)', 'time', '%.0f'),
+    ]
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Streaming statistics and LDA training from sufficient statistics
+"""
+
+import math
+import numpy
+
+# Task being executed by the workers in accumulate(), set before they are
+# forked so the loader (and any memory-mapped store) is shared with them.
+_TASK = None
+
+class Accumulator(object):
+  """Accumulates the number of samples, the mean and the scatter matrix (sum
+  of the outer products of the centered samples) of a set of vectors.
+
+  Blocks of samples are merged using the pairwise update of Chan et al., which
+  is numerically stable. Accumulators can also be merged between themselves,
+  so partial results calculated in different processes can be reduced.
+
+  Keyword Parameters:
+
+  width
+    The length of the vectors. If not given, it is set by the first update.
+  """
+
+  def __init__(self, width=None):
+
+    self.count = 0
+    self.mean = None
+    self.scatter = None
+    if width is not None: self._allocate(width)
+
+  def _allocate(self, width):
+    self.mean = numpy.zeros((width,), dtype='float64')
+    self.scatter = numpy.zeros((width, width), dtype='float64')
+
+  def _merge(self, count, mean, scatter):
+    """Merges the statistics of a block of samples"""
+
+    if count == 0: return
+    if self.mean is None: self._allocate(len(mean))
+
+    total = self.count + count
+    delta = mean - self.mean
+    self.mean += delta * (float(count) / total)
+    self.scatter += scatter
+    self.scatter += numpy.outer(delta, delta) * \
+        (float(self.count) * count / total)
+    self.count = total
+
+  def update(self, data, weights=None):
+    """Accumulates a 2D array with one sample per row. If given, every
+    sample counts as many times as its weight (which may be fractional)."""
+
+    if len(data) == 0: return
+    data = numpy.asarray(data, dtype='float64')
+
+    if weights is None:
+      mean = data.mean(axis=0)
+      centered = data - mean
+      self._merge(len(data), mean, numpy.dot(centered.T, centered))
+      return
+
+    weights = numpy.asarray(weights, dtype='float64')
+    total = weights.sum()
+    if total <= 0: return
+    mean = numpy.dot(weights, data) / total
+    centered = data - mean
+    self._merge(total, mean, numpy.dot(centered.T * weights, centered))
+
+  def merge(self, other):
+    """Merges the statistics of another accumulator into this one"""
+
+    if other.count == 0: return self
+    self._merge(other.count, other.mean, other.scatter)
+    return self
+
+  def variance(self):
+    """Returns the (biased) variance of every component"""
+
+    return numpy.diag(self.scatter) / self.count
+
+  def std(self):
+    """Returns the (biased) standard deviation of every component"""
+
+    return numpy.sqrt(self.variance())
+
+def _accumulate_chunk(filenames):
+  """Accumulates the data of a list of files, using the current loader"""
+
+  loader = _TASK
+  retval = Accumulator()
+  for k in filenames:
+    data = loader(k)
+    if isinstance(data, tuple): retval.update(*data)
+    else: retval.update(data)
+  return retval
+
+def accumulate(filenames, loader, jobs=1):
+  """Accumulates the data from many files in a single pass.
+
+  Keyword Parameters:
+
+  filenames
+    A list of files to read
+
+  loader
+    A callable returning a 2D array with the samples in a given file, or a
+    tuple ``(samples, weights)``
+
+  jobs
+    The number of processes to use. Each process accumulates part of the
+    files and the partial results are merged in the end.
+
+  Returns an :py:class:`Accumulator`.
+  """
+
+  global _TASK
+  _TASK = loader
+
+  try:
+    if jobs <= 1 or len(filenames) <= 1: return _accumulate_chunk(filenames)
+
+    import multiprocessing
+    chunks = 4 * jobs
+    size = int(math.ceil(float(len(filenames)) / chunks))
+    chunks = [filenames[k:k+size] for k in range(0, len(filenames), size)]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+      partial = pool.map(_accumulate_chunk, chunks)
+    finally:
+      pool.close()
+      pool.join()
+
+  finally:
+    _TASK = None
+
+  retval = Accumulator()
+  for k in partial: retval.merge(k)
+  return retval
+
+def balanced_mean_std(c0, c1, nonStdZero=False):
+  """Calculates the class-balanced mean and standard deviation of two classes
+  from their accumulators.
+
+  This gives the same results as
+  :py:func:`antispoofing.utils.ml.norm.calc_mean_std`: the mean is the
+  average of the class means and the standard deviation is calculated after
+  replicating the samples of each class so that both have (roughly) the same
+  number of samples. If ``nonStdZero`` is set, null standard deviations are
+  replaced by 1.
+  """
+
+  mean = (c0.mean + c1.mean) / 2.
+
+  prop = float(c0.count) / c1.count
+  if prop < 1: p0, p1 = int(math.ceil(1/prop)), 1
+  else: p0, p1 = 1, int(math.ceil(prop))
+
+  total = float(p0 * c0.count + p1 * c1.count)
+  center = (p0 * c0.count * c0.mean + p1 * c1.count * c1.mean) / total
+  var = p0 * (numpy.diag(c0.scatter) + c0.count * (c0.mean - center)**2)
+  var += p1 * (numpy.diag(c1.scatter) + c1.count * (c1.mean - center)**2)
+  std = numpy.sqrt(var / total)
+
+  if nonStdZero: std[std == 0] = 1
+
+  return mean, std
+
+def lda(classes, mean=None, std=None):
+  """Solves Fisher's LDA from the accumulated statistics of every class.
+
+  The within-class (Sw) and between-class (Sb) scatter matrices are
+  calculated from the accumulators and the generalized eigenvalue problem ``Sb
+  v = l Sw v`` is solved through the Cholesky decomposition of Sw.
+  Eigenvectors are normalized so that ``v' Sw v = 1``.
+
+  Keyword Parameters:
+
+  classes
+    A list of :py:class:`Accumulator` objects, one per class
+
+  mean, std
+    If given, solve the problem for the data normalized with these values,
+    i.e. ``(x - mean) / std``, without having to normalize the data itself
+
+  Returns a tuple ``(eigenvectors, eigenvalues)``, sorted by decreasing
+  eigenvalue. The eigenvectors are the columns of the first array.
+  """
+
+  width = len(classes[0].mean)
+  if mean is None: mean = numpy.zeros((width,), dtype='float64')
+  if std is None: std = numpy.ones((width,), dtype='float64')
+
+  count = float(sum([k.count for k in classes]))
+  means = [(k.mean - mean) / std for k in classes]
+  total = sum([k.count * m for k, m in zip(classes, means)]) / count
+
+  sw = sum([k.scatter for k in classes]) / numpy.outer(std, std)
+  sb = numpy.zeros_like(sw)
+  for k, m in zip(classes, means): sb += k.count * numpy.outer(m - total, m - total)
+
+  try:
+    cholesky = numpy.linalg.cholesky(sw)
+  except numpy.linalg.LinAlgError:
+    raise RuntimeError, "the within-class scatter matrix is singular - cannot solve the LDA problem"
+
+  inverse = numpy.linalg.inv(cholesky)
+  eigenvalues, eigenvectors = numpy.linalg.eigh(
+      numpy.dot(numpy.dot(inverse, sb), inverse.T))
+
+  order = numpy.argsort(eigenvalues)[::-1]
+  return numpy.dot(inverse.T, eigenvectors[:,order]), eigenvalues[order]
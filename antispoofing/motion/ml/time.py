@@ -9,19 +9,22 @@
 import os
 import bob
 import numpy
+from .. import storage
 
-def scores(flist):
+def scores(flist, store=None):
+  if store is not None: return storage.merge_valid(flist, store)
   d = bob.io.load(flist)
   return d[~numpy.isnan(d.sum(axis=1)),:]
 
-def eval_threshold(real, attack, minhter, verbose):
-  """Evaluates the optimal threshold for a given MLP/dataset"""
+def eval_threshold(real, attack, minhter, verbose, store=None):
+  """Evaluates the optimal threshold for a given MLP/dataset. If a
+  consolidated store is given, the scores are read from it."""
   
   if verbose: 
     print "Establishing optimal separation threshold at development set..."
 
-  real_scores = scores(real)
-  attack_scores = scores(attack)
+  real_scores = scores(real, store)
+  attack_scores = scores(attack, store)
 
   if minhter:
     thres = bob.measure.min_hter_threshold(attack_scores[:,0], real_scores[:,0])
@@ -38,7 +41,7 @@ def apply_threshold (value, threshold):
   if value < threshold: return -1.
   return +1.
   
-def threshold_scores(filename, threshold):
+def threshold_scores(filename, threshold, store=None):
   """Returns a vector of decisions given a certain filename, machine and the 
   threshold. These decisions are integers: -1 if it is an attack, 1 if it is a
   real access.
@@ -46,7 +49,7 @@ def threshold_scores(filename, threshold):
   if score < threshold => is attack, set -1
   if scores >= threshold => is real-access, set +1
   """
-  output = bob.io.load(filename)
+  output = storage.load(filename, store)
   return numpy.array([apply_threshold(k, threshold) for k in output])
 
 def average_scores(score, time):
@@ -62,7 +65,7 @@ def thresholded_running_average(score):
   retval[~numpy.isnan(score)] = [apply_threshold(good[:(k+1)].mean(),0) for k in range(good.size)]
   return retval
 
-def decisions(data, threshold, average=False, verbose=False):
+def decisions(data, threshold, average=False, verbose=False, store=None):
   """Returns a list of booleans (-1, +1) indicating the decisions through time
   for all input data.
   """
@@ -70,18 +73,19 @@ def decisions(data, threshold, average=False, verbose=False):
   decisions = []
   for filename in data:
     if verbose: print "Scoring file %s..." % filename
-    S = bob.io.load(filename)
+    S = storage.load(filename, store)
     if not average: #threshold before
       S = numpy.array([apply_threshold(S[k], threshold) \
           for k in range(len(S))])
     decisions.append(thresholded_running_average(S))
   return decisions
 
-def frfa_list(real, attack, threshold, average=False, verbose=False):
+def frfa_list(real, attack, threshold, average=False, verbose=False,
+    store=None):
   """Returns a list composed of the false rejections and false accepts"""
 
-  real_decisions = decisions(real, threshold, average, verbose)
-  attack_decisions = decisions(attack, threshold, average, verbose)
+  real_decisions = decisions(real, threshold, average, verbose, store)
+  attack_decisions = decisions(attack, threshold, average, verbose, store)
 
   # It only makes sense to analyze up to the smallest clip size...
   maxtime = min([len(k) for k in real_decisions] + \
@@ -112,7 +116,7 @@ def frfa_list(real, attack, threshold, average=False, verbose=False):
 
   return fr, fa
 
-def instantaneous_decisions(data, threshold, verbose=False):
+def instantaneous_decisions(data, threshold, verbose=False, store=None):
   """Returns a list of booleans (-1, +1) indicating the decisions through time
   for all input data.
   """
@@ -121,17 +125,18 @@ def instantaneous_decisions(data, threshold, verbose=False):
   for i, filename in enumerate(data):
     if verbose: 
       print "Thresholding file %s [%d/%d]..." % (filename, i+1, len(data))
-    S = bob.io.load(filename)
+    S = storage.load(filename, store)
     S = [apply_threshold(k, threshold) for k in S]
     decisions.append(S)
   return decisions
 
-def instantaneous_frfa_list(real, attack, threshold, verbose=False):
+def instantaneous_frfa_list(real, attack, threshold, verbose=False,
+    store=None):
   """Returns a list composed of the false rejections and false accepts for
   every instant w/o taking into consideration previous decisions."""
 
-  real_decisions = instantaneous_decisions(real, threshold, verbose)
-  attack_decisions = instantaneous_decisions(attack, threshold, verbose)
+  real_decisions = instantaneous_decisions(real, threshold, verbose, store)
+  attack_decisions = instantaneous_decisions(attack, threshold, verbose, store)
 
   # It only makes sense to analyze up to the smallest clip size...
   maxtime = min([len(k) for k in real_decisions] + \
@@ -166,17 +171,18 @@ class Analyzer:
   """A class that conducts full time analysis on a set of values"""
 
   def __init__(self, real_files, attack_files, threshold,
-      windowsize, overlap, average, verbose):
+      windowsize, overlap, average, verbose, store=None):
     """Initializes the analyzer with the real and attack files for a
     specific protocol, runs the base analysis using the given threshold. If
     average is set, use score averaging instead of instantaneous thresholding.
+    If a consolidated store is given, the scores are read from it.
     """
   
     if verbose: print "Running the time analysis..."
 
     # calculates the instantaneous lists
     (fr, fa) = instantaneous_frfa_list(real_files, attack_files,
-        threshold, verbose)
+        threshold, verbose, store)
 
     self.instd = {}
 
@@ -191,7 +197,7 @@ class Analyzer:
 
     # calculates the averaged lists
     (fr, fa) = frfa_list(real_files, attack_files,
-        threshold, average, verbose)
+        threshold, average, verbose, store)
 
     self.d = {}
 
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Consolidates the per-video files produced by any of the processing stages
+(frame differences, clustered quantities or scores) in a single store, saved
+in the same directory. Programs reading that directory afterwards use the
+store instead of opening each file individually. Videos are ordered by group
+and class, so all data for a group and class can be read at once.
+"""
+
+import os
+import sys
+import argparse
+
+def main():
+
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('inputdir', metavar='DIR', type=str,
+      help='Base directory containing the files to be consolidated. The store is saved in this directory.')
+  parser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
+      default=False, help='Increases this script verbosity')
+
+  # Adds database support using the common infrastructure
+  # N.B.: Only databases with 'video' support
+  import antispoofing.utils.db
+  antispoofing.utils.db.Database.create_parser(parser, 'video')
+
+  args = parser.parse_args()
+
+  if not os.path.exists(args.inputdir):
+    parser.error("input directory `%s' does not exist" % args.inputdir)
+
+  from .. import storage
+
+  db = args.cls(args)
+
+  entries = []
+  for group, data in (('train', db.get_train_data()),
+      ('devel', db.get_devel_data()), ('test', db.get_test_data())):
+    for cls, objects in zip(('real', 'attack'), data):
+      entries.append((group, cls,
+        [k.make_path(args.inputdir, '.hdf5') for k in objects]))
+
+  total = storage.consolidate(args.inputdir, entries, args.verbose)
+
+  print "Consolidated %d file(s) (%d rows) in `%s'" % \
+      (sum([len(k[2]) for k in entries]), total,
+        os.path.join(args.inputdir, storage.STORE_DATA))
+
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
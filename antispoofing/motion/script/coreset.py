@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Reduces the clustered features of the training videos (or of other groups,
+see --groups) by dropping redundant rows, which are common with overlapping
+windows. Each row kept
+carries a weight, the number of original rows it stands for. The output
+directory can be given to the trainers instead of the input one: weights are
+used by ``motion_ldatrain.py --streaming`` and ``motion_rproptrain.py``
+(with --sampler, --restarts or --sweep). Videos of the groups that are not reduced are copied unchanged.
+
+Rows can be kept every N rows (stride), one per cell of a regular grid
+(quantize) or so that all rows are within a radius of a kept row (kcenter).
+For the last two methods, features are first divided by their standard
+deviation on the training set.
+"""
+
+import os
+import sys
+import time
+import argparse
+from . import parallel
+
+# Default parameter of each reduction method
+DEFAULTS = {
+    'stride': 4,
+    'quantize': 0.5,
+    'kcenter': 0.5,
+    }
+
+def main():
+
+  import numpy
+
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('inputdir', metavar='DIR', type=str,
+      help='Base directory containing the clustered features to be reduced')
+  parser.add_argument('outputdir', metavar='DIR', type=str,
+      help='Base directory where to save the reduced features')
+  parser.add_argument('-m', '--method', dest='method', default='quantize',
+      choices=('stride', 'quantize', 'kcenter'), help='The reduction method (defaults to %(default)s)')
+  parser.add_argument('-p', '--parameter', dest='parameter', metavar='FLOAT',
+      type=float, default=None, help='The (integer) step of the stride method, the resolution of the quantize method or the radius of the kcenter method, the last two in units of standard deviation. Defaults to %s' % ', '.join(['%g (%s)' % (DEFAULTS[k], k) for k in sorted(DEFAULTS)]))
+  parser.add_argument('-n', '--max-rows', dest='max_rows', metavar='INT',
+      type=int, default=0, help='If greater than zero, the maximum number of rows kept per video by the kcenter method, even if some rows are then farther than the radius from all kept rows (defaults to %(default)s)')
+  parser.add_argument('-g', '--groups', dest='groups', nargs='+',
+      default=['train'], choices=('train', 'devel', 'test'), help='The groups whose videos are reduced. Videos of other groups are copied unchanged (defaults to %(default)s)')
+  parser.add_argument('-r', '--report', action='store_true', dest='report',
+      default=False, help='If set, train an LDA (using the streaming statistics) on the original and on the reduced training set and compare their HTER on the (original) development set. The comparison is saved in "coreset.txt" in the output directory.')
+
+  parallel.add_arguments(parser)
+
+  # Adds database support using the common infrastructure
+  # N.B.: Only databases with 'video' support
+  import antispoofing.utils.db
+  antispoofing.utils.db.Database.create_parser(parser, 'video')
+
+  args = parser.parse_args()
+
+  if not os.path.exists(args.inputdir):
+    parser.error("input directory `%s' does not exist" % args.inputdir)
+
+  if args.parameter is None: args.parameter = DEFAULTS[args.method]
+  if args.parameter <= 0:
+    parser.error("the parameter of the reduction method should be greater than zero")
+
+  if args.method == 'stride' and \
+      (args.parameter != int(args.parameter) or args.parameter < 1):
+    parser.error("the step of the stride method should be an integer greater or equal to 1")
+
+  if args.max_rows < 0:
+    parser.error("the maximum number of rows cannot be negative")
+
+  if args.max_rows and args.method != 'kcenter':
+    parser.error("a maximum number of rows can only be given to the kcenter method")
+
+  if args.jobs <= 0:
+    parser.error('The number of jobs has to be greater than zero')
+
+  from .. import storage
+  from .. import ml
+
+  db = args.cls(args)
+  groups = {
+      'train': db.get_train_data(),
+      'devel': db.get_devel_data(),
+      'test': db.get_test_data(),
+      }
+
+  def input_files(objects):
+    return [k.make_path(args.inputdir, '.hdf5') for k in objects]
+
+  # the scale of every feature, for methods using distances
+  scale = None
+  if args.method != 'stride':
+    train = groups['train'][0] + groups['train'][1]
+    accumulator = ml.stats.accumulate(input_files(train), storage.load_valid,
+        args.jobs)
+    scale = accumulator.std()
+    scale[scale == 0] = 1.
+
+  process = []
+  reduced = []
+  for group in ('train', 'devel', 'test'):
+    objects = groups[group][0] + groups[group][1]
+    process += objects
+    reduced += len(objects) * [group in args.groups]
+
+  def copy_sparse(data, filename):
+    storage.save_sparse(storage.densify(*data), filename)
+
+  def process_video(index, obj):
+
+    filename = obj.make_path(args.inputdir, '.hdf5')
+    position, features, length = storage.load_sparse(filename)
+    valid = ~numpy.isnan(features.sum(axis=1))
+    position, features = position[valid], features[valid]
+
+    if not reduced[index]:
+      parallel.save(obj, (position, features, length), args.outputdir,
+          '.hdf5', copy_sparse)
+      return len(features)
+
+    keep, weights = ml.coreset.select(features, args.method, args.parameter,
+        scale, args.max_rows)
+    parallel.save(obj, (position[keep], features[keep], length, weights),
+        args.outputdir, '.hdf5', storage.save_weighted)
+    return len(features)
+
+  failures = parallel.run(process_video, process, args.jobs)
+  if failures: return 1
+
+  if not args.report: return 0
+
+  def load_weighted(filename):
+    return storage.load_valid(filename), storage.load_weights(filename)
+
+  def train_lda(real, attack, loader):
+    """Trains an LDA from the streaming statistics of the given files"""
+
+    start = time.time()
+    real = ml.stats.accumulate(real, loader, args.jobs)
+    attack = ml.stats.accumulate(attack, loader, args.jobs)
+    mean, std = ml.stats.balanced_mean_std(real, attack, nonStdZero=True)
+    weights = ml.stats.lda([real, attack], mean, std)[0][:,0]
+    if numpy.dot(real.mean - attack.mean, weights / std) < 0:
+      weights = -1 * weights
+    return mean, std, weights, time.time() - start
+
+  def devel_hter(mean, std, weights):
+    """Returns the HTER (in %) on the development set, at its EER
+    threshold"""
+
+    import bob
+    scores = []
+    for objects in groups['devel']:
+      data = storage.merge_valid(input_files(objects))
+      scores.append(numpy.dot((data - mean) / std, weights))
+    thres = bob.measure.eer_threshold(scores[1], scores[0])
+    far, frr = bob.measure.farfrr(scores[1], scores[0], thres)
+    return 50 * (far + frr)
+
+  real, attack = groups['train']
+  results = []
+  for name, directory, loader in (
+      ('original', args.inputdir, storage.load_valid),
+      ('reduced', args.outputdir, load_weighted),
+      ):
+    files = [[k.make_path(directory, '.hdf5') for k in objects] for objects \
+        in (real, attack)]
+    mean, std, weights, duration = train_lda(files[0], files[1], loader)
+    rows = sum([len(storage.load_valid(k)) for k in files[0] + files[1]])
+    results.append({
+      'set': name,
+      'rows': rows,
+      'devel-hter': devel_hter(mean, std, weights),
+      'time': duration,
+      })
+
+  for k in results:
+    k['fraction'] = 100. * k['rows'] / max(results[0]['rows'], 1)
+
+  columns = [
+      ('Training set', 'set', '%s'),
+      ('Rows', 'rows', '%d'),
+      ('Rows (%)', 'fraction', '%.1f%%'),
+      ('Devel HTER (LDA)', 'devel-hter', '%.2f%%'),
+      ('Training time (s)', 'time', '%.1f'),
+      ]
+
+  f = open(os.path.join(args.outputdir, 'coreset.txt'), 'wt')
+  f.write("Method: %s (parameter = %g)\n" % (args.method, args.parameter))
+  ml.search.write_table(results, f, columns)
+  f.close()
+
+  print "Method: %s (parameter = %g)" % (args.method, args.parameter)
+  ml.search.write_table(results, sys.stdout, columns)
+
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
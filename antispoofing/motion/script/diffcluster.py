@@ -23,11 +23,39 @@ described quantities for windows of a configurable size (N):
 
 import os, sys
 import argparse
+from . import parallel
+
+def configuration_dir(outputdir, window_size, overlap):
+  """Returns the output directory for a given configuration of a sweep"""
+
+  return os.path.join(outputdir, 'window%d-overlap%d' % (window_size, overlap))
+
+def cluster_differences(data, sweep):
+  """Calculates the clustered values for face and background.
+
+  Keyword Parameters:
+
+  data
+    An array with shape ``(T, 2)`` containing the face and background frame
+    differences, as produced by ``motion_framediff.py``
+
+  sweep
+    A list of ``(window_size, overlap)`` tuples
+
+  Returns a dictionary with one array with shape ``(T, 10)`` for every
+  configuration in the sweep.
+  """
+  import numpy
+  from .. import cluster_5quantities_sweep
+
+  d_face = cluster_5quantities_sweep(data[:,0], sweep)
+  d_bg   = cluster_5quantities_sweep(data[:,1], sweep)
+
+  return dict([(k, numpy.hstack((d_face[k], d_bg[k]))) for k in sweep])
 
 def main():
 
   import bob
-  import numpy
 
   basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
   INPUTDIR = os.path.join(basedir, 'framediff')
@@ -39,16 +67,9 @@ def main():
       nargs='?', help='Base directory containing the frame differences to be treated by this procedure (defaults to "%(default)s")')
   parser.add_argument('outputdir', metavar='DIR', type=str, default=OUTPUTDIR,
       nargs='?', help='Base output directory for every file created by this procedure (defaults to "%(default)s")')
-  parser.add_argument('-n', '--window-size', dest="window_size", default=20,
-      type=int, help="determines the window size to be used when clustering frame-difference observations (defaults to %(default)s)"),
-  parser.add_argument('-o', '--overlap', dest="overlap", default=0, type=int,
-      help="determines the window overlapping; this number has to be between 0 (no overlapping) and 'window-size'-1 (defaults to %(default)s)"),
+  parallel.add_window_arguments(parser)
 
-  # The next option just returns the total number of cases we will be running
-  # It can be used to set jman --array option. To avoid user confusion, this
-  # option is suppressed # from the --help menu
-  parser.add_argument('--grid-count', dest='grid_count', action='store_true',
-      default=False, help=argparse.SUPPRESS)
+  parallel.add_grid_arguments(parser)
 
   # Adds database support using the common infrastructure
   # N.B.: Only databases with 'video' support
@@ -57,13 +78,12 @@ def main():
 
   args = parser.parse_args()
 
-  # checks window size and overlap
-  if args.window_size <= 0:
-    parser.error("window-size has to be greater than 0")
-  if args.overlap >= args.window_size or args.overlap < 0:
-    parser.error("overlap has to be smaller than window-size and greater or equal zero")
+  sweep = parallel.check_arguments(parser, args)
+
+  from .. import storage
 
-  from .. import cluster_5quantities
+  writer = None
+  if args.sparse: writer = storage.save_sparse
 
   # Creates an instance of the database
   db = args.cls(args)
@@ -71,39 +91,38 @@ def main():
   real, attack = db.get_all_data()
   process = real + attack
 
-  if args.grid_count:
-    print len(process)
-    sys.exit(0)
- 
-  # if we are on a grid environment, just find what I have to process.
-  if os.environ.has_key('SGE_TASK_ID'):
-    pos = int(os.environ['SGE_TASK_ID']) - 1
-    if pos >= len(process):
-      raise RuntimeError, "Grid request for job %d on a setup with %d jobs" % \
-          (pos, len(process))
-    process = [process[pos]]
+  def count_frames(obj):
+    return bob.io.peek(obj.make_path(args.inputdir, '.hdf5'))[1][0]
+  process = parallel.select_objects(args, process, count_frames)
 
   sys.stdout.write('Processing %d file(s)\n' % len(process))
   sys.stdout.flush()
 
-  counter = 0
-  for obj in process:
-    counter += 1
-
-    sys.stdout.write("Processing file %s [%d/%d] " % (obj.make_path(args.inputdir, '.hdf5'), counter, len(process)))
+  def process_file(index, obj):
 
     input = obj.load(args.inputdir, '.hdf5')    
-    d_face = cluster_5quantities(input[:,0], args.window_size, args.overlap)
-    d_bg   = cluster_5quantities(input[:,1], args.window_size, args.overlap)
-    
-    sys.stdout.write('Saving results to "%s"...\n' % args.outputdir)
-    obj.save(numpy.hstack((d_face, d_bg)), args.outputdir, '.hdf5')
+    clustered = cluster_differences(input, sweep)
+
+    for window_size, overlap in sweep:
+
+      outputdir = args.outputdir
+      if args.sweep is not None:
+        outputdir = configuration_dir(args.outputdir, window_size, overlap)
+
+      parallel.save(obj, clustered[(window_size, overlap)], outputdir,
+          '.hdf5', writer)
+
+    sys.stdout.write("Processed file %s [%d/%d], results saved to \"%s\"\n" %\
+        (obj.make_path(args.inputdir, '.hdf5'), index+1, len(process),
+          args.outputdir))
     sys.stdout.flush()
 
-  sys.stdout.write('\n')
-  sys.stdout.flush()
+    return len(input)
+
+  failures = parallel.run(process_file, process, args.jobs)
 
+  if failures: return 1
   return 0
 
 if __name__ == "__main__":
-  main()
+  sys.exit(main())
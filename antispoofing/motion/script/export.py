@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Exports a trained MLP or Linear Machine to a compact ``.npz`` file that
+can be used for scoring with NumPy only, without bob. Exported machines can be
+given to ``motion_make_scores.py`` instead of the original ones.
+"""
+
+import os
+import sys
+import argparse
+
+def main():
+  """Main method"""
+
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('machine', metavar='FILE', type=str, help='Name of the file containing the trained MLP or Linear Machine to be exported')
+  parser.add_argument('output', metavar='FILE', type=str, help='Name of the output file. It should have the ".npz" extension.')
+  parser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
+      default=False, help='Increases this script verbosity')
+
+  args = parser.parse_args()
+
+  if not os.path.exists(args.machine):
+    parser.error("Machine file `%s' does not exist" % args.machine)
+
+  if os.path.splitext(args.output)[1] != '.npz':
+    parser.error("Output file `%s' should have the \".npz\" extension" % args.output)
+
+  import numpy
+  from .. import inference
+
+  machine = inference.load_machine(args.machine)
+  exported = inference.convert(machine)
+  exported.save(args.output)
+
+  if args.verbose:
+    print "Exported machine with shape %s to `%s'" % \
+        ('-'.join([str(k) for k in exported.shape]), args.output)
+    print "Activations: %s" % ', '.join([k[0] for k in exported.activations])
+
+  # checks the exported machine gives the same results as the original one
+  data = numpy.random.randn(16, exported.shape[0])
+  data = data * exported.input_divide + exported.input_subtract
+  error = abs(inference.load(args.output)(data) - machine(data)).max()
+  if args.verbose: print "Maximum difference on random input: %.3e" % error
+  if error > 1e-8:
+    raise RuntimeError, "exported machine differs from the original (maximum difference is %.3e)" % error
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Calculates the clustered frame-difference features for all input videos in
+a single pass. This is equivalent to running ``motion_framediff.py`` followed
+by ``motion_diffcluster.py``, but the frame differences are kept in memory
+and, unless you ask for them, never written to disk. Only the final feature
+files are saved.
+
+This technique is described on the paper: Counter-Measures to Photo Attacks
+in Face Recognition: a public database and a baseline, Anjos & Marcel,
+IJCB'11."""
+
+import os, sys
+import argparse
+from . import parallel
+from .framediff import lbp_operator, compute_differences
+from .diffcluster import configuration_dir, cluster_differences
+
+def main():
+
+  import bob
+  import numpy
+
+  basedir = os.path.dirname(os.path.dirname(os.path.realpath(sys.argv[0])))
+  INPUTDIR = os.path.join(basedir, 'database')
+  OUTPUTDIR = os.path.join(basedir, 'clustered')
+
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parallel.add_video_arguments(parser)
+  parallel.add_window_arguments(parser)
+  parser.add_argument('-f', '--save-framediff', dest='framediffdir',
+      metavar='DIR', type=str, default=None,
+      help='If set, also save the frame differences in this directory, in the same format as motion_framediff.py')
+  parser.add_argument('inputdir', metavar='DIR', type=str, default=INPUTDIR,
+      nargs='?', help='Base directory containing the videos to be treated by this procedure (defaults to "%(default)s")')
+  parser.add_argument('outputdir', metavar='DIR', type=str, default=OUTPUTDIR,
+      nargs='?', help='Base output directory for every file created by this procedure defaults to "%(default)s")')
+
+  parallel.add_grid_arguments(parser)
+
+  # Adds database support using the common infrastructure
+  # N.B.: Only databases with 'video' support
+  import antispoofing.utils.db
+  antispoofing.utils.db.Database.create_parser(parser, 'video')
+
+  args = parser.parse_args()
+
+  sweep = parallel.check_arguments(parser, args)
+
+  from antispoofing.utils.faceloc import preprocess_detections
+  from .. import storage
+
+  writer = None
+  if args.sparse: writer = storage.save_sparse
+
+  # Creates an instance of the database
+  db = args.cls(args)
+
+  real, attack = db.get_all_data()
+  process = real + attack
+
+  def count_frames(obj):
+    return bob.io.VideoReader(obj.videofile(args.inputdir)).number_of_frames
+  process = parallel.select_objects(args, process, count_frames)
+
+  lbp = lbp_operator()
+
+  def process_video(index, obj):
+
+    filename = obj.videofile(args.inputdir)
+    input = bob.io.VideoReader(filename)
+
+    facefile = obj.facefile(args.inputdir)
+    locations = preprocess_detections(facefile, len(input),
+        facesize_filter=args.min_face_size)
+
+    message = "Processing file %s (%d frames) [%d/%d]..." % (filename,
+      input.number_of_frames, index+1, len(process))
+
+    # only stream the per-frame progress if we are not running in parallel
+    stream = None
+    if args.jobs == 1:
+      sys.stdout.write(message)
+      stream = sys.stdout
+
+    data = compute_differences(input, locations, lbp, args.chunk_size, stream)
+
+    if args.framediffdir is not None:
+      parallel.save(obj, data, args.framediffdir, '.hdf5')
+
+    clustered = cluster_differences(data, sweep)
+
+    for window_size, overlap in sweep:
+
+      outputdir = args.outputdir
+      if args.sweep is not None:
+        outputdir = configuration_dir(args.outputdir, window_size, overlap)
+
+      parallel.save(obj, clustered[(window_size, overlap)], outputdir,
+          '.hdf5', writer)
+
+    parallel.check_memory(args, message, filename)
+
+    return len(data)
+
+  failures = parallel.run(process_video, process, args.jobs)
+
+  if failures: return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
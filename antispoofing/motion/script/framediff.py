@@ -10,16 +10,108 @@ Marcel, IJCB'11."""
 
 import os, sys
 import argparse
+from . import parallel
 
-def compute_lbp(img):
+def lbp_operator():
+  """Returns the LBP operator used to encode frames before differencing"""
   import bob
+
+  return bob.ip.LBP(neighbors=8, uniform=True, circular=False, radius=1, to_average=False, elbp_type=bob.ip.ELBPType.REGULAR)
+
+def compute_lbp(img, lbp=None, lbpimage=None):
+  """Encodes the input gray-scaled image with LBP codes.
+
+  If given, the operator ``lbp`` and the output ``lbpimage`` (a ``uint16``
+  array with the right shape) are re-used, avoiding a new allocation at every
+  call.
+  """
   import numpy
-  
-  lbp = bob.ip.LBP(neighbors=8, uniform=True, circular=False, radius=1, to_average=False, elbp_type=bob.ip.ELBPType.REGULAR)
-  lbpimage = numpy.ndarray(lbp.get_lbp_shape(img), 'uint16') # allocating the image with lbp codes
+
+  if lbp is None: lbp = lbp_operator()
+  if lbpimage is None: # allocating the image with lbp codes
+    lbpimage = numpy.ndarray(lbp.get_lbp_shape(img), 'uint16')
   lbp(img, lbpimage) # calculating the lbp image
   return lbpimage
 
+def compute_differences(reader, locations, lbp, chunk_size, stream=None):
+  """Calculates the normalized frame differences for face and background for
+  all frames in a video.
+
+  Frames are streamed from the reader, so we never keep more than a stack of
+  ``chunk_size + 1`` LBP encoded images in memory, no matter how long the
+  video is. Each frame is LBP encoded only once. Frame differences for every
+  chunk are calculated at once, using
+  :py:func:`antispoofing.motion.eval_stack_differences`.
+
+  Keyword Parameters:
+
+  reader
+    An iterable returning the colored frames of the video, like a
+    ``bob.io.VideoReader``
+
+  locations
+    An iterable containing the face locations (BoundingBox objects or None)
+    for every frame in the video
+
+  lbp
+    The LBP operator to use, as returned by :py:func:`lbp_operator`
+
+  chunk_size
+    The number of frame differences to calculate at once
+
+  stream
+    If given, a file-like object where to write one character per frame
+    indicating if the frame contains a valid face detection (``.``) or not
+    (``x``).
+
+  Returns an array with shape ``(T, 2)`` containing the face and background
+  differences for every frame, where ``T`` is the number of frames read.
+  """
+  import bob
+  import numpy
+  from .. import bbx_array, eval_stack_differences
+
+  bbx = bbx_array(locations)
+  data = numpy.ndarray((len(bbx), 2), dtype='float64')
+  data[0] = (numpy.NaN, numpy.NaN)
+
+  gray = None
+  stack = None
+  start = 0 #index of the first frame in the stack
+  used = 0 #number of frames currently in the stack
+
+  def flush():
+    """Calculates the differences for the frames currently in the stack"""
+    stop = start + used
+    data[start+1:stop] = eval_stack_differences(stack[:used],
+        bbx[start:stop])[1:]
+    if stream is not None:
+      stream.write(''.join(['.' if k else 'x' for k in bbx[start+1:stop,4]]))
+      stream.flush()
+
+  for frame in reader:
+
+    if gray is None:
+      gray = bob.ip.rgb_to_gray(frame)
+      stack = numpy.ndarray((chunk_size+1,) + lbp.get_lbp_shape(gray),
+          'uint16')
+    else:
+      bob.ip.rgb_to_gray(frame, gray)
+
+    compute_lbp(gray, lbp, stack[used])
+    used += 1
+
+    if used == len(stack):
+      flush()
+      # the last frame in this chunk is the first one of the next
+      stack[0] = stack[used-1]
+      start += used - 1
+      used = 1
+
+  if used > 1: flush()
+
+  # some codecs report more frames than they can actually decode
+  return data[:(start+used)]
 
 def main():
   
@@ -32,19 +124,13 @@ def main():
 
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
-  parser.add_argument('-m', '--mininum-face-size', dest='min_face_size', 
-      metavar='PIXELS', type=int, default=0,
-      help='Minimum face size to be considered when pre-processing and extrapolating detections (defaults to %(default)s)')
+  parallel.add_video_arguments(parser)
   parser.add_argument('inputdir', metavar='DIR', type=str, default=INPUTDIR,
       nargs='?', help='Base directory containing the videos to be treated by this procedure (defaults to "%(default)s")')
   parser.add_argument('outputdir', metavar='DIR', type=str, default=OUTPUTDIR,
       nargs='?', help='Base output directory for every file created by this procedure defaults to "%(default)s")')
 
-  # The next option just returns the total number of cases we will be running
-  # It can be used to set jman --array option. To avoid user confusion, this
-  # option is suppressed # from the --help menu
-  parser.add_argument('--grid-count', dest='grid_count', action='store_true',
-      default=False, help=argparse.SUPPRESS)
+  parallel.add_grid_arguments(parser)
 
   # Adds database support using the common infrastructure
   # N.B.: Only databases with 'video' support
@@ -53,12 +139,9 @@ def main():
 
   args = parser.parse_args()
 
-  # checks face sizes
-  if args.min_face_size < 0:
-    parser.error('Face size cannot be less than zero. Give a value in pixels')
+  parallel.check_arguments(parser, args)
 
   from antispoofing.utils.faceloc import preprocess_detections
-  from .. import eval_face_differences, eval_background_differences
 
   # Creates an instance of the database
   db = args.cls(args)
@@ -66,22 +149,14 @@ def main():
   real, attack = db.get_all_data()
   process = real + attack
 
-  if args.grid_count:
-    print len(process)
-    sys.exit(0)
- 
-  # if we are on a grid environment, just find what I have to process.
-  if os.environ.has_key('SGE_TASK_ID'):
-    pos = int(os.environ['SGE_TASK_ID']) - 1
-    if pos >= len(process):
-      raise RuntimeError, "Grid request for job %d on a setup with %d jobs" % \
-          (pos, len(process))
-    process = [process[pos]]
-
-  counter = 0
-  for obj in process:
-    counter += 1
- 
+  def count_frames(obj):
+    return bob.io.VideoReader(obj.videofile(args.inputdir)).number_of_frames
+  process = parallel.select_objects(args, process, count_frames)
+
+  lbp = lbp_operator()
+
+  def process_video(index, obj):
+
     filename = obj.videofile(args.inputdir)
     input = bob.io.VideoReader(filename)
 
@@ -89,40 +164,27 @@ def main():
     locations = preprocess_detections(facefile, len(input), 
         facesize_filter=args.min_face_size)
 
-    sys.stdout.write("Processing file %s (%d frames) [%d/%d]..." % (filename,
-      input.number_of_frames, counter, len(process)))
+    message = "Processing file %s (%d frames) [%d/%d]..." % (filename,
+      input.number_of_frames, index+1, len(process))
 
-    # start the work here...
-    vin = input.load() # load all in one shot.
-    prev = bob.ip.rgb_to_gray(vin[0,:,:,:])
-    curr = numpy.empty_like(prev)
-    data = numpy.zeros((len(vin), 2), dtype='float64')
-    data[0] = (numpy.NaN, numpy.NaN)
+    # only stream the per-frame progress if we are not running in parallel
+    stream = None
+    if args.jobs == 1:
+      sys.stdout.write(message)
+      stream = sys.stdout
 
-    for k in range(1, vin.shape[0]):
-      bob.ip.rgb_to_gray(vin[k,:,:,:], curr)
+    data = compute_differences(input, locations, lbp, args.chunk_size, stream)
 
-      if locations[k] and locations[k].is_valid():
-        sys.stdout.write('.')
-        data[k][0] = eval_face_differences(compute_lbp(prev), compute_lbp(curr), locations[k])
-        data[k][1] = eval_background_differences(compute_lbp(prev), compute_lbp(curr), locations[k], None)
-      else:
-        sys.stdout.write('x')
-        data[k] = (numpy.NaN, numpy.NaN)
+    parallel.save(obj, data, args.outputdir, '.hdf5')
 
-      sys.stdout.flush()
+    parallel.check_memory(args, message, filename)
 
-      # swap buffers: curr <=> prev
-      tmp = prev
-      prev = curr
-      curr = tmp
+    return len(data)
 
-    obj.save(data, args.outputdir, '.hdf5')
-    
-    sys.stdout.write('\n')
-    sys.stdout.flush()
+  failures = parallel.run(process_video, process, args.jobs)
 
+  if failures: return 1
   return 0
 
 if __name__ == "__main__":
-  main()
+  sys.exit(main())
@@ -17,6 +17,7 @@ import bob
 import numpy
 import argparse
 from .. import ml
+from .. import storage
 import ConfigParser
 
 def main():
@@ -35,6 +36,10 @@ def main():
       dest='overwrite', default=False, help='If set and the destination directory exists, overwrite the results contained there')
   parser.add_argument('-V', '--verbose', action='store_true', dest='verbose',
       default=False, help='Increases this script verbosity')
+  parser.add_argument('-s', '--streaming', action='store_true',
+      dest='streaming', default=False, help='If set, train the LDA from statistics accumulated in a single pass over the input files, instead of loading all the training data in memory. The memory used depends only on the number of features. Rows of reduced input files (see motion_coreset.py) are weighted in this mode only.')
+  parser.add_argument('-j', '--jobs', dest='jobs', metavar='INT', type=int,
+      default=1, help='Number of processes to use for accumulating the statistics in streaming mode (defaults to %(default)s)')
 
   # Adds database support using the common infrastructure
   # N.B.: Only databases with 'video' support
@@ -43,6 +48,9 @@ def main():
 
   args = parser.parse_args()
 
+  if args.jobs <= 0:
+    parser.error("the number of jobs has to be greater than zero")
+
   start_time = time.time()
   paramfile = ConfigParser.SafeConfigParser()
   paramfile.add_section('time')
@@ -72,39 +80,89 @@ def main():
   db = args.cls(args) 
   real, attack = db.get_train_data()
   
+  # uses the consolidated store, if one is available
+  store = storage.open_store(use_inputdir[0])
+  if args.verbose and store is not None:
+    print "Using consolidated store with %d file(s)" % len(store)
+
   def merge_data(flist):
-    d = bob.io.load([k.make_path(use_inputdir[0], '.hdf5') for k in flist])
-    return d[~numpy.isnan(d.sum(axis=1)),:]
+    return storage.merge_valid([k.make_path(use_inputdir[0], '.hdf5') for k in flist], store)
 
-  real = merge_data(real)
-  attack = merge_data(attack)
+  def load_valid(filename):
+    return storage.load_valid(filename, store)
 
-  if args.verbose: print "Evaluating mean and standard deviation..."
-  from antispoofing.utils.ml.norm import calc_mean_std
-  mean, std = calc_mean_std(real, attack, nonStdZero=True)
+  def load_weighted(filename):
+    # rows of reduced files are weighted by the number of rows they stand for
+    data = load_valid(filename)
+    weights = storage.load_weights(filename)
+    if weights is None: return data
+    return data, weights
 
-  if args.verbose: print "Training LDA..."
-  from antispoofing.utils.ml.norm import zeromean_unitvar_norm
-  real = zeromean_unitvar_norm(real, mean, std)
-  attack = zeromean_unitvar_norm(attack, mean, std)
-  from antispoofing.utils.ml.lda import make_lda
-  machine = make_lda([real, attack])
+  def accumulate(flist):
+    return ml.stats.accumulate([k.make_path(use_inputdir[0], '.hdf5') for k in flist], load_weighted, args.jobs)
 
-  # adjust some details of the final machine to be saved
-  machine.resize(machine.shape[0], 1)
-  
-  # so we get real and attacks on the "right" side of the axis
-  machine.weights = -1 * machine.weights
+  if args.streaming:
+
+    if args.verbose: print "Accumulating statistics..."
+    real = accumulate(real)
+    attack = accumulate(attack)
+
+    if args.verbose: print "Evaluating mean and standard deviation..."
+    mean, std = ml.stats.balanced_mean_std(real, attack, nonStdZero=True)
+
+    if args.verbose: print "Training LDA..."
+    weights = ml.stats.lda([real, attack], mean, std)[0][:,0]
+
+    # so we get real and attacks on the "right" side of the axis
+    if numpy.dot(real.mean - attack.mean, weights / std) < 0:
+      weights = -1 * weights
+
+    # eigenvectors are normalized against the within-class scatter - scales
+    # them to unit norm, like the in-memory trainer, so scores are comparable
+    weights = weights / numpy.linalg.norm(weights)
+
+    machine = bob.machine.LinearMachine(len(weights), 1)
+    machine.weights = weights.reshape(len(weights), 1)
+    machine.biases = numpy.zeros((1,), dtype='float64')
+
+  else:
+
+    real = merge_data(real)
+    attack = merge_data(attack)
+
+    if args.verbose: print "Evaluating mean and standard deviation..."
+    from antispoofing.utils.ml.norm import calc_mean_std
+    mean, std = calc_mean_std(real, attack, nonStdZero=True)
+
+    if args.verbose: print "Training LDA..."
+    from antispoofing.utils.ml.norm import zeromean_unitvar_norm
+    real = zeromean_unitvar_norm(real, mean, std)
+    attack = zeromean_unitvar_norm(attack, mean, std)
+    from antispoofing.utils.ml.lda import make_lda
+    machine = make_lda([real, attack])
+
+    # adjust some details of the final machine to be saved
+    machine.resize(machine.shape[0], 1)
+    
+    # so we get real and attacks on the "right" side of the axis
+    machine.weights = -1 * machine.weights
 
   machine.input_subtract = mean
   machine.input_divide = std
 
+  def project(flist):
+    """Returns the scores for all valid rows in the given files"""
+    if not args.streaming: return machine(merge_data(flist))[:,0]
+    retval = [numpy.ndarray((0,), dtype='float64')]
+    for k in flist:
+      data = load_valid(k.make_path(use_inputdir[0], '.hdf5'))
+      if len(data): retval.append(machine(data)[:,0])
+    return numpy.hstack(retval)
+
   if args.verbose: print "Performance evaluation:"
   real, attack = db.get_devel_data()
-  real = merge_data(real)
-  attack = merge_data(attack)
-  pos = machine(real)[:,0]
-  neg = machine(attack)[:,0]
+  pos = project(real)
+  neg = project(attack)
 
   thres = bob.measure.eer_threshold(neg, pos)
   
@@ -118,10 +176,8 @@ def main():
   print "     * HTER: %.3f%%" % (50*(far+frr))
   
   real, attack = db.get_test_data()
-  real = merge_data(real)
-  attack = merge_data(attack)
-  pos = machine(real)[:,0]
-  neg = machine(attack)[:,0]
+  pos = project(real)
+  neg = project(attack)
   far, frr = bob.measure.farfrr(neg, pos, thres)
   good_neg = bob.measure.correctly_classified_negatives(neg, thres).sum()
   good_pos = bob.measure.correctly_classified_positives(pos, thres).sum()
@@ -146,8 +202,8 @@ def main():
   datapath = [os.path.realpath(k) for k in use_inputdir]
   paramfile.set('data', 'database', args.name)
   paramfile.set('data', 'input', '\n'.join(datapath))
-  paramfile.set('data', 'train-real', str(len(real)))
-  paramfile.set('data', 'train-attack', str(len(attack)))
+  paramfile.set('data', 'train-real', str(len(pos)))
+  paramfile.set('data', 'train-attack', str(len(neg)))
 
   paramfile.add_section('lda')
   paramfile.set('lda', 'shape', '-'.join([str(k) for k in machine.shape]))
@@ -4,16 +4,55 @@
 # Thu 28 Jul 2011 14:18:23 CEST 
 
 """This script will run feature vectors through a trained MLP and will produce
-score files for every individual video file in the database.
+score files for every individual video file in the database. The machine can
+be given as saved by the training programs or as exported by
+``motion_export.py``.
 """
 
 import os
 import sys
-import bob
 import numpy
 import argparse
-from .. import ml
-import ConfigParser
+from .. import storage
+from .. import inference
+from . import parallel
+
+def score(machine, inputs):
+  """Runs the feature vectors of many videos through a machine at once.
+
+  The valid rows (those with no NaNs) of all inputs are gathered in a single
+  matrix, so the machine is only called once. Results are then scattered back
+  to the right positions in each video.
+
+  Keyword Parameters:
+
+  machine
+    The MLP or LinearMachine to use for scoring
+
+  inputs
+    A list of 2D arrays with the feature vectors of every video
+
+  Returns a list of arrays with shape ``(T, 1)``, one per input, in which
+  rows with invalid features are set to NaN.
+  """
+
+  valid = [~numpy.isnan(k.sum(axis=1)) for k in inputs]
+  data = numpy.vstack([k[v,:] for k, v in zip(inputs, valid)])
+
+  scores = numpy.ndarray((0, 1), dtype='float64')
+  if len(data): scores = machine(data)
+
+  retval = []
+  start = 0
+  for k, v in zip(inputs, valid):
+    output = numpy.ndarray((len(k), 1), dtype='float64')
+    output[~v] = numpy.NaN
+    end = start + v.sum()
+    output[v] = scores[start:end]
+    start = end
+    retval.append(output)
+
+  return retval
 
 def main():
   """Main method"""
@@ -32,6 +71,12 @@ def main():
   parser.add_argument('outputdir', metavar='DIR', type=str, default=OUTPUTDIR, nargs='?', help='Base directory that will be used to save the results (defaults to "%(default)s").')
   parser.add_argument('-v', '--verbose', action='store_true', dest='verbose',
       default=False, help='Increases this script verbosity')
+  parser.add_argument('-F', '--float32', action='store_true', dest='float32',
+      default=False, help='If set and the machine was exported with motion_export.py, run the calculations in single precision, which is faster but less precise')
+  parser.add_argument('-b', '--batch-size', dest='batch_size', metavar='INT',
+      type=int, default=64, help='Number of videos whose feature vectors are run through the machine at once (defaults to %(default)s)')
+
+  parallel.add_arguments(parser)
 
   # Adds database support using the common infrastructure
   # N.B.: Only databases with 'video' support
@@ -46,49 +91,53 @@ def main():
   if not os.path.exists(args.machine):
     parser.error("Machine file `%s' does not exist" % args.machine)
 
+  if args.jobs <= 0:
+    parser.error("the number of jobs has to be greater than zero")
+
+  if args.batch_size <= 0:
+    parser.error("the batch size has to be greater than zero")
+
   if not os.path.exists(args.outputdir):
     if args.verbose: print "Creating output directory `%s'..." % args.outputdir
-    bob.db.utils.makedirs_safe(args.outputdir)
+    try:
+      os.makedirs(args.outputdir)
+    except OSError:
+      if not os.path.isdir(args.outputdir): raise
 
   # Creates an instance of the database
   db = args.cls(args)
   real, attack = db.get_all_data()
   process = real + attack
 
-  macfile = bob.io.HDF5File(args.machine)
-
-  try:
-    machine = bob.machine.MLP(macfile)
-  except:
-    try:
-      machine = bob.machine.LinearMachine(macfile)
-    except:
-      print "Cannot load Linear or MLP machine from file %s" % args.machine
-      raise
+  machine = inference.load_machine(args.machine,
+      'float32' if args.float32 else 'float64')
 
-  counter = 0
-  for obj in process:
-    counter += 1
+  # uses the consolidated store, if one is available
+  store = storage.open_store(args.inputdir)
 
-    if args.verbose:
-      filename = obj.make_path(args.inputdir, extension='.hdf5')
-      sys.stdout.write("Processing file %s [%d/%d] " % (filename, counter, len(process)))
+  def process_batch(index, batch):
 
-    input = obj.load(args.inputdir, '.hdf5')
-    valid_index = ~numpy.isnan(input.sum(axis=1))
-    valid_data = input[valid_index,:]
-    valid_output = machine(valid_data)
-    output = numpy.ndarray((len(input), 1), dtype='float64')
-    output[valid_index] = valid_output
-    output[~valid_index] = numpy.NaN
+    inputs = [storage.load(k.make_path(args.inputdir, '.hdf5'), store) \
+        for k in batch]
 
-    obj.save(output, args.outputdir, '.hdf5')
+    for obj, output in zip(batch, score(machine, inputs)):
+      parallel.save(obj, output, args.outputdir, '.hdf5')
 
     if args.verbose:
-      sys.stdout.write('Saving results to "%s"...\n' % args.outputdir)
+      for obj in batch:
+        filename = obj.make_path(args.inputdir, extension='.hdf5')
+        sys.stdout.write("Processed file %s [batch %d/%d], results saved to \"%s\"\n" % (filename, index+1, len(process), args.outputdir))
       sys.stdout.flush()
 
+    return sum([len(k) for k in inputs])
+
+  process = parallel.batches(process, args.batch_size)
+  failures = parallel.run(process_batch, process, args.jobs)
+
+  if failures: return 1
+
   if args.verbose: print "All done, bye!"
+  return 0
  
 if __name__ == '__main__':
-  main()
+  sys.exit(main())
@@ -14,6 +14,7 @@ import sys
 import bob
 import numpy
 import argparse
+from .. import storage
 
 def main():
   """Main method"""
@@ -47,6 +48,9 @@ def main():
 
   db = args.cls(args)
 
+  # uses the consolidated store, if one is available
+  store = storage.open_store(args.inputdir)
+
   def write_file(group):
 
     if args.verbose:
@@ -68,7 +72,7 @@ def main():
       if args.verbose: 
         print "Processing file %s [%d/%d]..." % (obj.make_path(), counter, total)
 
-      arr = obj.load(args.inputdir, '.hdf5')
+      arr = storage.load(obj.make_path(args.inputdir, '.hdf5'), store)
       arr = arr[~numpy.isnan(arr)] #remove NaN entries => invalid
       avg = numpy.mean(arr[:args.average])
 
@@ -84,7 +88,7 @@ def main():
       if args.verbose: 
         print "Processing file %s [%d/%d]..." % (obj.make_path(), counter, total)
 
-      arr = obj.load(args.inputdir, '.hdf5')
+      arr = storage.load(obj.make_path(args.inputdir, '.hdf5'), store)
       arr = arr[~numpy.isnan(arr)] #remove NaN entries => invalid
       avg = numpy.mean(arr[:args.average])
       
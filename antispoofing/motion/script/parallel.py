@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Utilities to run per-video jobs in parallel on a single machine, without
+requiring a grid.
+"""
+
+import os
+import sys
+import time
+import datetime
+import traceback
+
+# Task being executed by the workers, set before they are forked so the
+# database object list is shared with them instead of being serialized.
+_TASK = None
+
+def add_arguments(parser):
+  """Adds the options controlling local parallelization to the parser"""
+
+  parser.add_argument('-j', '--jobs', dest='jobs', metavar='INT', type=int,
+      default=1, help='Number of processes to use for treating the videos in this machine. Errors on individual videos are reported without aborting the whole run (defaults to %(default)s)')
+
+def add_shard_arguments(parser):
+  """Adds the options controlling frame-count balanced sharding to the
+  parser"""
+
+  parser.add_argument('--shard', dest='shard', metavar='I/N', type=shard,
+      default=None, help='If set, divide the videos in N shards of roughly the same total number of frames and only process the I-th one (counting from 1). This is useful for grid execution, e.g., with --shard=%%(SGE_TASK_ID)s/50 and an array of 50 jobs. The values are interpolated with os.environ.')
+  parser.add_argument('--frame-manifest', dest='manifest', metavar='FILE',
+      type=str, default=None, help='If set, cache the number of frames of every video in this text file, so they do not need to be counted again on subsequent runs')
+
+def shard(value):
+  """Parses a shard specification in the form ``I/N``, returning a tuple with
+  the zero-based shard index and the total number of shards."""
+
+  import argparse
+
+  try:
+    index, total = [int(k) for k in (value % os.environ).split('/')]
+  except (ValueError, KeyError):
+    raise argparse.ArgumentTypeError, "shard `%s' is not in the form I/N" % value
+  if total <= 0 or index <= 0 or index > total:
+    raise argparse.ArgumentTypeError, "shard `%s' should satisfy 1 <= I <= N" % value
+  return index-1, total
+
+def add_grid_arguments(parser):
+  """Adds the options controlling local parallelization, sharding and grid
+  execution to the parser"""
+
+  import argparse
+
+  add_arguments(parser)
+  add_shard_arguments(parser)
+
+  # The next option just returns the total number of cases we will be running
+  # It can be used to set jman --array option. To avoid user confusion, this
+  # option is suppressed # from the --help menu
+  parser.add_argument('--grid-count', dest='grid_count', action='store_true',
+      default=False, help=argparse.SUPPRESS)
+
+def add_video_arguments(parser):
+  """Adds the options controlling how videos are read to the parser"""
+
+  parser.add_argument('-m', '--mininum-face-size', dest='min_face_size',
+      metavar='PIXELS', type=int, default=0,
+      help='Minimum face size to be considered when pre-processing and extrapolating detections (defaults to %(default)s)')
+  parser.add_argument('-M', '--max-memory', dest='max_memory',
+      metavar='MB', type=int, default=0,
+      help='If set to a value greater than zero, consider the processing of a video failed if the peak resident memory while treating it exceeds this number of megabytes. The peak memory is always reported after each video is treated. On Linux, the peak is measured for every video; elsewhere, it is the peak of the whole process so far, which may include that of previous (larger) videos (defaults to %(default)s)')
+  parser.add_argument('-c', '--chunk-size', dest='chunk_size',
+      metavar='FRAMES', type=int, default=32,
+      help='Number of frame differences to be calculated at once. Larger values use more memory, but less time (defaults to %(default)s)')
+
+def configurations(value):
+  """Parses a list of window configurations like ``20:0,20:10,40:0``, returning
+  a list of ``(window_size, overlap)`` tuples"""
+
+  import argparse
+
+  try:
+    retval = [tuple([int(v) for v in k.split(':')]) for k in value.split(',')]
+  except ValueError:
+    raise argparse.ArgumentTypeError, "configurations `%s' should be given as a comma-separated list of window-size:overlap pairs" % value
+
+  for k in retval:
+    if len(k) != 2:
+      raise argparse.ArgumentTypeError, "configuration `%s' should be given as window-size:overlap" % ':'.join([str(v) for v in k])
+
+  return retval
+
+def add_window_arguments(parser):
+  """Adds the options controlling the clustering windows and the format of
+  the clustered values to the parser"""
+
+  parser.add_argument('-n', '--window-size', dest="window_size", default=20,
+      type=int, help="determines the window size to be used when clustering frame-difference observations (defaults to %(default)s)"),
+  parser.add_argument('-o', '--overlap', dest="overlap", default=0, type=int,
+      help="determines the window overlapping; this number has to be between 0 (no overlapping) and 'window-size'-1 (defaults to %(default)s)"),
+  parser.add_argument('-S', '--sweep', dest='sweep', metavar='N:O[,N:O...]',
+      type=configurations, default=None, help="if set, ignore the window-size and overlap options and compute the clustered values for all the given window-size:overlap pairs at once, treating each input only once. The results for every configuration are saved in a sub-directory of the output directory named 'window<N>-overlap<O>'")
+  parser.add_argument('-s', '--sparse', dest='sparse', action='store_true',
+      default=False, help="if set, only save the rows corresponding to the end of every window (and their positions), instead of the whole array with NaNs everywhere else. All programs reading the clustered values understand both formats")
+
+def check_arguments(parser, args):
+  """Validates the options added by the functions in this module, reporting
+  errors through the parser. Returns the list of ``(window_size, overlap)``
+  configurations to compute, if window options were added, or ``None``."""
+
+  # checks face sizes
+  if getattr(args, 'min_face_size', 0) < 0:
+    parser.error('Face size cannot be less than zero. Give a value in pixels')
+
+  if getattr(args, 'chunk_size', 1) <= 0:
+    parser.error('Chunk size has to be greater than zero')
+
+  if getattr(args, 'max_memory', 0) < 0:
+    parser.error('Maximum memory cannot be less than zero. Give a value in megabytes')
+
+  if args.jobs <= 0:
+    parser.error('The number of jobs has to be greater than zero')
+
+  if not hasattr(args, 'window_size'): return None
+
+  # checks window sizes and overlaps
+  if args.sweep is None: sweep = [(args.window_size, args.overlap)]
+  else: sweep = sorted(set(args.sweep))
+
+  for window_size, overlap in sweep:
+    if window_size <= 0:
+      parser.error("window-size has to be greater than 0")
+    if overlap >= window_size or overlap < 0:
+      parser.error("overlap has to be smaller than window-size and greater or equal zero")
+
+  return sweep
+
+def select_objects(args, objects, counter):
+  """Returns the objects this process should treat.
+
+  If ``--grid-count`` was given, prints the number of objects and exits. If a
+  shard was given, returns the objects in that shard (see
+  :py:func:`select_shard`, ``counter`` returning the number of frames of an
+  object). Otherwise, inside an SGE array job, returns the single object
+  matching the task identifier. Otherwise, returns all objects.
+  """
+
+  if args.grid_count:
+    print len(objects)
+    sys.exit(0)
+
+  # if we were asked to, just process a shard of the videos, balanced by the
+  # number of frames
+  if args.shard is not None:
+    return select_shard(objects, args.shard, counter, args.manifest)
+
+  # if we are on a grid environment, just find what I have to process.
+  if os.environ.has_key('SGE_TASK_ID'):
+    pos = int(os.environ['SGE_TASK_ID']) - 1
+    if pos >= len(objects):
+      raise RuntimeError, "Grid request for job %d on a setup with %d jobs" % \
+          (pos, len(objects))
+    return [objects[pos]]
+
+  return objects
+
+def reset_peak_memory():
+  """Resets the peak resident set size (RSS) of this process, so
+  :py:func:`peak_memory` measures it from now on. This is only possible on
+  Linux. Returns ``True`` if the peak could be reset."""
+
+  try:
+    f = open('/proc/self/clear_refs', 'w')
+    f.write('5')
+    f.close()
+    return True
+  except (IOError, OSError):
+    return False
+
+def peak_memory():
+  """Returns the peak resident set size (RSS) of this process, in megabytes.
+
+  On Linux, this is the peak since the last call to
+  :py:func:`reset_peak_memory`, which happens before every video is treated
+  (see :py:func:`run`). Elsewhere, this is the high-water mark for the whole
+  process and, therefore, it can only grow as more videos are treated.
+  """
+  try:
+    f = open('/proc/self/status', 'r')
+    try:
+      for line in f:
+        if line.startswith('VmHWM:'): return int(line.split()[1]) / 1024.
+    finally:
+      f.close()
+  except (IOError, OSError):
+    pass
+
+  import resource
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin': return peak / (1024. * 1024.) #in bytes
+  return peak / 1024. #in kilobytes
+
+def check_memory(args, message, filename):
+  """Reports the peak memory after a video was treated (after ``message``,
+  unless it was already printed, in sequential runs) and raises an error if
+  it exceeds the limit given with ``--max-memory``"""
+
+  peak = peak_memory()
+  if args.jobs == 1: message = ''
+  sys.stdout.write(message + ' (peak RSS: %.1f MB)\n' % peak)
+  sys.stdout.flush()
+
+  if args.max_memory and peak > args.max_memory:
+    raise RuntimeError, "Peak memory usage (%.1f MB) exceeded the limit of %d MB while processing file %s" % (peak, args.max_memory, filename)
+
+def balanced_partition(weights, n):
+  """Partitions items in ``n`` buckets of roughly the same total weight.
+
+  We use greedy longest-first packing: items are sorted by decreasing weight
+  and each one is assigned to the bucket with the smallest total weight so
+  far.
+
+  Keyword Parameters:
+
+  weights
+    An iterable with the weights of every item (e.g. number of frames)
+
+  n
+    The number of buckets to create
+
+  Returns a list of ``n`` lists containing the indexes of the items in each
+  bucket, in their original order.
+  """
+
+  import heapq
+
+  heap = [(0, k) for k in range(n)]
+  buckets = [[] for k in range(n)]
+
+  order = sorted(range(len(weights)), key=lambda k: weights[k], reverse=True)
+  for item in order:
+    total, bucket = heapq.heappop(heap)
+    buckets[bucket].append(item)
+    heapq.heappush(heap, (total + weights[item], bucket))
+
+  return [sorted(k) for k in buckets]
+
+def frame_counts(objects, counter, manifest=None):
+  """Returns the number of frames for every object given.
+
+  Keyword Parameters:
+
+  objects
+    A list of database objects
+
+  counter
+    A callable that returns the number of frames for a given object
+
+  manifest
+    If given, the name of a text file that caches the number of frames for
+    every object, one per line, as ``<path> <frames>``. Missing entries are
+    calculated and the file is updated.
+  """
+
+  cache = {}
+  if manifest is not None and os.path.exists(manifest):
+    for line in open(manifest, 'rt'):
+      line = line.strip()
+      if not line: continue
+      path, count = line.rsplit(' ', 1)
+      cache[path] = int(count)
+
+  retval = []
+  updated = False
+  for obj in objects:
+    path = obj.make_path()
+    if path not in cache:
+      cache[path] = counter(obj)
+      updated = True
+    retval.append(cache[path])
+
+  if manifest is not None and updated:
+    tmpname = '%s.tmp%d' % (manifest, os.getpid())
+    f = open(tmpname, 'wt')
+    for path in sorted(cache.keys()): f.write('%s %d\n' % (path, cache[path]))
+    f.close()
+    os.rename(tmpname, manifest)
+
+  return retval
+
+def select_shard(objects, shard, counter, manifest=None):
+  """Returns the objects in the given shard, after partitioning all objects in
+  buckets of roughly the same total number of frames. See
+  :py:func:`balanced_partition` and :py:func:`frame_counts`."""
+
+  index, total = shard
+  weights = frame_counts(objects, counter, manifest)
+  return [objects[k] for k in balanced_partition(weights, total)[index]]
+
+class Batch(object):
+  """A group of database objects that are treated together by a single call
+  to the function given to :py:func:`run`"""
+
+  def __init__(self, objects):
+    self.objects = objects
+
+  def __len__(self):
+    return len(self.objects)
+
+  def __iter__(self):
+    return iter(self.objects)
+
+  def make_path(self, *args, **kwargs):
+    return ', '.join([k.make_path(*args, **kwargs) for k in self.objects])
+
+def batches(objects, size):
+  """Groups the database objects in a list of :py:class:`Batch` objects
+  with (at most) ``size`` elements each"""
+
+  return [Batch(objects[k:k+size]) for k in range(0, len(objects), size)]
+
+def save(obj, data, directory, extension='.hdf5', writer=None):
+  """Saves the data for the given database object atomically.
+
+  The data is first written to a temporary file on the same directory as the
+  final destination, which is then renamed. Readers will never see a partially
+  written file, even if the process is killed in the middle of the operation.
+
+  Keyword Parameters:
+
+  obj
+    The database object (File) the data belongs to
+
+  data
+    The array to be saved
+
+  directory
+    The base output directory
+
+  extension
+    The extension of the output file, which determines its format
+
+  writer
+    A callable like ``writer(data, filename)`` to write the data. If not set,
+    use ``bob.io.save``.
+  """
+  import bob
+
+  filename = obj.make_path(directory, extension)
+  bob.db.utils.makedirs_safe(os.path.dirname(filename))
+
+  base, ext = os.path.splitext(filename)
+  tmpname = '%s.tmp%d%s' % (base, os.getpid(), ext)
+
+  if writer is None: writer = bob.io.save
+
+  try:
+    writer(data, tmpname)
+    os.rename(tmpname, filename)
+  finally:
+    if os.path.exists(tmpname): os.unlink(tmpname)
+
+def _run_one(index):
+  """Runs the current task on a single object, capturing errors"""
+
+  function, objects = _TASK
+
+  reset_peak_memory() #so peak memory reports are per video
+  start = time.time()
+  try:
+    size = function(index, objects[index])
+    return index, size, time.time() - start, None
+  except Exception:
+    return index, 0, time.time() - start, traceback.format_exc()
+
+def run(function, objects, jobs=1, stream=sys.stdout):
+  """Calls a function on every database object given, using a number of
+  local processes.
+
+  Errors are captured and reported for each object individually (with their
+  traceback, as soon as they happen), so a single failure does not abort the
+  whole run. An aggregate throughput summary, listing the objects that
+  failed, is printed in the end. Scripts should exit with a non-zero status
+  if there are failures.
+
+  Keyword Parameters:
+
+  function
+    A callable that will be called like ``function(index, obj)`` for every
+    object in the list. It should return the number of frames (or rows)
+    treated, which is used to calculate the throughput.
+
+  objects
+    A list of database objects to be processed. It may also contain
+    :py:class:`Batch` objects, in which case the function is called once
+    per batch.
+
+  jobs
+    The number of processes to use. If set to 1, everything runs in the
+    current process.
+
+  stream
+    A file-like object where to write the summary and the error report
+
+  Returns a list of tuples ``(obj, traceback)``, one for every object for
+  which the processing failed.
+  """
+
+  global _TASK
+  _TASK = (function, objects)
+
+  start = time.time()
+  pool = None
+
+  if jobs > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    results = pool.imap_unordered(_run_one, range(len(objects)))
+  else:
+    import itertools
+    results = itertools.imap(_run_one, range(len(objects)))
+
+  failures = []
+  frames = 0
+
+  try:
+    for index, size, elapsed, error in results:
+      frames += size
+      if error is not None:
+        failures.append((objects[index], error))
+        stream.write('Error processing %s:\n%s\n' % \
+            (objects[index].make_path(), error))
+        stream.flush()
+
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    _TASK = None
+
+  total = time.time() - start
+  def count(objects):
+    return sum([len(k) if isinstance(k, Batch) else 1 for k in objects])
+  videos = count(objects)
+
+  stream.write('Processed %d video(s), %d failed, using %d job(s) in %s\n' % \
+      (videos, count([k[0] for k in failures]), jobs,
+        datetime.timedelta(seconds=int(total))))
+  if total > 0:
+    stream.write('Throughput: %.2f videos/s, %.1f frames/s\n' % \
+        (videos/total, frames/total))
+  for obj, error in failures:
+    stream.write('Failed: %s\n' % obj.make_path())
+  stream.flush()
+
+  return failures
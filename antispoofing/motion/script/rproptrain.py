@@ -17,6 +17,7 @@ import bob
 import numpy
 import argparse
 from .. import ml
+from .. import storage
 import ConfigParser
 
 def main():
@@ -45,6 +46,36 @@ def main():
       dest='overwrite', default=False, help='If set and the destination directory exists, overwrite the results contained there')
   parser.add_argument('-V', '--verbose', action='store_true', dest='verbose',
       default=False, help='Increases this script verbosity')
+  parser.add_argument('-S', '--sampler', action='store_true', dest='sampler',
+      default=False, help='If set, draw the training samples with a class-balanced sampler. If the input directory was consolidated, the training set is not loaded in memory: samples are read directly from the memory-mapped store, and evaluations on the training set read it in chunks (only the position of every valid row is kept in memory). Otherwise, the whole training set is loaded, as without this option. Rows of reduced input files (see motion_coreset.py) are drawn with probabilities proportional to their weights.')
+  parser.add_argument('-s', '--seed', metavar='INT', type=int, dest='seed',
+      default=None, help='The seed for the random number generators of the class-balanced sampler and of the weight initialization with the numpy backend. By default, a new one is used at every run.')
+  parser.add_argument('-B', '--backend', dest='backend', default='bob',
+      choices=('bob', 'numpy'), help='The RProp implementation to use for training. Both produce the same kind of MLP machine (defaults to %(default)s)')
+  parser.add_argument('-F', '--float32', action='store_true', dest='float32',
+      default=False, help='If set, train in single precision (only with the numpy backend)')
+  parser.add_argument('-G', '--gradient-jobs', metavar='INT', type=int,
+      dest='gjobs', default=1, help='The number of processes calculating the derivatives of every mini-batch (only with the numpy backend). This speeds up trainings with large mini-batches. Defaults to %(default)s')
+  parser.add_argument('-r', '--restarts', metavar='INT', type=int,
+      dest='restarts', default=1, help='The number of MLPs to train, from different random initializations. Each is saved in a sub-directory of the output directory and the best one (see --select) is kept as the final result. All MLPs are trained with the class-balanced sampler (see --sampler), with seeds starting at --seed. Defaults to %(default)s')
+  parser.add_argument('-j', '--jobs', metavar='INT', type=int, dest='jobs',
+      default=1, help='The number of processes to use for training many MLPs at once. The data is loaded only once and shared between them. Defaults to %(default)s')
+  parser.add_argument('--select', dest='select', default='rmse',
+      choices=('rmse', 'hter'), help='The criterion used to select the best MLP amongst all restarts or sweep trials, measured on the development set (defaults to %(default)s)')
+  parser.add_argument('--sweep', metavar='GRID', type=str, dest='sweep',
+      default=None, help='Trains one MLP per point of the given parameter grid, like "hidden-neurons=5,10,20;batch-size=200,500;epoch=1,10", stopping the losing ones early. Parameters not in the grid are taken from the other options. Each MLP is saved in a sub-directory of the output directory, the results are ranked in "sweep.txt" and the best one (see --select) is kept as the final result. A maximum number of iterations is required.')
+  parser.add_argument('--min-iterations', metavar='INT', type=int,
+      dest='miniter', default=0, help='When sweeping, the number of iterations after which trials are compared for the first time. They are compared again every time their number of iterations is multiplied by --eta. By default, it is the maximum number of iterations divided by eta^3.')
+  parser.add_argument('-c', '--checkpoint-interval', metavar='SECONDS',
+      type=int, dest='checkpoint', default=600, help='The training state is saved to "checkpoint.npz" in the output directory at most every this number of seconds, so an interrupted training can be resumed with --resume. The file is removed once the training ends. A value of zero disables checkpoints. Defaults to %(default)s')
+  parser.add_argument('-R', '--resume', action='store_true', dest='resume',
+      default=False, help='If set and the output directory contains a checkpoint, continue the training from it. The same options (and output directory, without time interpolation) as for the interrupted run should be given. Training continues exactly as if it had not been interrupted only with the class-balanced sampler (see --sampler), whose state is saved in checkpoints.')
+  parser.add_argument('--evaluation-subset', metavar='INT', type=int,
+      dest='subsample', default=0, help='If set, the MLP is evaluated during training on a fixed random subset of (at most) this number of samples of each class of the training and development sets, which is much faster on large sets. The complete sets are still used every --full-evaluation-every evaluations, and the best MLP is only chosen on those. By default, the complete sets are always used.')
+  parser.add_argument('--full-evaluation-every', metavar='INT', type=int,
+      dest='fullevery', default=10, help='When evaluating on a subset, the number of evaluations between two evaluations on the complete sets. Defaults to %(default)s')
+  parser.add_argument('--eta', metavar='INT', type=int, dest='eta',
+      default=3, help='When sweeping, only the best 1/eta of the trials reaching each comparison point continue training. Defaults to %(default)s')
 
   # Adds database support using the common infrastructure
   # N.B.: Only databases with 'video' support
@@ -53,6 +84,50 @@ def main():
 
   args = parser.parse_args()
 
+  if args.float32 and args.backend != 'numpy':
+    parser.error("single precision training is only available with the numpy backend")
+
+  if args.gjobs <= 0:
+    parser.error("the number of gradient jobs has to be greater than zero")
+
+  if args.gjobs > 1 and args.backend != 'numpy':
+    parser.error("derivatives can only be calculated in parallel with the numpy backend")
+
+  if args.gjobs > 1 and args.jobs > 1 and \
+      (args.restarts > 1 or args.sweep is not None):
+    parser.error("derivatives cannot be calculated in parallel when training many MLPs at once - use either --jobs or --gradient-jobs")
+
+  if args.restarts <= 0:
+    parser.error("the number of restarts has to be greater than zero")
+
+  if args.jobs <= 0:
+    parser.error("the number of jobs has to be greater than zero")
+
+  if args.subsample < 0 or args.fullevery <= 0:
+    parser.error("the evaluation subset cannot be negative and full evaluations should happen at least every evaluation")
+
+  if args.checkpoint < 0:
+    parser.error("the checkpoint interval cannot be negative")
+
+  if args.resume and (args.restarts > 1 or args.sweep is not None):
+    parser.error("only single trainings can be resumed")
+
+  if args.resume and args.checkpoint == 0:
+    parser.error("checkpoints have to be enabled to resume a training")
+
+  if args.sweep is not None:
+    if args.restarts > 1:
+      parser.error("parameter sweeps and restarts cannot be combined")
+    if args.maxiter <= 0:
+      parser.error("a maximum number of iterations is required for parameter sweeps")
+    if args.eta < 2:
+      parser.error("eta should be at least 2")
+    if args.miniter <= 0: args.miniter = max(args.maxiter // args.eta**3, 1)
+    try:
+      configurations = ml.search.grid(args.sweep)
+    except RuntimeError, e:
+      parser.error(str(e))
+
   start_time = time.time()
   paramfile = ConfigParser.SafeConfigParser()
   paramfile.add_section('time')
@@ -67,7 +142,7 @@ def main():
   use_outputdir = use_outputdir % os.environ #interpolate environment
 
   if os.path.exists(use_outputdir):
-    if not args.overwrite:
+    if not (args.overwrite or args.resume):
       parser.error("output directory '%s' exists and the overwrite flag was not set" % use_outputdir)
   else:
     bob.db.utils.makedirs_safe(use_outputdir)
@@ -87,21 +162,101 @@ def main():
       'test' : dict(zip(('real', 'attack'), db.get_test_data())),
       }
   
-  def merge_data(flist):
-    d = bob.io.load([k.make_path(use_inputdir[0], '.hdf5') for k in flist])
-    return d[~numpy.isnan(d.sum(axis=1)),:]
+  # uses the consolidated store, if one is available
+  store = storage.open_store(use_inputdir[0])
+  if args.verbose and store is not None:
+    print "Using consolidated store with %d file(s)" % len(store)
+
+  def merge_data(flist, copy=True):
+    return storage.merge_valid([k.make_path(use_inputdir[0], '.hdf5') for k in flist], store, copy)
+
+  train_files = dict(data['train'])
+
+  # with the class-balanced sampler, the training set is not loaded: it is
+  # read from the memory-mapped store, if one is available
+  sampled = args.sampler or args.restarts > 1 or args.sweep is not None
 
   for key in data.keys():
     for cls in data[key].keys():
       if args.verbose: print "Loading %-5s/%-6s:" % (key, cls),
-      data[key][cls] = merge_data(data[key][cls])
+      data[key][cls] = merge_data(data[key][cls],
+          copy=(key != 'train' or not sampled))
       if args.verbose: print len(data[key][cls])
 
-  if args.verbose: print "Training MLP..."
-  mlp, evolution = ml.rprop.make_mlp((data['train']['real'],
-    data['train']['attack']), (data['devel']['real'], data['devel']['attack']),
-    args.batch, args.nhidden, args.epoch, args.maxiter, args.noimprov,
-    args.verbose)
+  def make_shuffler(seed):
+    def shuffler(train, target):
+      # rows of reduced files are drawn according to their weights
+      weights = [storage.merge_weights([k.make_path(use_inputdir[0], '.hdf5') for k in train_files[cls]]) for cls in ('real', 'attack')]
+      if weights[0] is None and weights[1] is None: weights = None
+      return ml.sampler.Sampler(train, target, seed, weights=weights)
+    return shuffler
+
+  shuffler = None
+  if args.sampler: shuffler = make_shuffler(args.seed)
+
+  train = (data['train']['real'], data['train']['attack'])
+  devel = (data['devel']['real'], data['devel']['attack'])
+  dtype = 'float32' if args.float32 else 'float64'
+
+  if args.sweep is not None:
+    if args.verbose: print "Sweeping %d configuration(s) using %d job(s), comparing trials at iteration(s) %s..." % (len(configurations), args.jobs, ', '.join([str(k) for k in ml.search.rungs(args.miniter, args.maxiter, args.eta)]) or 'none')
+    results = ml.search.sweep(train, devel, configurations, use_outputdir,
+        args.miniter, args.eta, args.jobs, args.seed, args.select,
+        args.verbose, make_shuffler, batch_size=args.batch,
+        nhidden=args.nhidden, epoch=args.epoch, max_iter=args.maxiter,
+        no_improvements=args.noimprov, verbose=args.verbose,
+        backend=args.backend, dtype=dtype, subsample=args.subsample,
+        full_every=args.fullevery, gradient_jobs=args.gjobs)
+    chosen = results[0]
+
+    f = open(os.path.join(use_outputdir, 'sweep.txt'), 'wt')
+    ml.search.write_table(results, f, ml.search.SWEEP_COLUMNS, chosen)
+    f.close()
+    if args.verbose:
+      ml.search.write_table(results, sys.stdout, ml.search.SWEEP_COLUMNS,
+          chosen)
+      print "Selected trial %d (by devel %s), saved at `%s'" % \
+          (chosen['trial'], args.select.upper(), chosen['directory'])
+
+    args.batch = chosen['batch_size']
+    args.epoch = chosen['epoch']
+    mlp, evolution = ml.search.load(chosen['directory'], train, devel)
+
+  elif args.restarts > 1:
+    if args.verbose: print "Training %d MLPs using %d job(s)..." % (args.restarts, args.jobs)
+    results = ml.search.restarts(train, devel, args.restarts, use_outputdir,
+        args.jobs, args.seed, args.verbose, make_shuffler,
+        batch_size=args.batch,
+        nhidden=args.nhidden, epoch=args.epoch, max_iter=args.maxiter,
+        no_improvements=args.noimprov, verbose=args.verbose,
+        backend=args.backend, dtype=dtype, subsample=args.subsample,
+        full_every=args.fullevery, gradient_jobs=args.gjobs)
+    chosen = ml.search.best(results, args.select)
+
+    f = open(os.path.join(use_outputdir, 'restarts.txt'), 'wt')
+    ml.search.write_table(results, f, ml.search.RESTART_COLUMNS, chosen)
+    f.close()
+    if args.verbose:
+      ml.search.write_table(results, sys.stdout, ml.search.RESTART_COLUMNS,
+          chosen)
+      print "Selected restart %d (by devel %s), saved at `%s'" % \
+          (chosen['restart'], args.select.upper(), chosen['directory'])
+
+    mlp, evolution = ml.search.load(chosen['directory'], train, devel)
+
+  else:
+    checkpoint = None
+    if args.checkpoint > 0:
+      checkpoint = os.path.join(use_outputdir, 'checkpoint.npz')
+
+    if args.verbose: print "Training MLP..."
+    mlp, evolution = ml.rprop.make_mlp(train, devel, args.batch,
+        args.nhidden, args.epoch, args.maxiter, args.noimprov, args.verbose,
+        shuffler, args.backend, dtype, args.seed, checkpoint=checkpoint,
+        checkpoint_interval=args.checkpoint, resume=args.resume,
+        subsample=args.subsample, full_every=args.fullevery,
+        history=os.path.join(use_outputdir, ml.search.HISTORY),
+        gradient_jobs=args.gjobs)
 
   if args.verbose: print "Saving session information..."
   def get_version(package):
@@ -131,6 +286,16 @@ def main():
   paramfile.set('mlp', 'batch-size', str(args.batch))
   paramfile.set('mlp', 'epoch-size', str(args.epoch))
   paramfile.set('mlp', 'maximum-iterations', str(args.maxiter))
+  paramfile.set('mlp', 'backend', args.backend)
+  if args.restarts > 1:
+    paramfile.set('mlp', 'restarts', str(args.restarts))
+    paramfile.set('mlp', 'selected-restart', str(chosen['restart']))
+    paramfile.set('mlp', 'seed', str(chosen['seed']))
+  if args.sweep is not None:
+    paramfile.set('mlp', 'sweep', args.sweep)
+    paramfile.set('mlp', 'sweep-trials', str(len(results)))
+    paramfile.set('mlp', 'selected-trial', str(chosen['trial']))
+    paramfile.set('mlp', 'seed', str(chosen['seed']))
   
   if args.verbose: print "Saving MLP..."
   mlpfile = bob.io.HDF5File(os.path.join(use_outputdir, 'mlp.hdf5'),'w')
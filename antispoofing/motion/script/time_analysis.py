@@ -13,6 +13,7 @@ import bob
 import numpy
 import argparse
 from .. import ml
+from .. import storage
 
 def write_table(title, analyzer, file, args):
 
@@ -35,9 +36,9 @@ def write_table(title, analyzer, file, args):
   
   analyzer.write_table(file, instantaneous=False)
 
-def get_parameters(f):
+def get_parameters(f, store=None):
 
-  scores = bob.io.load(f)
+  scores = storage.load(f, store)
   good = scores[~numpy.isnan(scores)]
   lscores = list(scores)
   first_detection = lscores.index(good[0])
@@ -84,6 +85,10 @@ def main():
     bob.db.utils.makedirs_safe(args.outputdir)
 
   db = args.cls(args)
+
+  # uses the consolidated store, if one is available
+  store = storage.open_store(args.inputdir)
+
   devel = dict(zip(('real', 'attack'), db.get_devel_data()))
   test = dict(zip(('real', 'attack'), db.get_test_data()))
 
@@ -94,23 +99,23 @@ def main():
   test['attack'] = [k.make_path(args.inputdir, '.hdf5') for k in test['attack']]
 
   # finds out window-size and overlap
-  args.windowsize, args.overlap = get_parameters(devel['real'][0])
+  args.windowsize, args.overlap = get_parameters(devel['real'][0], store)
   if args.verbose:
     print "Discovered parameters:"
     print " * window-size: %d" % args.windowsize
     print " * overlap    : %d" % args.overlap
 
   # try a match with the next file, just to make sure
-  windowsize2, overlap2 = get_parameters(devel['real'][1])
+  windowsize2, overlap2 = get_parameters(devel['real'][1], store)
   if args.windowsize != windowsize2 or args.overlap != overlap2:
     raise RuntimeError, "A possible misdetection of windowsize and overlap occurred between files '%s' and '%s'. The first detection showed a window-size/overlap of %d/%d while the second, %d/%d. You will have to edit this script and set these values by hand" % (devel['real'][0], devel['real'][1], args.windowsize, args.overlap, windowsize2, overlap2)
 
   # quickly load the development set and establish the threshold:
   thres = ml.time.eval_threshold(devel['real'], devel['attack'],
-      args.minhter, args.verbose)
+      args.minhter, args.verbose, store)
 
   analyzer = ml.time.Analyzer(test['real'], test['attack'], thres, 
-      args.windowsize, args.overlap, args.average, args.verbose)
+      args.windowsize, args.overlap, args.average, args.verbose, store)
 
   outfile = os.path.join(args.outputdir, 'time-analysis-table.rst')
 
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Reading and writing of per-video feature files.
+
+Clustered quantities (see :py:func:`antispoofing.motion.cluster_5quantities`)
+only contain data at the end of every window, all other rows being NaN. Next
+to the dense format, in which the whole array is saved, we support a sparse
+format that only keeps the rows with data, together with their indexes. It
+is an HDF5 file containing:
+
+index
+  A 1D array of integers with the positions of the rows with data
+
+features
+  A 2D array of floats containing the rows with data
+
+length
+  The total number of rows in the original (dense) array
+
+Reduced files (see :py:mod:`antispoofing.motion.ml.coreset`) are sparse files
+that only keep some of the rows with data and also contain:
+
+weights
+  A 1D array of floats with the number of original rows each kept row
+  stands for
+
+All readers in this module understand both formats.
+
+The files of a whole processing stage can also be consolidated in a single
+store (see :py:func:`consolidate`), saved next to them. It is made of a
+``.npy`` file with the rows of all videos, one after the other, and a text
+index with one line per video::
+
+  <path> <offset> <length> <group> <class>
+
+Videos are ordered by group and class, so that the rows of a whole group and
+class are contiguous. The data file is memory-mapped, so loading the data for
+a video (or a sequence of consecutive videos) is a zero-copy slice.
+"""
+
+import os
+import numpy
+
+STORE_DATA = 'store.npy'
+STORE_INDEX = 'store.txt'
+
+def sparsify(data):
+  """Returns a tuple ``(index, features)`` containing the positions and values
+  of the rows of a 2D array that are not completely made of NaNs"""
+
+  index = numpy.where(~numpy.isnan(data).all(axis=1))[0]
+  return index, data[index]
+
+def densify(index, features, length):
+  """Re-creates the dense array from its sparse representation"""
+
+  retval = numpy.ndarray((length, features.shape[1]), dtype=features.dtype)
+  retval[:] = numpy.NaN
+  retval[index] = features
+  return retval
+
+def save_sparse(data, filename):
+  """Saves the 2D array in the given file using the sparse format"""
+  import bob
+
+  index, features = sparsify(data)
+
+  f = bob.io.HDF5File(filename, 'w')
+  f.set('index', index.astype('int64'))
+  f.set('features', features)
+  f.set('length', data.shape[0])
+  del f
+
+def save_weighted(data, filename):
+  """Saves a reduced array in the sparse format, with the weight of every
+  row. ``data`` is a tuple ``(index, features, length, weights)``."""
+  import bob
+
+  index, features, length, weights = data
+
+  f = bob.io.HDF5File(filename, 'w')
+  f.set('index', numpy.asarray(index, dtype='int64'))
+  f.set('features', features)
+  f.set('length', length)
+  f.set('weights', numpy.asarray(weights, dtype='float64'))
+  del f
+
+def load_weights(filename):
+  """Returns the weights of the rows returned by :py:func:`load_valid` for a
+  file saved with :py:func:`save_weighted`, or ``None`` for other files"""
+  import bob
+
+  f = bob.io.HDF5File(filename, 'r')
+  if not f.has_key('weights'): return None
+  return f.read('weights')
+
+def merge_weights(filenames, store=None):
+  """Returns the weights of the rows returned by :py:func:`merge_valid`, or
+  ``None`` if none of the files has weights. Rows of files without weights
+  have a weight of 1."""
+
+  weights = [load_weights(k) for k in filenames]
+  if all([k is None for k in weights]): return None
+
+  for i, k in enumerate(weights):
+    if k is None:
+      weights[i] = numpy.ones((len(load_valid(filenames[i], store)),),
+          dtype='float64')
+
+  return numpy.hstack(weights + [numpy.ndarray((0,), dtype='float64')])
+
+def is_sparse(filename):
+  """Tells if the given file is in the sparse format"""
+  import bob
+
+  return bob.io.HDF5File(filename, 'r').has_key('index')
+
+def load_sparse(filename):
+  """Returns a tuple ``(index, features, length)`` with the contents of a
+  file in the sparse format. Dense files are converted on the fly."""
+  import bob
+
+  f = bob.io.HDF5File(filename, 'r')
+
+  if not f.has_key('index'):
+    del f
+    data = bob.io.load(filename)
+    index, features = sparsify(data)
+    return index, features, data.shape[0]
+
+  return f.read('index'), f.read('features'), int(f.read('length'))
+
+def shape(filename):
+  """Returns the shape of the dense array in the given file, in any format"""
+  import bob
+
+  f = bob.io.HDF5File(filename, 'r')
+  if f.has_key('index'):
+    return int(f.read('length')), f.read('features').shape[1]
+  del f
+  return tuple(bob.io.peek(filename)[1])
+
+def load(filename, store=None):
+  """Loads the dense array contained in the given file, in any format. If a
+  :py:class:`Store` containing the file is given, read it from there
+  instead."""
+  if store is not None and filename in store: return store.load(filename)
+
+  import bob
+  if is_sparse(filename): return densify(*load_sparse(filename))
+  return bob.io.load(filename)
+
+def load_valid(filename, store=None):
+  """Loads only the rows of the array in the given file that contain no
+  NaNs. If a :py:class:`Store` containing the file is given, read it from
+  there instead."""
+  import bob
+
+  if store is not None and filename in store: d = store.load(filename)
+  elif is_sparse(filename): d = load_sparse(filename)[1]
+  else: d = bob.io.load(filename)
+  return d[~numpy.isnan(d.sum(axis=1)),:]
+
+def merge_valid(filenames, store=None, copy=True):
+  """Loads and concatenates the rows with no NaNs from all given files. If a
+  :py:class:`Store` containing all files is given, read them from there
+  instead. In that case, if ``copy`` is not set, the rows are not loaded:
+  a :py:class:`Rows` view of the memory-mapped store is returned."""
+
+  if store is not None and all([k in store for k in filenames]):
+    if not copy: return store.valid_rows(filenames)
+    d = store.rows(filenames)
+    return d[~numpy.isnan(d.sum(axis=1)),:]
+
+  return numpy.vstack([load_valid(k) for k in filenames])
+
+def _key(filename, directory):
+  """Returns the path of a file relative to the given directory, without
+  extension"""
+
+  return os.path.relpath(os.path.splitext(os.path.abspath(filename))[0],
+      directory)
+
+def consolidate(directory, entries, verbose=False):
+  """Consolidates per-video files in a single store.
+
+  The data is copied into a memory-mapped file, so no more than one video is
+  kept in memory at any time. The store is written atomically, next to the
+  consolidated files.
+
+  Keyword Parameters:
+
+  directory
+    The base directory of the files to consolidate, where the store will be
+    saved
+
+  entries
+    A list of tuples ``(group, class, filenames)``, where ``filenames`` is a
+    list of the files (in any format) to include in the store. Files are
+    stored in the given order.
+
+  verbose
+    If set, prints the progress
+
+  Returns the total number of rows in the store.
+  """
+
+  directory = os.path.abspath(directory)
+
+  index = []
+  total = 0
+  width = None
+  for group, cls, filenames in entries:
+    for filename in filenames:
+      length, columns = shape(filename)
+      if width is None: width = columns
+      elif columns != width:
+        raise RuntimeError, "file `%s' has %d columns while previous files have %d - they cannot be consolidated" % (filename, columns, width)
+      index.append((filename, total, length, group, cls))
+      total += length
+
+  if width is None:
+    raise RuntimeError, "no files to consolidate in `%s'" % directory
+
+  datafile = os.path.join(directory, STORE_DATA)
+  indexfile = os.path.join(directory, STORE_INDEX)
+  tmpdata = '%s.tmp%d.npy' % (os.path.splitext(datafile)[0], os.getpid())
+  tmpindex = '%s.tmp%d' % (indexfile, os.getpid())
+
+  try:
+    data = numpy.lib.format.open_memmap(tmpdata, mode='w+', dtype='float64',
+        shape=(total, width))
+
+    for i, (filename, offset, length, group, cls) in enumerate(index):
+      if verbose:
+        print "Consolidating file %s [%d/%d]..." % (filename, i+1, len(index))
+      data[offset:offset+length] = load(filename)
+
+    data.flush()
+    del data
+
+    f = open(tmpindex, 'wt')
+    for filename, offset, length, group, cls in index:
+      f.write('%s %d %d %s %s\n' % (_key(filename, directory), offset, length,
+        group, cls))
+    f.close()
+
+    # the index tells if a store exists: an old one is removed before the data
+    # is replaced and the new one is only installed after it
+    if os.path.exists(indexfile): os.unlink(indexfile)
+    os.rename(tmpdata, datafile)
+    os.rename(tmpindex, indexfile)
+
+  finally:
+    for k in (tmpdata, tmpindex):
+      if os.path.exists(k): os.unlink(k)
+
+  return total
+
+def open_store(directory):
+  """Returns the :py:class:`Store` in the given directory or ``None``, if
+  the files in that directory were not consolidated"""
+
+  if not os.path.exists(os.path.join(directory, STORE_INDEX)): return None
+  return Store(directory)
+
+class Store(object):
+  """A consolidated store for the per-video files of a processing stage.
+
+  Files are looked-up using the same paths one would use to read them
+  individually, e.g. ``obj.make_path(directory, '.hdf5')``. All arrays
+  returned are read-only views of the memory-mapped data.
+  """
+
+  def __init__(self, directory):
+
+    self.directory = os.path.abspath(directory)
+    self.data = numpy.load(os.path.join(self.directory, STORE_DATA),
+        mmap_mode='r')
+
+    self.index = {}
+    self.groups = {}
+    for line in open(os.path.join(self.directory, STORE_INDEX), 'rt'):
+      line = line.strip()
+      if not line: continue
+      key, offset, length, group, cls = line.rsplit(' ', 4)
+      offset, length = int(offset), int(length)
+      self.index[key] = (offset, length)
+      start, stop = self.groups.get((group, cls), (offset, offset))
+      self.groups[(group, cls)] = (min(start, offset), max(stop, offset+length))
+
+  def key(self, filename):
+    """Returns the key in the index for the given filename"""
+
+    return _key(filename, self.directory)
+
+  def __contains__(self, filename):
+    return self.key(filename) in self.index
+
+  def __len__(self):
+    return len(self.index)
+
+  def load(self, filename):
+    """Returns the dense array for the given file"""
+
+    offset, length = self.index[self.key(filename)]
+    return self.data[offset:offset+length]
+
+  def group(self, group, cls):
+    """Returns all rows for the given group and class"""
+
+    start, stop = self.groups[(group, cls)]
+    return self.data[start:stop]
+
+  def rows(self, filenames):
+    """Returns the rows of all given files, concatenated.
+
+    If the files are consecutive in the store, this is a zero-copy slice.
+    Otherwise, the rows are gathered in a single pass over the data.
+    """
+
+    ranges = [self.index[self.key(k)] for k in filenames]
+    if not ranges: return self.data[0:0]
+
+    contiguous = True
+    for (o1, l1), (o2, l2) in zip(ranges[:-1], ranges[1:]):
+      if o1 + l1 != o2:
+        contiguous = False
+        break
+
+    if contiguous:
+      return self.data[ranges[0][0]:ranges[-1][0]+ranges[-1][1]]
+
+    select = numpy.hstack([numpy.arange(o, o+l) for o, l in ranges])
+    return numpy.take(self.data, select, axis=0)
+
+  def valid_rows(self, filenames, chunk_size=65536):
+    """Returns a :py:class:`Rows` view of the rows of all given files that
+    contain no NaNs. The data is scanned once, ``chunk_size`` rows at a
+    time, but never loaded as a whole."""
+
+    index = []
+    for offset, length in [self.index[self.key(k)] for k in filenames]:
+      for start in range(offset, offset+length, chunk_size):
+        block = self.data[start:min(start+chunk_size, offset+length)]
+        index.append(numpy.where(~numpy.isnan(block.sum(axis=1)))[0] + start)
+
+    return Rows(self.data,
+        numpy.hstack(index + [numpy.ndarray((0,), dtype='int64')]))
+
+class Rows(object):
+  """A read-only view of some rows of a (memory-mapped) 2D array.
+
+  Only the positions of the rows are kept in memory. Rows are read when
+  they are accessed, by slicing or indexing (which return arrays), or with
+  ``numpy.take``, so the view can be used in place of an array by
+  :py:class:`antispoofing.motion.ml.sampler.Sampler` and
+  :py:class:`antispoofing.motion.ml.rprop.Analyzer`.
+  """
+
+  def __init__(self, data, index):
+
+    self.data = data
+    self.index = numpy.asarray(index, dtype='int64')
+    self.shape = (len(self.index),) + data.shape[1:]
+    self.dtype = data.dtype
+
+  def __len__(self):
+    return len(self.index)
+
+  def __getitem__(self, key):
+    if isinstance(key, (int, long, numpy.integer)):
+      return self.data[self.index[key]]
+    return numpy.take(self.data, self.index[key], axis=0)
+
+  def take(self, indices, axis=0, out=None, mode='raise'):
+    """Reads the given rows, like ``numpy.take``"""
+
+    if axis != 0:
+      raise RuntimeError, "rows can only be taken along the first axis"
+    return numpy.take(self.data, self.index.take(indices, mode=mode), axis=0,
+        out=out)